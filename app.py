@@ -1,17 +1,52 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Request, Response, render_template, request, jsonify, url_for
 import os
+import threading
+from tempfile import SpooledTemporaryFile
 from werkzeug.utils import secure_filename
-from social_media import SocialMediaPoster
+from social_media import SocialMediaPoster, MAX_IMAGES
+from jobs import JobQueue, JobWorkers
+from metrics import shared_metrics
+
+class UploadRequest(Request):
+    """Keeps uploaded files in memory, spooling to a temp file only above UPLOAD_SPOOL_SIZE"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return SpooledTemporaryFile(max_size=app.config['UPLOAD_SPOOL_SIZE'], mode='rb+')
 
 app = Flask(__name__)
-app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.request_class = UploadRequest
+app.config['MAX_CONTENT_LENGTH'] = MAX_IMAGES * 16 * 1024 * 1024  # 16MB per image
+app.config['UPLOAD_SPOOL_SIZE'] = int(os.getenv('UPLOAD_SPOOL_SIZE', 8 * 1024 * 1024))
+app.config['POST_WORKERS'] = int(os.getenv('POST_WORKERS', 2))
+
+# Stage timings and counters for /metrics; METRICS_ENABLED=0 turns them off
+if os.getenv('METRICS_ENABLED', '1') not in ('0', 'false', 'no'):
+    shared_metrics().enable()
+
+# Initialize the social media poster; the same post submitted again within
+# DEDUPE_WINDOW seconds (e.g. after a client timeout) isn't sent twice
+poster = SocialMediaPoster(dedupe_window=float(os.getenv('DEDUPE_WINDOW', 600)))
 
-# Ensure upload directory exists
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+# Posts are queued and sent by background workers, so /post returns at once.
+# They start with the first request rather than on import, so the debug
+# reloader's watcher process and scripts importing app don't run workers too
+job_queue = None
+workers = None
+_workers_lock = threading.Lock()
 
-# Initialize the social media poster
-poster = SocialMediaPoster()
+def start_workers() -> JobQueue:
+    """Open the job queue and start the post workers, once per process"""
+    global job_queue, workers
+    with _workers_lock:
+        if workers is None:
+            job_queue = JobQueue()
+            workers = JobWorkers(job_queue, poster, workers=app.config['POST_WORKERS'])
+            workers.start()
+    return job_queue
+
+@app.before_request
+def ensure_workers():
+    start_workers()
 
 @app.route('/')
 def index():
@@ -29,56 +64,64 @@ def post():
         if not platforms:
             return jsonify({'error': 'Please select at least one platform (Bluesky or Mastodon)'})
 
-        results = {}
-        
-        # Handle image upload if present
-        if 'image' in request.files:
-            file = request.files['image']
-            if file.filename:
-                filename = secure_filename(file.filename)
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
-                
-                results = poster.post_image(
-                    text=text,
-                    image_path=filepath,
-                    platforms=platforms
-                )
-                
-                # Clean up uploaded file
-                os.remove(filepath)
-                
+        payload = {'text': text, 'platforms': platforms}
+        idempotency_key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key')
+        if idempotency_key:
+            payload['idempotency_key'] = idempotency_key
+        images = []
+
+        # Handle image uploads if present
+        files = [file for file in request.files.getlist('image') if file and file.filename]
+        if len(files) > MAX_IMAGES:
+            return jsonify({'error': f'Please choose at most {MAX_IMAGES} images'})
+        if files:
+            payload['filenames'] = [secure_filename(file.filename) for file in files]
+            payload['alt_texts'] = request.form.getlist('alt_text')
+            # Copied from the upload streams into the queue, large ones to files beside it
+            images = [file.stream for file in files]
+
         # Handle link if present
         elif request.form.get('link'):
-            results = poster.post_link(
-                text=text,
-                url=request.form['link'],
-                platforms=platforms
-            )
-            
-        # Handle text-only post
-        else:
-            results = poster.post_text(
-                text=text,
-                platforms=platforms
-            )
-
-        # Process results
-        success = []
-        errors = []
-        for platform, result in results.items():
-            if 'error' in result:
-                errors.append(f"{platform}: {result['error']}")
-            else:
-                success.append(platform)
-
-        return jsonify({
-            'success': success,
-            'errors': errors
-        })
+            payload['link'] = request.form['link']
+
+        # Long text is split into a reply chain only when asked for
+        elif request.form.get('thread'):
+            payload['thread'] = True
+
+        job_id = job_queue.enqueue(payload, images)
+        status_url = url_for('job_status', job_id=job_id)
+        return jsonify({'job_id': job_id, 'status': 'queued', 'status_url': status_url}), 202, {'Location': status_url}
 
     except Exception as e:
         return jsonify({'error': str(e)})
 
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'No such job'}), 404
+
+    # Process results
+    success = []
+    errors = []
+    for platform, result in (job['results'] or {}).items():
+        if 'error' in result:
+            errors.append(f"{platform}: {result['error']}")
+        else:
+            success.append(platform)
+    if job['error']:
+        errors.append(job['error'])
+
+    job.update(success=success, errors=errors)
+    return jsonify(job)
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(poster.image_cache.stats())
+
+@app.route('/metrics')
+def metrics():
+    return Response(shared_metrics().render(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     app.run(debug=True) 
\ No newline at end of file
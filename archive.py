@@ -0,0 +1,319 @@
+"""Local archive of the posts each account already has, kept in sync with the platforms
+
+The first sync pages back through an account's whole feed; later syncs
+fetch only posts newer than the ones archived, and an interrupted first
+sync carries on from its last cursor. Each page is written as it arrives,
+so memory use doesn't grow with the size of the account. Usage:
+
+    python archive.py sync [--platform bluesky]
+    python archive.py find "Text of a post" [--link https://...]
+"""
+import os
+import sys
+import time
+import sqlite3
+import hashlib
+import logging
+import argparse
+import threading
+from html.parser import HTMLParser
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ARCHIVE_PATH = '.post_archive.sqlite3'
+
+
+@dataclass
+class ArchivedPost:
+    """One of an account's posts, as kept in the archive"""
+    platform: str
+    uri: str
+    # Sortable id the platform pages by (Mastodon status id, Bluesky record key)
+    post_id: str
+    url: Optional[str]
+    text: str
+    created_at: Optional[str] = None
+
+
+@dataclass
+class FeedPage:
+    """Posts from one request for an account's feed, and the cursor for the next (older) page"""
+    posts: List[ArchivedPost]
+    cursor: Optional[str]
+
+
+@dataclass
+class SyncReport:
+    """What one sync of one account did"""
+    pages: int = 0
+    new: int = 0
+    # Whether the archive reaches back to the account's first post
+    complete: bool = False
+    error: Optional[str] = None
+
+
+def content_hash(text: str) -> str:
+    """Hash of a post's text with whitespace normalised, as posts are looked up by"""
+    return hashlib.sha256(' '.join(text.split()).encode()).hexdigest()
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.parts: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'br':
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag == 'p':
+            self.parts.append('\n\n')
+
+    def handle_data(self, data):
+        self.parts.append(data)
+
+
+def html_text(content: str) -> str:
+    """Plain text of a Mastodon status' HTML content, with links as their full URLs"""
+    # Mastodon shortens link text with hidden spans; their text is kept, so the URL is whole
+    extractor = _TextExtractor()
+    extractor.feed(content)
+    extractor.close()
+    return ''.join(extractor.parts).strip()
+
+
+class PostArchive:
+    """Posts of every synced account, stored in SQLite
+
+    Posts are keyed by (platform, uri) and indexed by content hash, so
+    finding where a text was already posted costs one index lookup however
+    many posts are archived. Sync progress is kept per account alongside.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv('POST_ARCHIVE', DEFAULT_ARCHIVE_PATH)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS archived_posts (
+                platform TEXT NOT NULL,
+                uri TEXT NOT NULL,
+                post_id TEXT NOT NULL,
+                url TEXT,
+                text TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                created_at TEXT,
+                synced_at REAL NOT NULL,
+                PRIMARY KEY (platform, uri)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS archived_posts_content ON archived_posts (content_hash);
+            CREATE TABLE IF NOT EXISTS sync_state (
+                platform TEXT NOT NULL,
+                account TEXT NOT NULL,
+                newest TEXT,  -- post_id of the newest post archived
+                cursor TEXT,  -- where the first sync of the account's older posts got to
+                complete INTEGER NOT NULL DEFAULT 0,
+                synced_at REAL,
+                PRIMARY KEY (platform, account)
+            );
+        ''')
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def state(self, platform: str, account: str) -> Tuple[Optional[str], Optional[str], bool]:
+        """(newest post_id, backfill cursor, whether the backfill is complete) for an account"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT newest, cursor, complete FROM sync_state WHERE platform = ? AND account = ?',
+                (platform, account)
+            ).fetchone()
+        return (row[0], row[1], bool(row[2])) if row else (None, None, False)
+
+    def store_page(self, platform: str, account: str, posts: List[ArchivedPost],
+                   newest: Optional[str] = None, cursor: Optional[str] = None,
+                   complete: Optional[bool] = None):
+        """Archive posts and record the sync's progress in one transaction
+
+        newest, cursor and complete update the account's sync state where
+        given; posts already archived are updated in place.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute('BEGIN')
+            try:
+                self._db.executemany(
+                    'INSERT INTO archived_posts VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT (platform, uri) DO UPDATE SET url = excluded.url, text = excluded.text, '
+                    'content_hash = excluded.content_hash, synced_at = excluded.synced_at',
+                    [(post.platform, post.uri, post.post_id, post.url, post.text, content_hash(post.text),
+                      post.created_at, now) for post in posts]
+                )
+                self._db.execute(
+                    'INSERT INTO sync_state (platform, account, synced_at) VALUES (?, ?, ?) '
+                    'ON CONFLICT (platform, account) DO UPDATE SET synced_at = excluded.synced_at',
+                    (platform, account, now)
+                )
+                if newest is not None:
+                    self._db.execute('UPDATE sync_state SET newest = ? WHERE platform = ? AND account = ?',
+                                     (newest, platform, account))
+                if cursor is not None or complete:
+                    self._db.execute(
+                        'UPDATE sync_state SET cursor = ?, complete = ? WHERE platform = ? AND account = ?',
+                        (None if complete else cursor, int(bool(complete)), platform, account)
+                    )
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+
+    def find(self, text: str, link: Optional[str] = None) -> Dict[str, Dict[str, Optional[str]]]:
+        """Where text was already posted: {platform: {'uri', 'url'}} of the newest match on each
+
+        With link, posts of the text followed by the link (as link posts are
+        made on platforms without link cards) match too.
+        """
+        hashes = [content_hash(text)]
+        if link:
+            hashes.append(content_hash(f"{text}\n\n{link}"))
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT platform, uri, url FROM archived_posts "
+                f"WHERE content_hash IN ({','.join('?' * len(hashes))}) ORDER BY created_at", hashes
+            ).fetchall()
+        return {platform: {'uri': uri, 'url': url} for platform, uri, url in rows}
+
+    def count(self, platform: Optional[str] = None) -> int:
+        """Number of posts archived, for one platform or all"""
+        with self._lock:
+            if platform:
+                return self._db.execute('SELECT COUNT(*) FROM archived_posts WHERE platform = ?',
+                                        (platform,)).fetchone()[0]
+            return self._db.execute('SELECT COUNT(*) FROM archived_posts').fetchone()[0]
+
+
+def newer(post_id: str, than: str) -> bool:
+    """Whether post_id is of a later post than `than`
+
+    Mastodon ids are decimal numbers of growing length and Bluesky record
+    keys are fixed-length timestamps, so ordering by length and then by
+    text orders both.
+    """
+    return (len(post_id), post_id) > (len(than), than)
+
+
+def sync_account(adapter, archive: PostArchive, rate_limiter) -> SyncReport:
+    """Bring the archive up to date with one platform account
+
+    Posts newer than the newest archived are fetched first, page by page
+    from the newest down until a page reaches that post. newest only moves
+    once they are all stored, so a run interrupted partway fetches the same
+    posts again rather than leaving a gap below them. Then, unless an
+    earlier sync already got there, older pages are fetched from where the
+    last one stopped back to the account's first post. Every page is stored
+    with the cursor after it before the next one is requested. A page may
+    hold no posts (every item was a repost) and the feed still go on: only
+    a page without a cursor ends it.
+    """
+    # Identifies the account, as it does for rate limits
+    account = adapter.rate_limit_key
+    newest, cursor, complete = archive.state(adapter.name, account)
+    report = SyncReport()
+
+    def fetch(cursor, since=None) -> FeedPage:
+        report.pages += 1
+        return rate_limiter.call(adapter, adapter.feed_page, cursor, since, read=True)
+
+    if newest is not None or complete:
+        page_cursor = None
+        latest = None
+        while True:
+            page = fetch(page_cursor, newest)
+            fresh = []
+            for post in page.posts:
+                if newest is not None and not newer(post.post_id, newest):
+                    break
+                fresh.append(post)
+            if latest is None and fresh:
+                latest = fresh[0].post_id
+            archive.store_page(adapter.name, account, fresh)
+            report.new += len(fresh)
+            if len(fresh) < len(page.posts) or not page.cursor:
+                break
+            page_cursor = page.cursor
+        if latest is not None:
+            # Only once every newer post is stored, so an interrupted run fetches them again
+            archive.store_page(adapter.name, account, [], newest=latest)
+
+    while not complete:
+        page = fetch(cursor)
+        cursor = page.cursor
+        complete = not cursor
+        # The first page of the first sync holds the newest post
+        first = page.posts[0].post_id if newest is None and page.posts else None
+        newest = newest or first
+        archive.store_page(adapter.name, account, page.posts, newest=first, cursor=cursor, complete=complete)
+        report.new += len(page.posts)
+    report.complete = True
+    return report
+
+
+def sync_feeds(poster, archive: Optional[PostArchive] = None,
+               platforms: Optional[List[str]] = None) -> Dict[str, SyncReport]:
+    """Sync the archive with each platform's account, all platforms at once
+
+    Calls go through the poster's rate limiter. A platform that fails is
+    reported with its error and keeps what was synced before the failure.
+    """
+    archive = archive if archive is not None else PostArchive()
+    platforms = platforms if platforms is not None else poster.available_platforms()
+
+    def run(platform):
+        try:
+            return sync_account(poster._adapter(platform), archive, poster.rate_limiter)
+        except Exception as e:
+            logger.warning(f"Syncing {platform} failed: {e}")
+            return SyncReport(error=str(e))
+
+    with ThreadPoolExecutor(max_workers=max(len(platforms), 1), thread_name_prefix='feed-sync') as executor:
+        return dict(zip(platforms, executor.map(run, platforms)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--archive', help=f'archive file (default: POST_ARCHIVE or {DEFAULT_ARCHIVE_PATH})')
+    commands = parser.add_subparsers(dest='command', required=True)
+    sync = commands.add_parser('sync', help="fetch the accounts' new posts")
+    sync.add_argument('--platform', action='append', help='sync only this platform')
+    find = commands.add_parser('find', help='show where a text was already posted')
+    find.add_argument('text')
+    find.add_argument('--link')
+    args = parser.parse_args()
+
+    archive = PostArchive(args.archive)
+    if args.command == 'find':
+        found = archive.find(args.text, args.link)
+        for platform, post in found.items():
+            print(f"{platform}: {post['url'] or post['uri']}")
+        return 0 if found else 1
+
+    from social_media import SocialMediaPoster
+    with SocialMediaPoster() as poster:
+        reports = sync_feeds(poster, archive, args.platform)
+    for platform, report in reports.items():
+        if report.error:
+            print(f"✗ {platform}: {report.error}")
+        else:
+            print(f"✓ {platform}: {report.new} new posts in {report.pages} pages, "
+                  f"{archive.count(platform)} archived")
+    return 1 if any(report.error for report in reports.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
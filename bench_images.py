@@ -0,0 +1,96 @@
+"""Image compression benchmark: encodes and time needed to fit an image under a byte budget
+
+Compares the old linear quality loop with images.compress_to_budget over a
+corpus of large photos. Pass a directory of JPEG/PNG files, or leave it out
+to use synthetic photo-like images. Usage:
+
+    python bench_images.py [photo_dir] [--max-kb 900]
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+from io import BytesIO
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from images import compress_to_budget
+
+SYNTHETIC_SIZES = [(3000, 2000), (4032, 3024), (6000, 4000)]
+
+
+def legacy_compress(img: Image.Image, max_bytes: int):
+    """The quality loop SocialMediaPoster._resize_image used to run, counting encodes"""
+    if img.mode in ('RGBA', 'P'):
+        img = img.convert('RGB')
+    quality = 95
+    encodes = 0
+    while True:
+        buffer = BytesIO()
+        img.save(buffer, format='JPEG', quality=quality)
+        encodes += 1
+        if len(buffer.getvalue()) <= max_bytes or quality <= 5:
+            return buffer.getvalue(), img.size, encodes
+        quality -= 5
+
+
+def synthetic_photo(size, seed: int) -> Image.Image:
+    """A photo-like image: gradients and shapes for structure, noise for sensor grain"""
+    width, height = size
+    base = Image.merge('RGB', [
+        Image.linear_gradient('L').resize(size),
+        Image.radial_gradient('L').resize(size),
+        Image.linear_gradient('L').rotate(90 + seed * 30).resize(size),
+    ])
+    draw = ImageDraw.Draw(base)
+    for i in range(40):
+        x = (i * 7919 + seed * 104729) % width
+        y = (i * 6271 + seed * 1299709) % height
+        r = 50 + (i * 37) % (min(size) // 6)
+        draw.ellipse((x - r, y - r, x + r, y + r),
+                     fill=((i * 53) % 256, (i * 97) % 256, (i * 151) % 256))
+    base = base.filter(ImageFilter.GaussianBlur(1))
+    grain = Image.effect_noise(size, 48).convert('RGB')
+    return Image.blend(base, grain, 0.3)
+
+
+def load_corpus(directory):
+    """Yield (name, image) pairs from directory, or synthetic photos"""
+    if directory:
+        paths = sorted(glob.glob(os.path.join(directory, '*.jp*g')) +
+                       glob.glob(os.path.join(directory, '*.png')))
+        for path in paths:
+            with Image.open(path) as img:
+                img.load()
+                yield os.path.basename(path), img
+    else:
+        for seed, size in enumerate(SYNTHETIC_SIZES):
+            yield f"synthetic {size[0]}x{size[1]}", synthetic_photo(size, seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('photo_dir', nargs='?')
+    parser.add_argument('--max-kb', type=int, default=900)
+    args = parser.parse_args()
+    max_bytes = args.max_kb * 1024
+
+    print(f"{'image':<26}{'method':<10}{'encodes':>8}{'time':>10}{'size':>10}  output")
+    for name, img in load_corpus(args.photo_dir):
+        start = time.perf_counter()
+        data, size, encodes = legacy_compress(img, max_bytes)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<26}{'legacy':<10}{encodes:>8}{elapsed:>9.2f}s{len(data) // 1024:>8}KB"
+              f"  {size[0]}x{size[1]}")
+
+        start = time.perf_counter()
+        result = compress_to_budget(img, max_bytes)
+        elapsed = time.perf_counter() - start
+        print(f"{'':<26}{'budget':<10}{result.encodes:>8}{elapsed:>9.2f}s"
+              f"{len(result.data) // 1024:>8}KB  {result.width}x{result.height} q{result.quality}")
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
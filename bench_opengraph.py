@@ -0,0 +1,130 @@
+"""OpenGraph extraction benchmark against large pages served from a local HTTP server
+
+Compares downloading the whole page and parsing it with BeautifulSoup (what
+post_link used to do) with the streaming head-only extractor. Pass a
+directory of saved .html pages, or leave it out to use generated pages
+shaped like real news articles (big inline <head>, multi-megabyte body).
+Usage:
+
+    python bench_opengraph.py [fixture_dir] [--runs 5]
+"""
+import os
+import glob
+import time
+import argparse
+import statistics
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+from opengraph import extract_metadata
+
+CHUNK_SIZE = 16 * 1024
+
+
+def generated_page(head_kb: int, body_kb: int) -> bytes:
+    """An article-like page: inline CSS/JSON-LD in <head>, OG tags in mixed styles, long body"""
+    head = [
+        '<!DOCTYPE html><html lang="en"><head><meta charset="utf-8">',
+        '<title>Benchmark article &amp; friends</title>',
+        '<style>' + '.c{margin:0;padding:0}' * (head_kb * 1024 // 2 // 22) + '</style>',
+        '<meta content="Benchmark article" property="og:title">',
+        '<meta name="og:description" content="A description with &quot;entities&quot;">',
+        '<meta name="twitter:image" content="/images/hero.jpg">',
+        '<script type="application/ld+json">' + '{"a":1},' * (head_kb * 1024 // 2 // 8) + '</script>',
+        '</head>',
+    ]
+    paragraph = '<p>' + 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 20 + '</p>\n'
+    body = '<body><article>' + paragraph * (body_kb * 1024 // len(paragraph)) + '</article></body></html>'
+    return (''.join(head) + body).encode()
+
+
+def load_fixtures(directory):
+    if directory:
+        return {os.path.basename(path): open(path, 'rb').read()
+                for path in sorted(glob.glob(os.path.join(directory, '*.htm*')))}
+    return {
+        'small head, 2MB body': generated_page(30, 2048),
+        'large head, 5MB body': generated_page(300, 5120),
+    }
+
+
+def serve(fixtures):
+    """Serve fixtures at /<index> from a background HTTP server; returns the base URL"""
+    pages = list(fixtures.values())
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            body = pages[int(self.path.strip('/'))]
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    class Server(ThreadingHTTPServer):
+        def handle_error(self, request, client_address):
+            # The streaming client hangs up once it has the <head>
+            pass
+
+    server = Server(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def legacy(session, url):
+    from bs4 import BeautifulSoup
+    response = session.get(url)
+    soup = BeautifulSoup(response.text, 'html.parser')
+    tag = soup.find('meta', property='og:title')
+    return (tag['content'] if tag else None), len(response.content)
+
+
+def streaming(session, url):
+    with session.get(url, stream=True) as response:
+        read = 0
+
+        def chunks():
+            nonlocal read
+            for chunk in response.iter_content(CHUNK_SIZE):
+                read += len(chunk)
+                yield chunk
+
+        metadata = extract_metadata(chunks(), response.url, response.headers.get('Content-Type'))
+    return metadata.title, read
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('fixture_dir', nargs='?')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixture_dir)
+    base_url = serve(fixtures)
+    session = requests.Session()
+
+    print(f"{'page':<26}{'size':>9}  {'method':<10}{'median':>10}{'read':>10}  title")
+    for index, (name, body) in enumerate(fixtures.items()):
+        url = f"{base_url}/{index}"
+        for method_name, method in (('bs4', legacy), ('streaming', streaming)):
+            timings = []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                title, read = method(session, url)
+                timings.append(time.perf_counter() - start)
+            print(f"{name:<26}{len(body) // 1024:>7}KB  {method_name:<10}"
+                  f"{statistics.median(timings) * 1000:>8.1f}ms{read // 1024:>8}KB  {title}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+"""Posting benchmark against local stand-ins for Bluesky and Mastodon
+
+Starts the servers in stub_servers.py and sends text, image and link posts
+through SocialMediaPoster, and text and image posts through the web app's
+/post route and job workers. Nothing leaves the machine, and the stand-ins'
+latency, rate limits and errors come from the options and a fixed seed, so
+runs with the same options are comparable across commits. Each scenario
+runs in a fresh interpreter, so its peak RSS is its own. Usage:
+
+    python bench_posting.py [--posts 100] [--concurrency 4] [--latency 0.05]
+                            [--error-rate 0] [--rate-limit 0] [--json results.jsonl]
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import platform
+import resource
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List
+
+from bulk import percentile
+from stub_servers import StubServers, StubConfig
+
+SCENARIOS = ['text', 'image', 'link', 'app text', 'app image']
+
+# Photo-sized uploads: bigger than Bluesky's blob limit, so they are re-encoded for it
+IMAGE_SIZE = (3000, 2000)
+
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of this process so far, in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def make_images(count: int, seed: int) -> List[bytes]:
+    """count distinct photo-like JPEGs
+
+    One image is rendered and each copy gets a different trailer after the
+    end-of-image marker, so every post misses the image cache without
+    rendering count photos.
+    """
+    from PIL import Image
+    rng = random.Random(seed)
+    width, height = IMAGE_SIZE
+    small = Image.frombytes('RGB', (width // 16, height // 16), rng.randbytes(width // 16 * height // 16 * 3))
+    buffer = io.BytesIO()
+    small.resize(IMAGE_SIZE, Image.Resampling.BILINEAR).save(buffer, format='JPEG', quality=92)
+    base = buffer.getvalue()
+    return [base + f'bench-{seed}-{i}'.encode() for i in range(count)]
+
+
+def summarise(latencies: List[float], elapsed: float, errors: int) -> Dict[str, Any]:
+    values = sorted(latencies)
+    return {
+        'posts': len(values),
+        'errors': errors,
+        'throughput': len(values) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(values, 50) * 1000,
+        'p95_ms': percentile(values, 95) * 1000,
+        'p99_ms': percentile(values, 99) * 1000,
+    }
+
+
+def _fast_limits(poster):
+    """Let the stand-ins' rate limit headers, not the real services' budgets, set the pace"""
+    for adapter in poster.adapters.values():
+        adapter.rate_limit = (1000.0, 1000)
+        adapter.media_rate_limit = (1000.0, 1000)
+
+
+def run_poster(scenario: str, posts: int, concurrency: int, seed: int) -> Dict[str, Any]:
+    """Send posts through SocialMediaPoster with `concurrency` posts in flight"""
+    from social_media import SocialMediaPoster
+    from rate_limit import RateLimiter
+
+    poster = SocialMediaPoster(max_workers=concurrency * 2, rate_limiter=RateLimiter())
+    _fast_limits(poster)
+    images = make_images(posts + 1, seed) if scenario == 'image' else []
+    article_base = os.environ['BENCH_ARTICLE_BASE']
+
+    def send(i):
+        if scenario == 'text':
+            return poster.post_text(f'Benchmark post {i}')
+        if scenario == 'image':
+            return poster.post_image(f'Benchmark image {i}', images[i], alt_text=f'Image {i}')
+        return poster.post_link(f'Benchmark link {i}', f'{article_base}/{i}')
+
+    def timed(i):
+        start = time.perf_counter()
+        results = send(i)
+        return time.perf_counter() - start, any('error' in r for r in poster.describe_results(results).values())
+
+    # Logs in and warms up connections outside the measurement
+    timed(posts)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(timed, range(posts)))
+    elapsed = time.perf_counter() - start
+    poster.close()
+    return summarise([latency for latency, _ in outcomes], elapsed, sum(failed for _, failed in outcomes))
+
+
+def run_app(scenario: str, posts: int, concurrency: int, seed: int) -> Dict[str, Any]:
+    """Submit posts to /post and time each from submission until its job is done"""
+    os.environ['POST_WORKERS'] = str(concurrency)
+    import app as web
+
+    _fast_limits(web.poster)
+    client = web.app.test_client()
+    images = make_images(posts + 1, seed) if scenario == 'app image' else []
+
+    def submit(i):
+        data = {'text': f'Benchmark app post {i}', 'platforms': ['bluesky', 'mastodon']}
+        if images:
+            data['image'] = (io.BytesIO(images[i]), f'{i}.jpg')
+            data['alt_text'] = f'Image {i}'
+        response = client.post('/post', data=data, content_type='multipart/form-data')
+        return response.get_json()['job_id']
+
+    def wait(job_ids):
+        jobs = {}
+        while len(jobs) < len(job_ids):
+            for job_id in job_ids:
+                if job_id not in jobs:
+                    job = web.job_queue.get(job_id)
+                    if job['status'] in ('done', 'failed'):
+                        jobs[job_id] = job
+            time.sleep(0.005)
+        return jobs
+
+    wait([submit(posts)])
+    start = time.perf_counter()
+    job_ids = [submit(i) for i in range(posts)]
+    jobs = wait(job_ids)
+    elapsed = time.perf_counter() - start
+    web.workers.stop()
+
+    latencies = [job['finished_at'] - job['created_at'] for job in jobs.values()]
+    errors = sum(1 for job in jobs.values()
+                 if job['status'] == 'failed' or any('error' in r for r in (job['results'] or {}).values()))
+    return summarise(latencies, elapsed, errors)
+
+
+def run_scenario(scenario: str, posts: int, concurrency: int, seed: int) -> Dict[str, Any]:
+    """Run one scenario in this process and add its peak RSS"""
+    if scenario.startswith('app'):
+        result = run_app(scenario, posts, concurrency, seed)
+    else:
+        result = run_poster(scenario, posts, concurrency, seed)
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def git_revision() -> str:
+    """Commit the tree is at, with '+dirty' for uncommitted changes"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=here,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=here,
+                               capture_output=True, text=True).stdout.strip()
+        return commit + ('+dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--posts', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per stand-in response')
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of uploads and posts failing with 503')
+    parser.add_argument('--rate-limit', type=int, default=0, help='requests per 5 minutes (0: unlimited)')
+    parser.add_argument('--media-processing', type=float, default=0.3,
+                        help='seconds Mastodon takes to process an upload')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='run only these')
+    parser.add_argument('--json', help='append one JSON line per scenario to this file')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = run_scenario(args.child, args.posts, args.concurrency, args.seed)
+        print(json.dumps(result))
+        return
+
+    config = StubConfig(latency=args.latency, jitter=args.jitter, rate_limit=args.rate_limit,
+                        error_rate=args.error_rate, media_processing=args.media_processing, seed=args.seed)
+    options = {key: value for key, value in vars(args).items() if key not in ('json', 'child', 'scenario')}
+    revision = git_revision()
+    here = os.path.dirname(os.path.abspath(__file__))
+    print(f"{revision}  {options}")
+    print(f"{'scenario':<12}{'posts/s':>9}{'p50':>10}{'p95':>10}{'p99':>10}{'errors':>8}{'peak RSS':>11}")
+
+    with StubServers(config) as servers:
+        for scenario in args.scenario or SCENARIOS:
+            with tempfile.TemporaryDirectory() as scratch:
+                env = {k: v for k, v in os.environ.items() if not k.startswith(('BLUESKY_', 'MASTODON_'))}
+                env.update(servers.environ())
+                env.update(
+                    BENCH_ARTICLE_BASE=servers.article_url(0).rsplit('/', 1)[0],
+                    BLUESKY_SESSION_FILE=os.path.join(scratch, 'bluesky_session.json'),
+                    IMAGE_CACHE_DIR=os.path.join(scratch, 'image_cache'),
+                    LINK_PREVIEW_CACHE=os.path.join(scratch, 'link_previews.sqlite3'),
+                    IDEMPOTENCY_STORE=os.path.join(scratch, 'idempotency.sqlite3'),
+                    JOB_QUEUE_PATH=os.path.join(scratch, 'jobs.sqlite3'),
+                    DEDUPE_WINDOW='0',
+                )
+                command = [sys.executable, os.path.abspath(__file__), '--child', scenario,
+                           '--posts', str(args.posts), '--concurrency', str(args.concurrency),
+                           '--seed', str(args.seed)]
+                output = subprocess.run(command, cwd=here, env=env, capture_output=True, text=True)
+                if output.returncode != 0:
+                    print(f"{scenario:<12}failed:\n{output.stderr[-2000:]}")
+                    continue
+                result = json.loads(output.stdout.strip().splitlines()[-1])
+
+            print(f"{scenario:<12}{result['throughput']:>9.1f}{result['p50_ms']:>8.0f}ms{result['p95_ms']:>8.0f}ms"
+                  f"{result['p99_ms']:>8.0f}ms{result['errors']:>8}{result['peak_rss_mb']:>9.0f}MB")
+            if args.json:
+                record = dict(result, scenario=scenario, revision=revision, options=options,
+                              python=platform.python_version(), timestamp=time.time())
+                with open(args.json, 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+
+
+if __name__ == '__main__':
+    main()
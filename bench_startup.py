@@ -0,0 +1,69 @@
+"""Startup benchmark: how long it takes to import the poster and boot the Flask app
+
+Each measurement runs in a fresh interpreter so nothing is already imported.
+Platform credentials are removed from the environment, so no network calls
+are made. Usage:
+
+    python bench_startup.py [--runs 10]
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+HEAVY_MODULES = ['atproto', 'mastodon', 'bs4', 'PIL', 'requests', 'httpx']
+
+SNIPPETS = {
+    'import social_media': 'from social_media import SocialMediaPoster',
+    'SocialMediaPoster()': 'from social_media import SocialMediaPoster; SocialMediaPoster()',
+    'import app (Flask boot)': 'import app',
+}
+
+_TIMER = """
+import sys, time, json
+start = time.perf_counter()
+{snippet}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'elapsed': elapsed, 'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(snippet: str, runs: int) -> dict:
+    """Run snippet in `runs` fresh interpreters and summarise the timings"""
+    env = {k: v for k, v in os.environ.items()
+           if not k.startswith(('BLUESKY_', 'MASTODON_'))}
+    code = _TIMER.format(snippet=snippet, heavy=HEAVY_MODULES)
+    here = os.path.dirname(os.path.abspath(__file__))
+    timings = []
+    loaded = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', code], cwd=here, env=env,
+            capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        timings.append(result['elapsed'])
+        loaded = result['loaded']
+    return {
+        'median_ms': statistics.median(timings) * 1000,
+        'min_ms': min(timings) * 1000,
+        'loaded': loaded,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'scenario':<26}{'median':>10}{'min':>10}  heavy modules loaded")
+    for name, snippet in SNIPPETS.items():
+        result = measure(snippet, args.runs)
+        print(f"{name:<26}{result['median_ms']:>8.1f}ms{result['min_ms']:>8.1f}ms  "
+              f"{', '.join(result['loaded']) or '-'}")
+
+
+if __name__ == '__main__':
+    main()
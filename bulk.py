@@ -0,0 +1,203 @@
+"""Post a batch of posts from a JSONL file
+
+Each input line is a JSON object with "text" and optionally "platforms",
+"idempotency_key", and "link" or "image" (a file path) with "alt_text",
+or "images" (up to four paths) with "alt_texts". Text posts with "thread"
+set are split into a reply chain when too long for a platform.
+Results are appended to an output JSONL file, one line per attempt at an
+input line. Re-running the batch resumes it: lines that were posted are
+skipped, and lines that failed are tried again, only on the platforms they
+didn't reach. Lines with an idempotency key are never posted twice, even
+when the output file is lost.
+Usage:
+
+    python bulk.py posts.jsonl -o results.jsonl [--concurrency 4]
+"""
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import threading
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, List, Iterator, Tuple, Set
+
+from jobs import execute_post
+
+
+@dataclass
+class BatchReport:
+    """What a batch run did and how fast"""
+    posted: int = 0
+    failed: int = 0
+    skipped: int = 0
+    elapsed: float = 0.0
+    latencies: Dict[str, List[float]] = field(default_factory=dict)
+
+    @property
+    def throughput(self) -> float:
+        """Posts completed per second"""
+        return (self.posted + self.failed) / self.elapsed if self.elapsed else 0.0
+
+    def percentiles(self, platform: str, qs=(50, 95, 99)) -> Dict[int, float]:
+        """Latency percentiles in seconds for one platform"""
+        values = sorted(self.latencies.get(platform, []))
+        return {q: percentile(values, q) for q in qs}
+
+    def summary(self) -> str:
+        lines = [
+            f"{self.posted} posted, {self.failed} failed, {self.skipped} already done "
+            f"in {self.elapsed:.1f}s ({self.throughput:.2f} posts/sec)"
+        ]
+        for platform in sorted(self.latencies):
+            p = self.percentiles(platform)
+            lines.append(f"  {platform:<10} p50 {p[50] * 1000:7.0f}ms  p95 {p[95] * 1000:7.0f}ms  "
+                         f"p99 {p[99] * 1000:7.0f}ms  ({len(self.latencies[platform])} calls)")
+        return '\n'.join(lines)
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list (0.0 if empty)"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def read_progress(output_path: str) -> Tuple[Set[int], Dict[int, Set[str]]]:
+    """Lines of an earlier run recorded in output_path: those fully posted, and
+    the platforms each partly posted line already reached"""
+    done, reached = set(), {}
+    if not os.path.exists(output_path):
+        return done, reached
+    with open(output_path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                number = entry['line']
+            except (ValueError, KeyError, TypeError):
+                # A line cut short by a crash: that post is retried
+                continue
+            results = entry.get('results') or {}
+            posted = {platform for platform, result in results.items() if 'error' not in result}
+            reached.setdefault(number, set()).update(posted)
+            if 'error' not in entry and len(posted) == len(results):
+                done.add(number)
+    return done, {number: platforms for number, platforms in reached.items() if number not in done}
+
+
+def read_posts(input_path: str) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """Yield (line number, post, parse error) for each non-blank input line, without reading ahead"""
+    with open(input_path) as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield number, json.loads(line), None
+            except ValueError as e:
+                yield number, None, f"Invalid JSON: {e}"
+
+
+def _post_one(poster, post: dict):
+    payload = {key: post[key] for key in ('text', 'platforms', 'link', 'alt_texts', 'idempotency_key',
+                                          'thread') if key in post}
+    image_paths = post.get('images') or ([post['image']] if post.get('image') else [])
+    images = []
+    for path in image_paths:
+        with open(path, 'rb') as f:
+            images.append(f.read())
+    if images:
+        payload['filenames'] = [os.path.basename(path) for path in image_paths]
+        payload.setdefault('alt_texts', [post.get('alt_text', '')])
+    return execute_post(poster, payload, images)
+
+
+def run_batch(poster, input_path: str, output_path: str, concurrency: int = 4,
+              resume: bool = True) -> BatchReport:
+    """Post every line of input_path with up to `concurrency` posts in flight
+
+    The input is streamed; at most `concurrency` lines are held in memory
+    at a time. With resume, lines output_path records as posted are
+    skipped, and lines that failed on some platforms are only retried on
+    the others.
+    """
+    done, reached = read_progress(output_path) if resume else (set(), {})
+    report = BatchReport()
+    lock = threading.Lock()
+    slots = threading.BoundedSemaphore(concurrency)
+
+    def record(number, entry):
+        entry = dict(line=number, **entry)
+        with lock:
+            output.write(json.dumps(entry) + '\n')
+            output.flush()
+
+    def run(number, post):
+        try:
+            results = _post_one(poster, post)
+            described = poster.describe_results(results)
+            timings = getattr(results, 'timings', {})
+            entry = {'results': described, 'timings': timings}
+            if getattr(results, 'stages', None):
+                entry['stages'] = results.stages
+            record(number, entry)
+            with lock:
+                failed = any('error' in result for result in described.values())
+                report.failed += failed
+                report.posted += not failed
+                for platform, elapsed in timings.items():
+                    report.latencies.setdefault(platform, []).append(elapsed)
+        except Exception as e:
+            record(number, {'error': str(e)})
+            with lock:
+                report.failed += 1
+        finally:
+            slots.release()
+
+    start = time.perf_counter()
+    with open(output_path, 'a' if resume else 'w') as output, \
+            ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='bulk-post') as executor:
+        for number, post, error in read_posts(input_path):
+            if number in done:
+                report.skipped += 1
+                continue
+            if error or not isinstance(post, dict) or not post.get('text'):
+                record(number, {'error': error or 'Missing "text"'})
+                with lock:
+                    report.failed += 1
+                continue
+            if reached.get(number):
+                # Don't post again where an earlier run's attempt already went out
+                platforms = post.get('platforms') or poster.available_platforms()
+                post = dict(post, platforms=[platform for platform in platforms
+                                             if platform not in reached[number]])
+            slots.acquire()
+            executor.submit(run, number, post)
+    report.elapsed = time.perf_counter() - start
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('input', help='JSONL file of posts')
+    parser.add_argument('-o', '--output', help='JSONL file for results (default: <input>.results.jsonl)')
+    parser.add_argument('-c', '--concurrency', type=int, default=4, help='posts in flight at once')
+    parser.add_argument('--no-resume', action='store_true', help='start over instead of skipping done lines')
+    args = parser.parse_args()
+
+    from social_media import SocialMediaPoster
+    from platforms import PLATFORMS
+
+    output = args.output or f"{os.path.splitext(args.input)[0]}.results.jsonl"
+    # Enough threads for every post in flight to reach every platform at once
+    with SocialMediaPoster(max_workers=args.concurrency * len(PLATFORMS)) as poster:
+        report = run_batch(poster, args.input, output, args.concurrency, resume=not args.no_resume)
+    print(report.summary())
+    print(f"Results written to {output}")
+    return 1 if report.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""Bluesky rich text facets: the links, #hashtags and @mentions in a post
+
+Bluesky shows plain text unless a post carries facets marking the byte
+ranges to link. Ranges are UTF-8 byte offsets, so they are counted while
+the text is scanned once rather than by encoding the text up to each match.
+Mentions need the account's DID; handles are looked up through a shared
+cache, with every handle not cached asked for in one getProfiles call.
+"""
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Dict, List, Tuple, Callable, Iterable
+
+from metrics import shared_metrics
+
+logger = logging.getLogger(__name__)
+
+# getProfiles takes at most this many actors
+PROFILES_BATCH = 25
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_TTL = 24 * 60 * 60
+# Handles that don't exist are asked about again sooner, in case they are registered
+DEFAULT_MISSING_TTL = 10 * 60
+# Longer tags are left as plain text; Bluesky rejects them
+MAX_TAG_LENGTH = 64
+
+_FACET_PATTERN = re.compile(r'''
+    (?<![\w/])(?P<link>https?://[^\s<>"'`]+)
+  | (?<![^\s(\[])@(?P<mention>(?:[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?\.)+
+                              [a-zA-Z](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?)(?![\w.-]*\w)
+  | (?<!\S)[#＃](?P<tag>[^\s#＃]+)
+''', re.VERBOSE)
+
+# Punctuation ending a sentence rather than the link or tag before it
+_TRAILING = '.,;:!?"\''
+
+
+@dataclass(frozen=True)
+class FacetSpan:
+    """A link, mention or tag found in a post, with its character and UTF-8 byte ranges"""
+    kind: str  # 'link', 'mention' or 'tag'
+    value: str  # The URL, the handle without '@', or the tag without '#'
+    byte_start: int
+    byte_end: int
+    start: int
+    end: int
+
+
+def _trim(kind: str, value: str) -> str:
+    """value without trailing punctuation that belongs to the sentence"""
+    if kind == 'mention':
+        return value
+    value = value.rstrip(_TRAILING)
+    # Keep a closing parenthesis only when the link or tag opened one
+    while value.endswith(')') and value.count(')') > value.count('('):
+        value = value[:-1].rstrip(_TRAILING)
+    return value
+
+
+def find_facets(text: str) -> List[FacetSpan]:
+    """Links, @mentions and #hashtags in text, in order, with their byte ranges"""
+    spans = []
+    position = 0
+    byte_position = 0
+    for match in _FACET_PATTERN.finditer(text):
+        kind = match.lastgroup
+        value = _trim(kind, match.group(kind))
+        if not value or (kind == 'tag' and (value.isdigit() or len(value) > MAX_TAG_LENGTH)):
+            continue
+        start = match.start()
+        end = match.start(kind) + len(value)
+        # Only the text between the previous match and this one is encoded
+        byte_start = byte_position + len(text[position:start].encode('utf-8'))
+        byte_end = byte_start + len(text[start:end].encode('utf-8'))
+        spans.append(FacetSpan(kind, value.lower() if kind == 'mention' else value,
+                               byte_start, byte_end, start, end))
+        position, byte_position = end, byte_end
+    return spans
+
+
+class HandleCache:
+    """Handle to DID lookups, kept for ttl seconds and evicted least recently used first
+
+    resolve() answers from the cache and fetches every other handle in
+    batches of PROFILES_BATCH, so a post with up to 25 new mentions costs
+    one round trip and one with only known mentions costs none. Handles
+    that turn out not to exist are remembered for missing_ttl seconds.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_CACHE_SIZE, ttl: float = DEFAULT_TTL,
+                 missing_ttl: float = DEFAULT_MISSING_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.missing_ttl = missing_ttl
+        self._entries: 'OrderedDict[str, Tuple[Optional[str], float]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, handle: str) -> Tuple[bool, Optional[str]]:
+        """(found, did) for a cached handle; did is None for one known not to exist"""
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is None:
+                return False, None
+            if entry[1] < time.monotonic():
+                del self._entries[handle]
+                return False, None
+            self._entries.move_to_end(handle)
+            return True, entry[0]
+
+    def put(self, handle: str, did: Optional[str]):
+        """Remember handle's DID, or that it has none"""
+        expires_at = time.monotonic() + (self.ttl if did else self.missing_ttl)
+        with self._lock:
+            self._entries[handle] = (did, expires_at)
+            self._entries.move_to_end(handle)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def resolve(self, handles: Iterable[str],
+                fetch: Callable[[List[str]], Dict[str, str]]) -> Dict[str, Optional[str]]:
+        """DIDs of handles, fetching uncached ones with fetch(up to 25 handles) -> {handle: did}
+
+        A failed fetch leaves its handles unresolved without caching them.
+        """
+        metrics = shared_metrics()
+        dids: Dict[str, Optional[str]] = {}
+        missing = []
+        for handle in dict.fromkeys(handles):
+            found, did = self.get(handle)
+            if found:
+                dids[handle] = did
+            else:
+                missing.append(handle)
+        if dids:
+            metrics.count('crosspost_handle_lookups_total', len(dids), result='cached')
+        for i in range(0, len(missing), PROFILES_BATCH):
+            batch = missing[i:i + PROFILES_BATCH]
+            try:
+                fetched = {handle.lower(): did for handle, did in fetch(batch).items()}
+            except Exception as e:
+                logger.warning(f"Could not look up {', '.join(batch)}: {e}")
+                metrics.count('crosspost_handle_lookups_total', len(batch), result='failed')
+                continue
+            metrics.count('crosspost_handle_lookups_total', len(batch), result='fetched')
+            for handle in batch:
+                dids[handle] = fetched.get(handle)
+                self.put(handle, dids[handle])
+        return dids
+
+
+def resolve_mentions(text: str, fetch_dids: Callable[[List[str]], Dict[str, str]],
+                     cache: Optional[HandleCache] = None) -> Dict[str, Optional[str]]:
+    """DIDs of the handles mentioned in text, looked up as HandleCache.resolve() does"""
+    handles = [span.value for span in find_facets(text) if span.kind == 'mention']
+    return (cache or shared_handle_cache()).resolve(handles, fetch_dids) if handles else {}
+
+
+def build_facets(text: str, fetch_dids: Callable[[List[str]], Dict[str, str]],
+                 cache: Optional[HandleCache] = None) -> List:
+    """app.bsky.richtext.facet records for the links, mentions and tags in text
+
+    fetch_dids(handles) looks up handles the cache doesn't know. Mentions
+    of handles that don't resolve are left as plain text.
+    """
+    from atproto import models
+    Facet = models.AppBskyRichtextFacet
+
+    spans = find_facets(text)
+    handles = [span.value for span in spans if span.kind == 'mention']
+    dids = (cache or shared_handle_cache()).resolve(handles, fetch_dids) if handles else {}
+
+    facets = []
+    for span in spans:
+        if span.kind == 'link':
+            feature = Facet.Link(uri=span.value)
+        elif span.kind == 'tag':
+            feature = Facet.Tag(tag=span.value)
+        elif dids.get(span.value):
+            feature = Facet.Mention(did=dids[span.value])
+        else:
+            continue
+        facets.append(Facet.Main(
+            index=Facet.ByteSlice(byte_start=span.byte_start, byte_end=span.byte_end),
+            features=[feature]
+        ))
+    return facets
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def shared_handle_cache() -> HandleCache:
+    """The process-wide handle cache used when none is passed in"""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = HandleCache()
+        return _shared_cache
@@ -0,0 +1,549 @@
+"""Watch RSS and Atom feeds and cross-post their new articles
+
+Feeds are polled with If-None-Match / If-Modified-Since, so an unchanged
+feed costs one 304 and no download. A feed that changed is parsed as it
+streams in, and its entries are checked against the ones already seen.
+New entries are posted with SocialMediaPoster.post_link, oldest first.
+Validators, poll intervals and seen entries are kept in SQLite, so a
+restarted watcher neither downloads unchanged feeds again nor re-posts
+old entries. An entry whose post failed is retried from the store on the
+following polls, whether or not the feed changed. The first poll of a
+feed only records what it already has.
+Usage:
+
+    python feed_watcher.py https://example.com/feed/ [...] [--feeds feeds.txt] [--once]
+"""
+import os
+import sys
+import time
+import heapq
+import random
+import sqlite3
+import logging
+import argparse
+import threading
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, List, Iterable, TYPE_CHECKING
+from xml.etree.ElementTree import XMLPullParser
+
+from metrics import shared_metrics
+
+if TYPE_CHECKING:
+    from http_client import HttpClient
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STORE_PATH = '.feed_watcher.sqlite3'
+CHUNK_SIZE = 16 * 1024
+# Stop reading a feed after this many bytes; entries parsed until then are kept
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+# Poll intervals in seconds: the first, and the bounds adaptation keeps to
+DEFAULT_INTERVAL = 15 * 60
+DEFAULT_MIN_INTERVAL = 5 * 60
+DEFAULT_MAX_INTERVAL = 6 * 60 * 60
+# An entry whose post keeps failing is given up after this many polls
+MAX_POST_ATTEMPTS = 3
+# A running watcher re-reads the feed list this often, for feeds changed by other processes
+RELOAD_INTERVAL = 60
+# Seen entries no longer in their feed are forgotten after this long
+SEEN_RETENTION = 90 * 24 * 60 * 60
+
+
+@dataclass
+class FeedEntry:
+    """An article in a feed"""
+    id: str
+    link: Optional[str]
+    title: Optional[str]
+
+
+@dataclass
+class FeedState:
+    """What is kept about a watched feed between polls"""
+    url: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    interval: float = DEFAULT_INTERVAL
+    next_poll: float = 0.0
+    errors: int = 0
+    # None until the feed's entries at the time it was added are recorded
+    polled_at: Optional[float] = None
+
+
+def _local(tag: str) -> str:
+    """Tag name without its namespace: {http://www.w3.org/2005/Atom}entry -> entry"""
+    return tag.rpartition('}')[2]
+
+
+class FeedParser:
+    """Incremental RSS 2.0, RSS 1.0 and Atom parser: feed() it chunks, then read entries
+
+    Each entry is turned into a FeedEntry when its closing tag is parsed
+    and then dropped from the tree, so memory stays flat however long the
+    feed is. Input past max_bytes is ignored.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+        self.entries: List[FeedEntry] = []
+        self._parser = XMLPullParser(events=('start', 'end'))
+        self._open = []
+
+    @property
+    def done(self) -> bool:
+        return self.bytes_read >= self.max_bytes
+
+    def feed(self, chunk: bytes) -> bool:
+        """Parse the next chunk of the feed; returns True once no more input is read"""
+        if self.done:
+            return True
+        chunk = chunk[:self.max_bytes - self.bytes_read]
+        self.bytes_read += len(chunk)
+        self._parser.feed(chunk)
+        for event, element in self._parser.read_events():
+            if event == 'start':
+                self._open.append(element)
+                continue
+            self._open.pop()
+            if _local(element.tag) in ('item', 'entry'):
+                entry = self._entry(element)
+                if entry is not None:
+                    self.entries.append(entry)
+                if self._open:
+                    self._open[-1].remove(element)
+        if self.done:
+            logger.warning(f"Feed is over {self.max_bytes} bytes; reading only the entries before that")
+        return self.done
+
+    def close(self) -> List[FeedEntry]:
+        """Finish parsing (raising ParseError if the feed was cut short) and return the entries"""
+        if not self.done:
+            self._parser.close()
+        return self.entries
+
+    @staticmethod
+    def _entry(element) -> Optional[FeedEntry]:
+        fields: Dict[str, str] = {}
+        for child in element:
+            name = _local(child.tag)
+            if name == 'link':
+                # Atom links are in href, with rel="alternate" (the default) for the article
+                href = child.get('href')
+                if href is not None:
+                    if child.get('rel', 'alternate') == 'alternate':
+                        fields.setdefault('link', href.strip())
+                    continue
+            if name in ('guid', 'id', 'link', 'title') and child.text and child.text.strip():
+                fields.setdefault(name, child.text.strip())
+        # RSS 1.0 items are identified by rdf:about
+        about = next((value for key, value in element.attrib.items() if _local(key) == 'about'), None)
+        entry_id = fields.get('guid') or fields.get('id') or about or fields.get('link') or fields.get('title')
+        if entry_id is None:
+            return None
+        return FeedEntry(entry_id, fields.get('link'), fields.get('title'))
+
+
+def parse_feed(chunks: Iterable[bytes], max_bytes: int = DEFAULT_MAX_BYTES) -> List[FeedEntry]:
+    """Entries of a feed read from chunks, in the order the feed lists them"""
+    parser = FeedParser(max_bytes)
+    for chunk in chunks:
+        if parser.feed(chunk):
+            break
+    return parser.close()
+
+
+class FeedStore:
+    """Watched feeds and the entries already seen in each, stored in SQLite
+
+    Seen entries are keyed by (feed, entry id), so recording a feed's
+    entries costs one index lookup each however many have been recorded.
+    Each keeps its link and title, so one whose post failed can be retried
+    without the feed.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv('FEED_WATCHER_STORE', DEFAULT_STORE_PATH)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS feeds (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                interval REAL NOT NULL,
+                next_poll REAL NOT NULL,
+                errors INTEGER NOT NULL DEFAULT 0,
+                polled_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS feed_entries (
+                feed_url TEXT NOT NULL,
+                entry_id TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                posted_at REAL,
+                seen_at REAL NOT NULL,  -- last time the entry was in its feed
+                link TEXT,
+                title TEXT,
+                position INTEGER,  -- place in the feed when last seen, 0 for the first
+                PRIMARY KEY (feed_url, entry_id)
+            ) WITHOUT ROWID;
+        ''')
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def add(self, url: str, interval: float = DEFAULT_INTERVAL) -> bool:
+        """Start watching url, first polled right away; returns False if it already is watched"""
+        with self._lock:
+            cursor = self._db.execute(
+                'INSERT OR IGNORE INTO feeds (url, interval, next_poll) VALUES (?, ?, 0)', (url, interval)
+            )
+        return cursor.rowcount == 1
+
+    def remove(self, url: str):
+        """Stop watching url and forget its entries"""
+        with self._lock:
+            self._db.execute('BEGIN')
+            self._db.execute('DELETE FROM feeds WHERE url = ?', (url,))
+            self._db.execute('DELETE FROM feed_entries WHERE feed_url = ?', (url,))
+            self._db.execute('COMMIT')
+
+    def feeds(self) -> List[FeedState]:
+        """Every watched feed"""
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT url, etag, last_modified, interval, next_poll, errors, polled_at FROM feeds'
+            ).fetchall()
+        return [FeedState(*row) for row in rows]
+
+    def get(self, url: str) -> Optional[FeedState]:
+        with self._lock:
+            row = self._db.execute(
+                'SELECT url, etag, last_modified, interval, next_poll, errors, polled_at FROM feeds WHERE url = ?',
+                (url,)
+            ).fetchone()
+        return FeedState(*row) if row else None
+
+    def save(self, state: FeedState):
+        """Record a feed's validators and schedule after a poll"""
+        with self._lock:
+            self._db.execute(
+                'UPDATE feeds SET etag = ?, last_modified = ?, interval = ?, next_poll = ?, errors = ?, '
+                'polled_at = ? WHERE url = ?',
+                (state.etag, state.last_modified, state.interval, state.next_poll, state.errors,
+                 state.polled_at, state.url)
+            )
+
+    def unposted(self, url: str) -> List[FeedEntry]:
+        """Entries of the feed at url with a link that haven't gone out yet nor been given up on, oldest first"""
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT entry_id, link, title FROM feed_entries WHERE feed_url = ? AND posted_at IS NULL '
+                'AND attempts < ? AND link IS NOT NULL ORDER BY seen_at, position DESC',
+                (url, MAX_POST_ATTEMPTS)
+            ).fetchall()
+        return [FeedEntry(*row) for row in rows]
+
+    def touch(self, url: str, entries: List[FeedEntry], posted: bool = False):
+        """Record that entries are in the feed now, in this order, as posted if posted
+
+        Entries of the feed that haven't been in it for SEEN_RETENTION are
+        forgotten at the same time.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute('BEGIN')
+            try:
+                self._db.executemany(
+                    'INSERT INTO feed_entries (feed_url, entry_id, posted_at, seen_at, link, title, position) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT (feed_url, entry_id) DO UPDATE SET seen_at = excluded.seen_at, '
+                    'posted_at = COALESCE(feed_entries.posted_at, excluded.posted_at), '
+                    'link = excluded.link, title = excluded.title, position = excluded.position',
+                    [(url, entry.id, now if posted else None, now, entry.link, entry.title, position)
+                     for position, entry in enumerate(entries)]
+                )
+                self._db.execute('DELETE FROM feed_entries WHERE feed_url = ? AND seen_at < ?',
+                                 (url, now - SEEN_RETENTION))
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+
+    def record_attempt(self, url: str, entry_id: str, posted: bool):
+        """Record one try at posting an entry, and whether it went out"""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                'INSERT INTO feed_entries (feed_url, entry_id, attempts, posted_at, seen_at) VALUES (?, ?, 1, ?, ?) '
+                'ON CONFLICT (feed_url, entry_id) DO UPDATE SET attempts = feed_entries.attempts + 1, '
+                'posted_at = COALESCE(feed_entries.posted_at, excluded.posted_at)',
+                (url, entry_id, now if posted else None, now)
+            )
+
+
+def _retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (seconds or an HTTP date)"""
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        return parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError):
+        return None
+
+
+class FeedWatcher:
+    """Polls the feeds in a FeedStore and posts their new entries through a SocialMediaPoster
+
+    Up to workers feeds are fetched at once over the shared pooled HTTP
+    client, which also caps requests per host. Each feed has its own poll
+    interval: halved when a poll posts new entries, grown by half when it
+    finds none, and left alone when their posts all failed, within
+    [min_interval, max_interval]. Failed polls back
+    off exponentially, and 429/503 responses wait at least for Retry-After.
+    Entries are posted with template (fields: title, link) as the text.
+    """
+
+    def __init__(self, poster=None, store: Optional[FeedStore] = None, http: Optional['HttpClient'] = None,
+                 workers: int = 8, platforms: Optional[List[str]] = None, template: str = '{title}',
+                 min_interval: float = DEFAULT_MIN_INTERVAL, max_interval: float = DEFAULT_MAX_INTERVAL,
+                 post_existing: bool = False):
+        """Create a watcher; with post_existing, a new feed's current entries are posted too"""
+        self.store = store if store is not None else FeedStore()
+        self._poster = poster
+        self._http = http
+        self.workers = workers
+        self.platforms = platforms
+        self.template = template
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.post_existing = post_existing
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._wake = threading.Condition()
+        self._reload = True
+
+    @property
+    def poster(self):
+        """The poster that sends new entries, created on first use"""
+        if self._poster is None:
+            from social_media import SocialMediaPoster
+            self._poster = SocialMediaPoster()
+        return self._poster
+
+    @property
+    def http(self) -> 'HttpClient':
+        if self._http is None:
+            from http_client import shared_client
+            self._http = shared_client()
+        return self._http
+
+    def add_feed(self, url: str) -> bool:
+        """Watch url; returns False if it already was watched"""
+        added = self.store.add(url, min(max(DEFAULT_INTERVAL, self.min_interval), self.max_interval))
+        if added:
+            # A running watcher picks it up straight away
+            with self._wake:
+                self._reload = True
+                self._wake.notify()
+        return added
+
+    def _fetch(self, state: FeedState) -> Optional[List[FeedEntry]]:
+        """Conditionally GET a feed and parse it; None if it hasn't changed since the last poll"""
+        headers = {}
+        if state.etag:
+            headers['If-None-Match'] = state.etag
+        if state.last_modified:
+            headers['If-Modified-Since'] = state.last_modified
+        with shared_metrics().timer('crosspost_feed_fetch_seconds'), \
+                self.http.stream('GET', state.url, headers=headers) as response:
+            if response.status_code == 304:
+                return None
+            if response.status_code in (429, 503):
+                wait = _retry_after(response.headers.get('Retry-After'))
+                if wait is not None:
+                    state.next_poll = time.time() + wait
+            response.raise_for_status()
+            entries = parse_feed(response.iter_bytes(CHUNK_SIZE))
+        state.etag = response.headers.get('ETag')
+        state.last_modified = response.headers.get('Last-Modified')
+        return entries
+
+    def _post(self, state: FeedState, entry: FeedEntry) -> bool:
+        """Cross-post one entry; returns whether it went out on every platform"""
+        text = self.template.format(title=entry.title or entry.link, link=entry.link)
+        # Keyed by the entry, so a restart mid-post doesn't post it twice where it already went out
+        results = self.poster.post_link(text, entry.link, platforms=self.platforms,
+                                        idempotency_key=f'feed:{state.url}#{entry.id}')
+        failed = [platform for platform, result in results.items()
+                  if isinstance(result, dict) and 'error' in result]
+        if failed:
+            logger.warning(f"Posting {entry.link} from {state.url} failed on {', '.join(failed)}")
+        return not failed
+
+    def poll(self, url: str) -> List[FeedEntry]:
+        """Poll one feed now, post its new entries and schedule its next poll
+
+        Returns the entries that were posted.
+        """
+        state = self.store.get(url)
+        if state is None:
+            raise ValueError(f"Not watching {url}")
+        metrics = shared_metrics()
+        now = time.time()
+        posted = []
+        try:
+            entries = self._fetch(state)
+        except Exception as e:
+            state.errors += 1
+            delay = min(state.interval * 2 ** state.errors, self.max_interval)
+            state.next_poll = max(state.next_poll, now + delay)
+            metrics.count('crosspost_feed_polls_total', result='error')
+            logger.warning(f"Polling {url} failed ({state.errors} in a row): {e}")
+            self.store.save(state)
+            return posted
+
+        state.errors = 0
+        if entries is None:
+            metrics.count('crosspost_feed_polls_total', result='not_modified')
+        else:
+            metrics.count('crosspost_feed_polls_total', result='fetched')
+            # What the feed had when it was added isn't news
+            self.store.touch(url, entries, posted=state.polled_at is None and not self.post_existing)
+        # New entries, and those whose posts failed on earlier polls, even if the feed is unchanged since
+        new = self.store.unposted(url)
+        for entry in new:
+            ok = self._post(state, entry)
+            self.store.record_attempt(url, entry.id, ok)
+            metrics.count('crosspost_feed_entries_total', result='posted' if ok else 'failed')
+            if ok:
+                posted.append(entry)
+
+        if posted:
+            state.interval = max(state.interval / 2, self.min_interval)
+        elif not new:
+            state.interval = min(state.interval * 1.5, self.max_interval)
+        # Jitter spreads out feeds that were added together
+        state.next_poll = now + state.interval * random.uniform(0.9, 1.1)
+        state.polled_at = now
+        self.store.save(state)
+        return posted
+
+    def run_once(self) -> Dict[str, List[FeedEntry]]:
+        """Poll every feed that is due, at most workers at a time, and return what was posted"""
+        now = time.time()
+        due = [state.url for state in self.store.feeds() if state.next_poll <= now]
+        with ThreadPoolExecutor(max_workers=max(min(self.workers, len(due)), 1),
+                                thread_name_prefix='feed-poll') as executor:
+            return dict(zip(due, executor.map(self.poll, due)))
+
+    def start(self):
+        """Keep polling feeds as they fall due, in a background thread"""
+        if self._thread is None:
+            self._stopping.clear()
+            self._reload = True
+            self._thread = threading.Thread(target=self._run, name='feed-watcher', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop polling once the polls in progress are done"""
+        self._stopping.set()
+        with self._wake:
+            self._wake.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        # Feeds by when they are next due; a feed being polled is off the heap until it is done
+        schedule = []
+        in_flight = set()
+        reloaded = 0.0
+
+        def poll(url):
+            try:
+                self.poll(url)
+            except Exception:
+                logger.exception(f"Polling {url} failed")
+            state = self.store.get(url)
+            with self._wake:
+                in_flight.discard(url)
+                if state is not None:
+                    heapq.heappush(schedule, (state.next_poll, url))
+                self._wake.notify()
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='feed-poll') as executor:
+            with self._wake:
+                while not self._stopping.is_set():
+                    now = time.time()
+                    if self._reload or now - reloaded >= RELOAD_INTERVAL:
+                        # Picks up feeds added or removed here or by other processes
+                        self._reload = False
+                        reloaded = now
+                        schedule[:] = [(state.next_poll, state.url) for state in self.store.feeds()
+                                       if state.url not in in_flight]
+                        heapq.heapify(schedule)
+                    while schedule and schedule[0][0] <= now and len(in_flight) < self.workers:
+                        _, url = heapq.heappop(schedule)
+                        in_flight.add(url)
+                        executor.submit(poll, url)
+                    timeout = reloaded + RELOAD_INTERVAL - now
+                    if schedule and len(in_flight) < self.workers:
+                        timeout = min(timeout, schedule[0][0] - now)
+                    self._wake.wait(max(timeout, 0.0))
+
+
+def _read_feed_list(path: str) -> List[str]:
+    """Feed URLs from a file, one per line; blank lines and # comments are skipped"""
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('urls', nargs='*', help='feeds to start watching')
+    parser.add_argument('--feeds', help='file with more feed URLs, one per line')
+    parser.add_argument('--store', help=f'state file (default: FEED_WATCHER_STORE or {DEFAULT_STORE_PATH})')
+    parser.add_argument('--platform', action='append', help='post only to this platform')
+    parser.add_argument('--template', default='{title}', help='post text, with {title} and {link}')
+    parser.add_argument('--workers', type=int, default=8, help='feeds fetched at once')
+    parser.add_argument('--min-interval', type=float, default=DEFAULT_MIN_INTERVAL)
+    parser.add_argument('--max-interval', type=float, default=DEFAULT_MAX_INTERVAL)
+    parser.add_argument('--post-existing', action='store_true',
+                        help="also post the entries new feeds already have")
+    parser.add_argument('--once', action='store_true', help='poll the feeds that are due once and exit')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    urls = args.urls + (_read_feed_list(args.feeds) if args.feeds else [])
+    watcher = FeedWatcher(store=FeedStore(args.store), platforms=args.platform, template=args.template,
+                          workers=args.workers, min_interval=args.min_interval,
+                          max_interval=args.max_interval, post_existing=args.post_existing)
+    for url in urls:
+        if watcher.add_feed(url):
+            logger.info(f"Watching {url}")
+    if not watcher.store.feeds():
+        parser.error('no feeds to watch')
+
+    if args.once:
+        for url, posted in watcher.run_once().items():
+            for entry in posted:
+                print(f"✓ {entry.link} (from {url})")
+        return 0
+
+    watcher.start()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        watcher.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
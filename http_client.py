@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from dataclasses import dataclass
+from typing import Optional, Dict
+from urllib.parse import urlsplit
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class HttpConfig:
+    """Connection pool, timeout and protocol settings for outbound HTTP"""
+    connect_timeout: float = 5.0
+    read_timeout: float = 10.0
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    max_connections_per_host: int = 6
+    http2: bool = False
+    user_agent: str = 'social-cross-posting (+https://github.com/omiq/social-cross-posting)'
+
+    def client_kwargs(self) -> dict:
+        """Keyword arguments for httpx.Client / httpx.AsyncClient"""
+        http2 = self.http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("HTTP/2 requested but the h2 package is not installed; using HTTP/1.1")
+                http2 = False
+        return {
+            'http2': http2,
+            'follow_redirects': True,
+            'headers': {'User-Agent': self.user_agent},
+            'timeout': httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            'limits': httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry
+            ),
+        }
+
+
+class DownloadRejected(ValueError):
+    """A download was aborted for being too large or of the wrong type"""
+
+
+def _check_headers(response: httpx.Response, max_bytes: int, content_type_prefix: str):
+    """Reject a response from its headers alone, before reading the body"""
+    content_type = response.headers.get('Content-Type', '')
+    if content_type_prefix and not content_type.startswith(content_type_prefix):
+        raise DownloadRejected(f"{response.url} is {content_type or 'untyped'}, not {content_type_prefix}*")
+    length = response.headers.get('Content-Length')
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise DownloadRejected(f"{response.url} is {length} bytes, over the {max_bytes} byte limit")
+
+
+def _host(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+class HttpClient:
+    """Pooled keep-alive HTTP client shared by everything that fetches pages and images
+
+    Connections to the same site are reused between fetches. On top of the
+    pool's overall limit, at most max_connections_per_host requests run
+    against one host at a time.
+    """
+
+    def __init__(self, config: Optional[HttpConfig] = None):
+        self.config = config or HttpConfig()
+        self._client = httpx.Client(**self.config.client_kwargs())
+        self._host_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._client.close()
+
+    def _slot(self, url: str) -> threading.BoundedSemaphore:
+        host = _host(url)
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.config.max_connections_per_host)
+            return self._host_slots[host]
+
+    @contextmanager
+    def stream(self, method: str, url: str, headers: Optional[Dict[str, str]] = None):
+        """Send a request and yield the response before its body has been read"""
+        with self._slot(url):
+            with self._client.stream(method, url, headers=headers) as response:
+                yield response
+
+    def get(self, url: str, headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+        """GET url and read the whole body"""
+        with self._slot(url):
+            return self._client.get(url, headers=headers)
+
+    def download(self, url: str, max_bytes: int, content_type_prefix: str = '') -> bytes:
+        """GET url and return its body, aborting once it goes over max_bytes
+
+        Raises DownloadRejected without reading the body when the headers
+        already show the wrong content type or a Content-Length over the cap.
+        """
+        with self.stream('GET', url) as response:
+            response.raise_for_status()
+            _check_headers(response, max_bytes, content_type_prefix)
+            chunks = []
+            received = 0
+            for chunk in response.iter_bytes():
+                received += len(chunk)
+                if received > max_bytes:
+                    raise DownloadRejected(f"{url} is over the {max_bytes} byte limit")
+                chunks.append(chunk)
+            return b''.join(chunks)
+
+
+class AsyncHttpClient:
+    """asyncio counterpart of HttpClient with the same pooling and limits"""
+
+    def __init__(self, config: Optional[HttpConfig] = None):
+        self.config = config or HttpConfig()
+        self._client = httpx.AsyncClient(**self.config.client_kwargs())
+        self._host_slots: Dict[str, asyncio.Semaphore] = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    def _slot(self, url: str) -> asyncio.Semaphore:
+        host = _host(url)
+        if host not in self._host_slots:
+            self._host_slots[host] = asyncio.Semaphore(self.config.max_connections_per_host)
+        return self._host_slots[host]
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, headers: Optional[Dict[str, str]] = None):
+        """Send a request and yield the response before its body has been read"""
+        async with self._slot(url):
+            async with self._client.stream(method, url, headers=headers) as response:
+                yield response
+
+    async def get(self, url: str, headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+        """GET url and read the whole body"""
+        async with self._slot(url):
+            return await self._client.get(url, headers=headers)
+
+    async def download(self, url: str, max_bytes: int, content_type_prefix: str = '') -> bytes:
+        """GET url and return its body, aborting once it goes over max_bytes"""
+        async with self.stream('GET', url) as response:
+            response.raise_for_status()
+            _check_headers(response, max_bytes, content_type_prefix)
+            chunks = []
+            received = 0
+            async for chunk in response.aiter_bytes():
+                received += len(chunk)
+                if received > max_bytes:
+                    raise DownloadRejected(f"{url} is over the {max_bytes} byte limit")
+                chunks.append(chunk)
+            return b''.join(chunks)
+
+
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+
+def shared_client() -> HttpClient:
+    """The process-wide HTTP client used when none is passed in"""
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            _shared_client = HttpClient()
+        return _shared_client
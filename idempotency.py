@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Optional, Dict, Any, Sequence
+
+DEFAULT_STORE_PATH = '.idempotency.sqlite3'
+# A post still marked in progress after this long was abandoned by a crashed process
+DEFAULT_PENDING_TIMEOUT = 10 * 60
+
+
+class PostInProgress(ValueError):
+    """Another call with the same idempotency key is posting to this platform right now"""
+
+
+class PreviousResult(dict):
+    """Result recorded for an idempotency key by an earlier post, returned instead of posting again"""
+
+
+def content_key(text: str, media: Sequence[bytes] = (), link: Optional[str] = None) -> str:
+    """Idempotency key derived from what is posted: the text, the media's digests and the link"""
+    digest = hashlib.sha256()
+    media_digests = b''.join(hashlib.sha256(item).digest() for item in media)
+    for part in (text.encode(), media_digests, (link or '').encode()):
+        # Length-prefixed so that different splits of the same bytes don't collide
+        digest.update(len(part).to_bytes(8, 'big'))
+        digest.update(part)
+    return 'content:' + digest.hexdigest()
+
+
+class IdempotencyStore:
+    """Per-platform outcomes of posts, by idempotency key, stored in SQLite
+
+    A post is recorded as pending before it is sent and as done, with the
+    platform's result, once it has gone out. A post made of several (a
+    thread) records its progress while pending; if it fails partway the
+    progress is kept, so a retry with the same key carries on from it
+    instead of starting over. Lookups go through the
+    (key, platform) primary key, so they cost the same few page reads with
+    millions of posts recorded. Several processes can share the file.
+    """
+
+    def __init__(self, path: Optional[str] = None, pending_timeout: float = DEFAULT_PENDING_TIMEOUT):
+        self.path = path or os.getenv('IDEMPOTENCY_STORE', DEFAULT_STORE_PATH)
+        self.pending_timeout = pending_timeout
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS posts (
+                key TEXT NOT NULL,
+                platform TEXT NOT NULL,
+                status TEXT NOT NULL,
+                result TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (key, platform)
+            ) WITHOUT ROWID
+        ''')
+
+    def begin(self, key: str, platform: str, max_age: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Return the recorded result for key on platform, or mark it pending and return None
+
+        A result older than max_age seconds is ignored and the post made
+        again. Raises PostInProgress if another call is posting it now.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._db.execute(
+                    'SELECT status, result, updated_at FROM posts WHERE key = ? AND platform = ?',
+                    (key, platform)
+                ).fetchone()
+                if row is not None:
+                    status, result, updated_at = row
+                    if status == 'done' and (max_age is None or now - updated_at <= max_age):
+                        self._db.execute('COMMIT')
+                        return json.loads(result)
+                    if status == 'pending' and now - updated_at < self.pending_timeout:
+                        self._db.execute('COMMIT')
+                        raise PostInProgress(f"A post with this idempotency key is already being sent to {platform}")
+                # Progress of an attempt that failed or was abandoned is kept for this one
+                progress = row[1] if row is not None and row[0] != 'done' else None
+                self._db.execute(
+                    "INSERT OR REPLACE INTO posts (key, platform, status, result, updated_at) "
+                    "VALUES (?, ?, 'pending', ?, ?)", (key, platform, progress, now)
+                )
+                self._db.execute('COMMIT')
+            except PostInProgress:
+                raise
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+        return None
+
+    def complete(self, key: str, platform: str, result: Dict[str, Any]):
+        """Record the result of a post that went out"""
+        with self._lock:
+            self._db.execute(
+                "UPDATE posts SET status = 'done', result = ?, updated_at = ? WHERE key = ? AND platform = ?",
+                (json.dumps(result), time.time(), key, platform)
+            )
+
+    def save_progress(self, key: str, platform: str, progress: Dict[str, Any]):
+        """Record how far a pending post got, e.g. the posts of a thread made so far"""
+        with self._lock:
+            self._db.execute(
+                "UPDATE posts SET result = ?, updated_at = ? WHERE key = ? AND platform = ? AND status = 'pending'",
+                (json.dumps(progress), time.time(), key, platform)
+            )
+
+    def progress(self, key: str, platform: str) -> Optional[Dict[str, Any]]:
+        """Progress recorded for a pending post, by this attempt or an earlier one that failed"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT result FROM posts WHERE key = ? AND platform = ? AND status = 'pending'", (key, platform)
+            ).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def abandon(self, key: str, platform: str):
+        """Give up on a pending post that failed, so the key can be used again
+
+        Progress it recorded is kept (as a partial post) for the next attempt.
+        """
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM posts WHERE key = ? AND platform = ? AND status = 'pending' AND result IS NULL",
+                (key, platform)
+            )
+            self._db.execute(
+                "UPDATE posts SET status = 'partial' WHERE key = ? AND platform = ? AND status = 'pending'",
+                (key, platform)
+            )
+
+    def get(self, key: str, platform: str) -> Optional[Dict[str, Any]]:
+        """The recorded result for key on platform, if it has been posted"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT result FROM posts WHERE key = ? AND platform = ? AND status = 'done'", (key, platform)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+
+_shared_store = None
+_shared_store_lock = threading.Lock()
+
+
+def shared_store() -> IdempotencyStore:
+    """The process-wide store used when none is passed in"""
+    global _shared_store
+    with _shared_store_lock:
+        if _shared_store is None:
+            _shared_store = IdempotencyStore()
+        return _shared_store
@@ -0,0 +1,211 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Callable, TYPE_CHECKING
+
+from platforms import ImageLimits
+
+if TYPE_CHECKING:
+    from images import ImageVariant
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = '.image_cache'
+# Bump when the image pipeline changes, so old entries are no longer used
+CACHE_VERSION = 2
+# Bytes each in-memory entry is counted as on top of its data (key, metadata, bookkeeping),
+# so pass-through entries, which hold no data, still count towards memory_bytes
+MEMORY_ENTRY_OVERHEAD = 512
+
+
+class ImageCache:
+    """Processed image variants keyed by the source bytes' hash and the target limits
+
+    A size-bounded in-memory LRU sits in front of an on-disk store, which
+    evicts its least recently used files once it grows past disk_bytes.
+    Variants that are just the untouched source are stored as a marker, so
+    a hit never decodes the image again. Pass directory=False for a
+    memory-only cache.
+    """
+
+    def __init__(self, directory: Optional[str] = None, memory_bytes: int = 64 * 1024 * 1024,
+                 disk_bytes: int = 512 * 1024 * 1024):
+        if directory is None:
+            directory = os.getenv('IMAGE_CACHE_DIR', DEFAULT_CACHE_DIR)
+        self.directory = directory or None
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk_size = None
+        self._lock = threading.Lock()
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters and current tier sizes"""
+        with self._lock:
+            if self._disk_size is None and self.directory:
+                self._disk_size = self._scan_disk_size()
+            return dict(self.counters, memory_bytes=self._memory_size,
+                        memory_entries=len(self._memory), disk_bytes=self._disk_size or 0)
+
+    @staticmethod
+    def key(digest: str, limits: ImageLimits) -> str:
+        """Cache key for the source with the given sha256 digest, processed for limits"""
+        profile = hashlib.sha256(f"{CACHE_VERSION}:{limits!r}".encode()).hexdigest()
+        return f"{digest}-{profile[:16]}"
+
+    def get_variants(self, source: bytes, limits: Dict[str, ImageLimits],
+                     on_variant: Optional[Callable[[str, 'ImageVariant'], None]] = None) -> Dict[str, 'ImageVariant']:
+        """Like images.prepare_variants, but only processes what isn't cached yet
+
+        on_variant is called for cached variants straight away.
+        """
+        from images import ImageVariant, prepare_variants
+
+        digest = hashlib.sha256(source).hexdigest()
+        variants = {}
+        missing = {}
+        for platform, platform_limits in limits.items():
+            entry = self._get(self.key(digest, platform_limits))
+            if entry is None:
+                missing[platform] = platform_limits
+                continue
+            meta, data = entry
+            variants[platform] = ImageVariant(
+                source if meta.get('passthrough') else data,
+                meta['mime_type'], meta['width'], meta['height']
+            )
+            if on_variant is not None:
+                on_variant(platform, variants[platform])
+
+        if missing:
+            processed = prepare_variants(source, missing, on_variant)
+            for platform, variant in processed.items():
+                meta = {'mime_type': variant.mime_type, 'width': variant.width,
+                        'height': variant.height}
+                data = variant.data
+                if data is source:
+                    meta['passthrough'] = True
+                    data = b''
+                self._put(self.key(digest, missing[platform]), meta, data)
+            variants.update(processed)
+        return variants
+
+    def _get(self, key: str):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.counters['memory_hits'] += 1
+                return entry
+
+        entry = self._read_disk(key)
+        with self._lock:
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            self.counters['disk_hits'] += 1
+        self._remember(key, entry)
+        return entry
+
+    def _put(self, key: str, meta: dict, data: bytes):
+        self._remember(key, (meta, data))
+        self._write_disk(key, meta, data)
+
+    @staticmethod
+    def _memory_cost(entry) -> int:
+        return len(entry[1]) + MEMORY_ENTRY_OVERHEAD
+
+    def _remember(self, key: str, entry):
+        size = self._memory_cost(entry)
+        if size > self.memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_size -= self._memory_cost(self._memory.pop(key))
+            self._memory[key] = entry
+            self._memory_size += size
+            while self._memory_size > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_size -= self._memory_cost(evicted)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def _read_disk(self, key: str):
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                meta = json.loads(f.readline())
+                data = f.read()
+        except (OSError, ValueError):
+            return None
+        # Reads count as use for LRU eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return meta, data
+
+    def _write_disk(self, key: str, meta: dict, data: bytes):
+        if not self.directory:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(json.dumps(meta).encode() + b'\n')
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write image cache entry {path}: {e}")
+            return
+
+        with self._lock:
+            if self._disk_size is None:
+                self._disk_size = self._scan_disk_size()
+            else:
+                self._disk_size += os.path.getsize(path)
+            over_budget = self._disk_size > self.disk_bytes
+        if over_budget:
+            self._evict_disk()
+
+    def _scan_disk_size(self) -> int:
+        return sum(size for _, _, size in self._disk_entries())
+
+    def _disk_entries(self):
+        """Yield (last_used, path, size) for every file in the disk store"""
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield stat.st_mtime, path, stat.st_size
+
+    def _evict_disk(self):
+        """Delete least recently used files until the store is at 90% of disk_bytes"""
+        entries = sorted(self._disk_entries())
+        total = sum(size for _, _, size in entries)
+        target = self.disk_bytes * 0.9
+        evicted = 0
+        for _, path, size in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+        with self._lock:
+            self._disk_size = total
+            self.counters['evictions'] += evicted
@@ -0,0 +1,210 @@
+import math
+from io import BytesIO
+from dataclasses import dataclass
+from typing import Dict, Tuple, Callable, Optional
+
+from PIL import Image, ImageOps
+
+from platforms import ImageLimits
+from metrics import shared_metrics
+
+# Link card thumbnails: about the size the apps show them at
+THUMBNAIL_LIMITS = ImageLimits(max_bytes=256 * 1024, max_pixels=1200 * 630)
+
+# Size of the thumbnail used to estimate how well an image compresses
+PROBE_SIZE = 512
+# Quality levels tried, from max_quality down
+QUALITY_STEP = 5
+# EXIF orientations that turn the image a quarter, swapping width and height
+_QUARTER_TURNS = {5, 6, 7, 8}
+
+
+@dataclass
+class CompressedImage:
+    """An encoded image and how it was produced"""
+    data: bytes
+    width: int
+    height: int
+    quality: int
+    encodes: int
+
+
+def _encode_jpeg(img: Image.Image, quality: int) -> bytes:
+    buffer = BytesIO()
+    img.save(buffer, format='JPEG', quality=quality, optimize=False)
+    return buffer.getvalue()
+
+
+def _probe_sizes(img: Image.Image, qualities) -> Dict[int, int]:
+    """Encoded sizes of a small thumbnail of img at each quality
+
+    Encoding the thumbnail is far cheaper than encoding the full image, and
+    its size curve over quality has nearly the same shape.
+    """
+    probe = img.copy()
+    probe.thumbnail((PROBE_SIZE, PROBE_SIZE), Image.Resampling.BILINEAR)
+    return {quality: len(_encode_jpeg(probe, quality)) for quality in qualities}
+
+
+def _scaled(img: Image.Image, scale: float) -> Image.Image:
+    width = max(1, int(img.width * scale))
+    height = max(1, int(img.height * scale))
+    return img.resize((width, height), Image.Resampling.LANCZOS)
+
+
+def compress_to_budget(img: Image.Image, max_bytes: int, min_quality: int = 60,
+                       max_quality: int = 95, max_encodes: int = 6) -> CompressedImage:
+    """Encode img as a JPEG of at most max_bytes in a small, bounded number of encodes
+
+    The first full encode is at max_quality, which is all that small images
+    need. Otherwise the size-over-quality curve of a thumbnail, scaled to
+    match that first encode, predicts the highest quality that fits. If
+    even min_quality is predicted not to fit, the image is downscaled first
+    so quality never has to drop below min_quality. Each miss re-calibrates
+    the prediction; after max_encodes full encodes the image is shrunk by
+    the remaining overshoot.
+    """
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    data = _encode_jpeg(img, max_quality)
+    encodes = 1
+    if len(data) <= max_bytes:
+        return CompressedImage(data, img.width, img.height, max_quality, encodes)
+
+    qualities = range(max_quality, min_quality - 1, -QUALITY_STEP)
+    probe = _probe_sizes(img, qualities)
+    calibration = len(data) / probe[max_quality]
+
+    def predict(quality):
+        return probe[quality] * calibration
+
+    lowest = qualities[-1]
+    if predict(lowest) > max_bytes:
+        scale = math.sqrt(max_bytes / predict(lowest)) * 0.95
+        img = _scaled(img, scale)
+        calibration *= scale * scale
+
+    fits, too_big = None, max_quality
+    while encodes < max_encodes:
+        candidates = [q for q in qualities if q < too_big and predict(q) <= max_bytes]
+        if not candidates:
+            candidates = [q for q in qualities if q < too_big]
+        if not candidates or (fits is not None and candidates[0] <= fits.quality):
+            break
+        quality = candidates[0]
+        data = _encode_jpeg(img, quality)
+        encodes += 1
+        # Re-calibrate on the real size at this quality for the next guess
+        calibration = len(data) / probe[quality]
+        if len(data) <= max_bytes:
+            fits = CompressedImage(data, img.width, img.height, quality, encodes)
+            break
+        too_big = quality
+
+    if fits is not None:
+        fits.encodes = encodes
+        return fits
+
+    # Prediction was too optimistic even at the lowest quality: shrink by the overshoot
+    scale = math.sqrt(max_bytes / len(data)) * 0.9
+    img = _scaled(img, scale)
+    data = _encode_jpeg(img, lowest)
+    return CompressedImage(data, img.width, img.height, lowest, encodes + 1)
+
+
+@dataclass
+class ImageVariant:
+    """An image ready to upload to one platform"""
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+
+
+def _fit_pixels(size: Tuple[int, int], max_pixels: int) -> Tuple[int, int]:
+    """Largest size with the same aspect ratio and at most max_pixels"""
+    width, height = size
+    if width * height <= max_pixels:
+        return size
+    scale = math.sqrt(max_pixels / (width * height))
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def _has_metadata(img: Image.Image) -> bool:
+    """Whether img carries EXIF or XMP, which can hold GPS and camera details"""
+    return bool(img.getexif()) or any(key in img.info for key in ('xmp', 'XML:com.adobe.xmp'))
+
+
+def prepare_variants(source: bytes, limits: Dict[str, ImageLimits],
+                     on_variant: Optional[Callable[[str, ImageVariant], None]] = None) -> Dict[str, ImageVariant]:
+    """Decode source once and produce an image variant for each entry in limits
+
+    A platform whose limits the source already meets gets the original bytes
+    untouched, unless the source has EXIF or XMP metadata: those are always
+    re-encoded, which drops the metadata and applies the EXIF orientation.
+    A JPEG source is decoded at reduced scale when even the largest variant
+    needs fewer pixels (JPEG draft mode), then resized and compressed to
+    each platform's limits. Platforms with the same limits share one encode.
+
+    on_variant(platform, variant) is called as soon as each platform's
+    variant is ready, before the others are encoded. Decode and encode
+    times and the number of encodes are recorded in the shared metrics.
+    """
+    metrics = shared_metrics()
+
+    def ready(platform, variant):
+        if on_variant is not None:
+            on_variant(platform, variant)
+
+    with Image.open(BytesIO(source)) as img:
+        has_metadata = _has_metadata(img)
+        quarter_turn = img.getexif().get(0x0112) in _QUARTER_TURNS
+        # Size as displayed, once the EXIF orientation is applied
+        original_size = img.size[::-1] if quarter_turn else img.size
+        original_mime = Image.MIME.get(img.format)
+        original = ImageVariant(source, original_mime, *original_size)
+
+        def passes_through(platform_limits):
+            return (not has_metadata
+                    and len(source) <= platform_limits.max_bytes
+                    and original_size[0] * original_size[1] <= platform_limits.max_pixels
+                    and original_mime in platform_limits.formats)
+
+        to_encode = {limit for limit in limits.values() if not passes_through(limit)}
+        for platform, limit in limits.items():
+            if limit not in to_encode:
+                ready(platform, original)
+        decoded = None
+        if to_encode:
+            largest = max(_fit_pixels(original_size, limit.max_pixels) for limit in to_encode)
+            with metrics.timer('crosspost_image_decode_seconds'):
+                if img.format == 'JPEG':
+                    # Draft sizes are in stored orientation, before the EXIF rotation
+                    img.draft('RGB', largest[::-1] if quarter_turn else largest)
+                img.load()
+                decoded = ImageOps.exif_transpose(img)
+                decoded = decoded if decoded.mode == 'RGB' else decoded.convert('RGB')
+
+    encoded = {}
+    for limit in sorted(to_encode, key=lambda limit: -limit.max_pixels):
+        if 'image/jpeg' not in limit.formats:
+            raise ValueError(f"Can't produce an image in any of {limit.formats}")
+        # Platforms with the same limits share the encode and its metrics
+        sharing = [platform for platform, platform_limit in limits.items() if platform_limit == limit]
+        label = ','.join(sharing)
+        with metrics.timer('crosspost_image_encode_seconds', platform=label):
+            target = _fit_pixels(decoded.size, limit.max_pixels)
+            img = decoded if target == decoded.size else decoded.resize(target, Image.Resampling.LANCZOS)
+            result = compress_to_budget(img, limit.max_bytes)
+        metrics.count('crosspost_image_encodes_total', result.encodes, platform=label)
+        encoded[limit] = ImageVariant(result.data, 'image/jpeg', result.width, result.height)
+        for platform in sharing:
+            ready(platform, encoded[limit])
+
+    return {platform: encoded.get(limit, original) for platform, limit in limits.items()}
+
+
+def make_thumbnail(source: bytes, limits: ImageLimits = THUMBNAIL_LIMITS) -> bytes:
+    """Downscale and recompress a link card image to fit limits"""
+    return prepare_variants(source, {'thumbnail': limits})['thumbnail'].data
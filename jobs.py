@@ -0,0 +1,396 @@
+import os
+import json
+import shutil
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Optional, Dict, Any, List, Sequence, Union, BinaryIO
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_PATH = '.jobs.sqlite3'
+# A running job whose worker stops renewing its lease for this long is handed out again
+DEFAULT_LEASE = 10 * 60
+# A job handed out this many times without finishing is marked failed
+DEFAULT_MAX_ATTEMPTS = 3
+# Job images larger than this are kept in files next to the queue rather than in it
+DEFAULT_SPILL_SIZE = 1024 * 1024
+
+
+@dataclass
+class Job:
+    """A post waiting in, or taken from, the queue"""
+    id: str
+    payload: Dict[str, Any]
+    # Image contents, or the path of an image kept on disk
+    images: List[Union[bytes, str]] = field(default_factory=list)
+    attempts: int = 0
+
+
+def execute_post(poster, payload: Dict[str, Any], images: Sequence[Union[bytes, str]] = ()) -> Dict[str, Any]:
+    """Run one post described by payload through poster and return its results
+
+    payload holds 'text', optional 'platforms' and 'idempotency_key', and
+    'link' or (with images) 'alt_texts' and 'filenames'. Without a link or
+    images it is a text post, posted as a thread if 'thread' is set.
+    """
+    text = payload['text']
+    platforms = payload.get('platforms')
+    key = payload.get('idempotency_key')
+    if images:
+        return poster.post_images(text, list(images), payload.get('alt_texts'),
+                                  platforms=platforms, idempotency_key=key)
+    elif payload.get('link'):
+        return poster.post_link(text, payload['link'], platforms=platforms, idempotency_key=key)
+    else:
+        return poster.post_text(text, platforms=platforms, idempotency_key=key,
+                                thread=bool(payload.get('thread')))
+
+
+class JobQueue:
+    """Post jobs persisted in SQLite, shared by every process using the same file
+
+    Jobs go from queued to running to done (or failed); their images are
+    kept alongside until then, in the database up to spill_size bytes and
+    in files in a directory next to it above that. A job is claimed with a lease, which its
+    worker renews while the job runs, so one left running by a crashed
+    worker is picked up again once the lease runs out. A job that has been
+    claimed max_attempts times without finishing is marked failed instead.
+    A queued job is not handed out before its run_at time; jobs are indexed
+    by it, so finding the next due one stays cheap however many are
+    scheduled.
+    """
+
+    def __init__(self, path: Optional[str] = None, lease: float = DEFAULT_LEASE,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS, spill_size: Optional[int] = None):
+        self.path = path or os.getenv('JOB_QUEUE_PATH', DEFAULT_QUEUE_PATH)
+        self.lease = lease
+        self.max_attempts = max_attempts
+        if spill_size is None:
+            spill_size = int(os.getenv('JOB_IMAGE_SPILL_SIZE', DEFAULT_SPILL_SIZE))
+        self.spill_size = spill_size
+        self.image_dir = self.path + '.images'
+        self._local = threading.local()
+        self._new_job = threading.Condition()
+        with self._connection() as db:
+            db.executescript('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    results TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    lease_until REAL,
+                    run_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS jobs_due ON jobs (status, run_at);
+                CREATE TABLE IF NOT EXISTS job_images (
+                    job_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    data BLOB,
+                    path TEXT,
+                    PRIMARY KEY (job_id, position)
+                );
+            ''')
+
+    def _connection(self) -> sqlite3.Connection:
+        """This thread's connection to the queue database"""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            self._local.db = db
+        return db
+
+    def enqueue(self, payload: Dict[str, Any], images: Sequence[Union[bytes, BinaryIO]] = (),
+                run_at: Optional[float] = None) -> str:
+        """Add a post to the queue and return its job id
+
+        Images are given as bytes or binary file objects, which are copied
+        in chunks so a large upload is never held in memory whole. The job
+        runs as soon as a worker is free, or not before run_at (Unix time)
+        if given.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        rows = []
+        db = self._connection()
+        try:
+            for position, image in enumerate(images):
+                rows.append((job_id, position) + self._store_image(job_id, position, image))
+            db.execute('BEGIN')
+            try:
+                db.execute(
+                    'INSERT INTO jobs (id, status, payload, created_at, run_at) VALUES (?, ?, ?, ?, ?)',
+                    (job_id, 'queued', json.dumps(payload), now, run_at if run_at is not None else now)
+                )
+                db.executemany(
+                    'INSERT INTO job_images (job_id, position, data, path) VALUES (?, ?, ?, ?)', rows
+                )
+                db.execute('COMMIT')
+            except Exception:
+                db.execute('ROLLBACK')
+                raise
+        except Exception:
+            self._remove_files([path for *_, path in rows if path])
+            raise
+        with self._new_job:
+            self._new_job.notify()
+        return job_id
+
+    def _store_image(self, job_id: str, position: int, image: Union[bytes, BinaryIO]):
+        """(data, path) to record for an image: its bytes, or the file it was copied to"""
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            head, rest = bytes(image), None
+        else:
+            head, rest = image.read(self.spill_size + 1), image
+        if len(head) <= self.spill_size:
+            return head, None
+        os.makedirs(self.image_dir, exist_ok=True)
+        path = os.path.join(self.image_dir, f'{job_id}-{position}')
+        try:
+            with open(path, 'wb') as f:
+                f.write(head)
+                if rest is not None:
+                    shutil.copyfileobj(rest, f)
+        except Exception:
+            self._remove_files([path])
+            raise
+        return None, path
+
+    @staticmethod
+    def _remove_files(paths: List[str]):
+        """Delete image files, ignoring ones already gone"""
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def claim(self) -> Optional[Job]:
+        """Take a job whose lease ran out, or else the earliest due one, and mark it running"""
+        now = time.time()
+        db = self._connection()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            abandoned = [job_id for (job_id,) in db.execute(
+                "SELECT id FROM jobs WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                (now, self.max_attempts)
+            )]
+            for job_id in abandoned:
+                logger.error(f"Job {job_id} was claimed {self.max_attempts} times without finishing")
+                db.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, finished_at = ?, "
+                    "lease_until = NULL WHERE id = ?",
+                    (f'Abandoned after {self.max_attempts} attempts', now, job_id)
+                )
+                self._drop_images(job_id)
+            row = db.execute(
+                "SELECT id, payload, attempts FROM jobs "
+                "WHERE status = 'running' AND lease_until < ? LIMIT 1", (now,)
+            ).fetchone()
+            if row is None:
+                row = db.execute(
+                    "SELECT id, payload, attempts FROM jobs "
+                    "WHERE status = 'queued' AND run_at <= ? ORDER BY run_at LIMIT 1", (now,)
+                ).fetchone()
+            if row is not None:
+                db.execute(
+                    "UPDATE jobs SET status = 'running', started_at = ?, lease_until = ?, "
+                    "attempts = attempts + 1 WHERE id = ?",
+                    (now, now + self.lease, row[0])
+                )
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        images = [data if path is None else path for data, path in db.execute(
+            'SELECT data, path FROM job_images WHERE job_id = ? ORDER BY position', (row[0],)
+        )]
+        return Job(id=row[0], payload=json.loads(row[1]), images=images, attempts=row[2] + 1)
+
+    def renew(self, job_id: str) -> bool:
+        """Extend a running job's lease; returns False if the job is no longer running"""
+        cursor = self._connection().execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running'",
+            (time.time() + self.lease, job_id)
+        )
+        return cursor.rowcount == 1
+
+    def next_due(self) -> Optional[float]:
+        """When the next queued job is due or a running job's lease runs out (Unix time)"""
+        row = self._connection().execute(
+            "SELECT MIN(due) FROM ("
+            "SELECT MIN(run_at) AS due FROM jobs WHERE status = 'queued' UNION ALL "
+            "SELECT MIN(lease_until) FROM jobs WHERE status = 'running')"
+        ).fetchone()
+        return row[0]
+
+    def cancel(self, job_id: str) -> bool:
+        """Withdraw a job that hasn't started yet; returns False if it already has"""
+        cursor = self._connection().execute(
+            "UPDATE jobs SET status = 'cancelled', finished_at = ? "
+            "WHERE id = ? AND status = 'queued'",
+            (time.time(), job_id)
+        )
+        if cursor.rowcount != 1:
+            return False
+        self._drop_images(job_id)
+        return True
+
+    def _drop_images(self, job_id: str):
+        """Delete the images of a job that won't run again"""
+        db = self._connection()
+        paths = [path for (path,) in db.execute(
+            'SELECT path FROM job_images WHERE job_id = ? AND path IS NOT NULL', (job_id,)
+        )]
+        db.execute('DELETE FROM job_images WHERE job_id = ?', (job_id,))
+        self._remove_files(paths)
+
+    def wait_for_job(self, timeout: float):
+        """Block until a job is enqueued in this process or timeout seconds pass"""
+        with self._new_job:
+            self._new_job.wait(timeout)
+
+    def wake_all(self):
+        """Wake every thread in this process waiting in wait_for_job"""
+        with self._new_job:
+            self._new_job.notify_all()
+
+    def complete(self, job_id: str, results: Dict[str, Any], timings: Dict[str, float],
+                 stages: Optional[Dict[str, Dict[str, float]]] = None):
+        """Record a finished job's per-platform results and timings, and image posts' stage times"""
+        outcome = {'results': results, 'timings': timings}
+        if stages:
+            outcome['stages'] = stages
+        self._connection().execute(
+            "UPDATE jobs SET status = 'done', results = ?, finished_at = ?, "
+            "lease_until = NULL WHERE id = ?",
+            (json.dumps(outcome), time.time(), job_id)
+        )
+        self._drop_images(job_id)
+
+    def fail(self, job_id: str, error: str):
+        """Record a job that could not be run at all"""
+        self._connection().execute(
+            "UPDATE jobs SET status = 'failed', error = ?, finished_at = ?, "
+            "lease_until = NULL WHERE id = ?",
+            (error, time.time(), job_id)
+        )
+        self._drop_images(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Status and results of a job, or None if there is no such job"""
+        row = self._connection().execute(
+            'SELECT id, status, payload, results, error, attempts, created_at, started_at, finished_at, run_at '
+            'FROM jobs WHERE id = ?', (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        payload = json.loads(row[2])
+        outcome = json.loads(row[3]) if row[3] else {}
+        return {
+            'id': row[0],
+            'status': row[1],
+            'platforms': payload.get('platforms'),
+            'results': outcome.get('results'),
+            'timings': outcome.get('timings'),
+            'stages': outcome.get('stages'),
+            'error': row[4],
+            'attempts': row[5],
+            'created_at': row[6],
+            'started_at': row[7],
+            'finished_at': row[8],
+            'run_at': row[9],
+        }
+
+
+class JobWorkers:
+    """Background threads that run queued jobs through a SocialMediaPoster"""
+
+    def __init__(self, queue: JobQueue, poster, workers: int = 2, poll_interval: float = 1.0):
+        self.queue = queue
+        self.poster = poster
+        self.workers = workers
+        # Jobs enqueued by other processes are only noticed by polling; jobs
+        # scheduled for later are woken for exactly when they are due
+        self.poll_interval = poll_interval
+        self._threads: List[threading.Thread] = []
+        self._stopping = threading.Event()
+
+    def start(self):
+        """Start the worker threads"""
+        self._stopping.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'post-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None):
+        """Ask the workers to stop once their current job is done, and wait for them"""
+        self._stopping.set()
+        self.queue.wake_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _work(self):
+        while not self._stopping.is_set():
+            try:
+                job = self.queue.claim()
+            except Exception as e:
+                logger.error(f"Could not claim a job: {e}")
+                self.queue.wait_for_job(self.poll_interval)
+                continue
+            if job is None:
+                self.queue.wait_for_job(self._idle_timeout())
+                continue
+            self.run(job)
+
+    def _idle_timeout(self) -> float:
+        """How long to wait for a new job before looking at the queue again"""
+        try:
+            due = self.queue.next_due()
+        except Exception as e:
+            logger.error(f"Could not read the queue: {e}")
+            return self.poll_interval
+        if due is None:
+            return self.poll_interval
+        return min(self.poll_interval, max(due - time.time(), 0.0))
+
+    def run(self, job: Job):
+        """Run one job and record its outcome
+
+        The job's lease is renewed while it runs, so waiting on rate limits
+        or media processing doesn't let another worker claim it.
+        """
+        finished = threading.Event()
+
+        def renew_lease():
+            while not finished.wait(self.queue.lease / 3):
+                try:
+                    self.queue.renew(job.id)
+                except Exception as e:
+                    logger.warning(f"Could not renew the lease of job {job.id}: {e}")
+
+        renewer = threading.Thread(target=renew_lease, name=f'lease-{job.id[:8]}', daemon=True)
+        renewer.start()
+        try:
+            results = execute_post(self.poster, job.payload, job.images)
+            self.queue.complete(job.id, self.poster.describe_results(results),
+                                getattr(results, 'timings', {}), getattr(results, 'stages', None))
+        except Exception as e:
+            logger.exception(f"Job {job.id} failed")
+            self.queue.fail(job.id, str(e))
+        finally:
+            finished.set()
+            renewer.join()
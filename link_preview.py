@@ -0,0 +1,207 @@
+import os
+import time
+import logging
+import sqlite3
+import threading
+from dataclasses import dataclass, replace
+from typing import Optional, Dict, Tuple, TYPE_CHECKING
+
+from opengraph import PageMetadata, extract_metadata
+from metrics import shared_metrics
+
+if TYPE_CHECKING:
+    from http_client import HttpClient
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = '.link_previews.sqlite3'
+DEFAULT_TTL = 60 * 60
+CHUNK_SIZE = 16 * 1024
+# Link card images larger than this are not downloaded
+MAX_THUMBNAIL_DOWNLOAD = 5 * 1024 * 1024
+# Sent when a 304 comes back with no cached preview to keep
+REFETCH_HEADERS = {'Cache-Control': 'no-cache', 'Pragma': 'no-cache'}
+
+
+@dataclass
+class LinkPreview:
+    """What a link card shows for a URL, plus what we need to revalidate it"""
+    url: str
+    title: Optional[str]
+    description: Optional[str]
+    image_url: Optional[str]
+    thumb: Optional[bytes]
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    fetched_at: float = 0.0
+
+
+class LinkPreviewCache:
+    """Link previews stored in SQLite, fresh for ttl seconds and then revalidated
+
+    Stale entries are revalidated with If-None-Match / If-Modified-Since, so
+    an unchanged page costs a single 304 round trip and no thumbnail download.
+    Pass path=':memory:' for a cache that isn't kept on disk.
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl: float = DEFAULT_TTL):
+        self.path = path or os.getenv('LINK_PREVIEW_CACHE', DEFAULT_CACHE_PATH)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS link_previews (
+                url TEXT PRIMARY KEY,
+                title TEXT,
+                description TEXT,
+                image_url TEXT,
+                thumb BLOB,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL
+            )
+        ''')
+        self._db.commit()
+
+    def get(self, url: str) -> Optional[LinkPreview]:
+        """Return the stored preview for url, fresh or not"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT url, title, description, image_url, thumb, etag, last_modified, fetched_at '
+                'FROM link_previews WHERE url = ?', (url,)
+            ).fetchone()
+        return LinkPreview(*row) if row else None
+
+    def put(self, preview: LinkPreview):
+        """Store a preview, replacing any previous one for its URL"""
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO link_previews VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (preview.url, preview.title, preview.description, preview.image_url,
+                 preview.thumb, preview.etag, preview.last_modified, preview.fetched_at)
+            )
+            self._db.commit()
+
+    def is_fresh(self, preview: LinkPreview) -> bool:
+        """Whether preview can be used without asking the server"""
+        return time.time() - preview.fetched_at < self.ttl
+
+    @staticmethod
+    def revalidation_headers(preview: Optional[LinkPreview]) -> Dict[str, str]:
+        """Conditional request headers for refreshing preview"""
+        headers = {}
+        if preview is not None:
+            if preview.etag:
+                headers['If-None-Match'] = preview.etag
+            if preview.last_modified:
+                headers['If-Modified-Since'] = preview.last_modified
+        return headers
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def shared_cache() -> LinkPreviewCache:
+    """The process-wide cache used by default by every link poster"""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = LinkPreviewCache()
+        return _shared_cache
+
+
+def preview_from_response(url: str, previous: Optional[LinkPreview], status_code: int,
+                          headers, metadata: Optional[PageMetadata]) -> Tuple[LinkPreview, bool]:
+    """Build the new preview from a (possibly conditional) page response
+
+    Returns the preview and whether its thumbnail still has to be downloaded.
+    A 304 keeps everything from previous; a changed page keeps the previous
+    thumbnail if the og:image URL is the same. Either way a thumbnail that
+    failed to download last time is tried again.
+    """
+    now = time.time()
+    if status_code == 304:
+        if previous is None:
+            raise ValueError(f"{url} answered 304 Not Modified with no cached preview to keep")
+        return replace(previous, fetched_at=now), bool(previous.image_url) and previous.thumb is None
+
+    thumb = None
+    if previous is not None and previous.image_url == metadata.image_url:
+        thumb = previous.thumb
+    preview = LinkPreview(
+        url=url,
+        title=metadata.title,
+        description=metadata.description,
+        image_url=metadata.image_url,
+        thumb=thumb,
+        etag=headers.get('ETag'),
+        last_modified=headers.get('Last-Modified'),
+        fetched_at=now
+    )
+    return preview, bool(metadata.image_url) and thumb is None
+
+
+def fetch_thumbnail(http: 'HttpClient', image_url: str) -> Optional[bytes]:
+    """Download a link card image with a size cap and shrink it to card size
+
+    Returns None, rather than failing the post, when the image is too big,
+    isn't an image, or can't be fetched or decoded.
+    """
+    from images import make_thumbnail
+    try:
+        with shared_metrics().timer('crosspost_thumbnail_download_seconds'):
+            data = http.download(image_url, MAX_THUMBNAIL_DOWNLOAD, content_type_prefix='image/')
+        return make_thumbnail(data)
+    except Exception as e:
+        logger.warning(f"Skipping link card image {image_url}: {e}")
+        return None
+
+
+def _fetch_metadata(http: 'HttpClient', url: str, headers: Dict[str, str]):
+    """GET url and read its metadata, or None for a 304"""
+    with http.stream('GET', url, headers=headers) as response:
+        metadata = None
+        if response.status_code != 304:
+            response.raise_for_status()
+            metadata = extract_metadata(
+                response.iter_bytes(CHUNK_SIZE), str(response.url),
+                response.headers.get('Content-Type')
+            )
+    return response, metadata
+
+
+def get_link_preview(url: str, cache: Optional[LinkPreviewCache] = None,
+                     http: Optional['HttpClient'] = None) -> LinkPreview:
+    """Get the link preview for url, from the cache when possible
+
+    The page is streamed and only read up to the end of its <head>. Fetches
+    go through http, by default the process-wide pooled client.
+    """
+    from http_client import shared_client
+
+    if cache is None:
+        cache = shared_cache()
+    if http is None:
+        http = shared_client()
+    metrics = shared_metrics()
+    previous = cache.get(url)
+    if previous is not None and cache.is_fresh(previous):
+        metrics.count('crosspost_link_previews_total', result='cached')
+        return previous
+
+    # The page is parsed as it streams in, so this times fetch and parse together
+    with metrics.timer('crosspost_link_preview_fetch_seconds'):
+        response, metadata = _fetch_metadata(http, url, cache.revalidation_headers(previous))
+        if response.status_code == 304 and previous is None:
+            # A cache along the way answered a request we never made conditional
+            response, metadata = _fetch_metadata(http, url, REFETCH_HEADERS)
+    metrics.count('crosspost_link_previews_total',
+                  result='not_modified' if response.status_code == 304 else 'fetched')
+    preview, needs_thumb = preview_from_response(
+        url, previous, response.status_code, response.headers, metadata
+    )
+    if needs_thumb:
+        preview.thumb = fetch_thumbnail(http, preview.image_url)
+    cache.put(preview)
+    return preview
@@ -0,0 +1,194 @@
+"""Timings and counters for each stage of a cross-post
+
+Instrumentation is off until enabled, and then costs a lock and a few
+additions per observation. Metrics are kept in one process-wide registry:
+
+    from metrics import shared_metrics
+
+    shared_metrics().enable()                # collect, e.g. for /metrics
+    shared_metrics().add_hook(print)         # or have every observation passed on
+    print(shared_metrics().render())         # Prometheus text format
+"""
+import os
+import time
+import bisect
+import logging
+import threading
+from contextlib import nullcontext
+from typing import Dict, Tuple, List, Callable
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+Hook = Callable[[str, Dict[str, str], float], None]
+
+# Returned by timer() while disabled, so timing a block costs one attribute check
+_NULL_TIMER = nullcontext()
+
+
+class _Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, buckets: int):
+        self.counts = [0] * buckets
+        self.sum = 0.0
+        self.count = 0
+
+
+class _Timer:
+    __slots__ = ('metrics', 'name', 'labels', 'start')
+
+    def __init__(self, metrics: 'Metrics', name: str, labels: Dict[str, str]):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Labels, extra: str = '') -> str:
+    parts = [f'{key}="{_escape(value)}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class Metrics:
+    """Counters and latency histograms, by metric name and labels
+
+    Nothing is recorded while disabled. Hooks are called with
+    (name, labels, value) for every observation, value being the seconds
+    for timings and the increment for counters.
+    """
+
+    def __init__(self, enabled: bool = False, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = tuple(sorted(buckets))
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], _Histogram] = {}
+        self._hooks: List[Hook] = []
+        self._lock = threading.Lock()
+
+    def enable(self):
+        """Start recording"""
+        self.enabled = True
+
+    def disable(self):
+        """Stop recording; what was recorded so far is kept"""
+        self.enabled = False
+
+    def add_hook(self, hook: Hook):
+        """Call hook(name, labels, value) for every observation from now on, and start recording"""
+        with self._lock:
+            self._hooks = self._hooks + [hook]
+        self.enabled = True
+
+    def remove_hook(self, hook: Hook):
+        """Stop calling hook"""
+        with self._lock:
+            self._hooks = [h for h in self._hooks if h is not hook]
+
+    def count(self, name: str, value: float = 1, **labels: str):
+        """Add value to the counter name with labels"""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        if self._hooks:
+            self._notify(name, labels, value)
+
+    def observe(self, name: str, seconds: float, **labels: str):
+        """Record a duration in the histogram name with labels"""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        bucket = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(len(self.buckets) + 1)
+            histogram.counts[bucket] += 1
+            histogram.sum += seconds
+            histogram.count += 1
+        if self._hooks:
+            self._notify(name, labels, seconds)
+
+    def timer(self, name: str, **labels: str):
+        """Context manager that records how long its block took in the histogram name"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, labels)
+
+    def _notify(self, name: str, labels: Dict[str, str], value: float):
+        for hook in self._hooks:
+            try:
+                hook(name, labels, value)
+            except Exception as e:
+                logger.warning(f"Metrics hook {hook!r} failed: {e}")
+
+    def snapshot(self) -> Dict[str, Dict[Labels, float]]:
+        """Counter values and histogram counts and sums, by name and then labels"""
+        result: Dict[str, Dict[Labels, float]] = {}
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                result.setdefault(name, {})[labels] = value
+            for (name, labels), histogram in self._histograms.items():
+                result.setdefault(name + '_count', {})[labels] = histogram.count
+                result.setdefault(name + '_sum', {})[labels] = histogram.sum
+        return result
+
+    def render(self) -> str:
+        """Everything recorded, in the Prometheus text exposition format"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                (key, list(histogram.counts), histogram.sum, histogram.count)
+                for key, histogram in self._histograms.items()
+            )
+        bounds = ['le="%g"' % bound for bound in self.buckets] + ['le="+Inf"']
+        lines = []
+        last_name = None
+        for (name, labels), value in counters:
+            if name != last_name:
+                lines.append(f'# TYPE {name} counter')
+                last_name = name
+            lines.append(f'{name}{_format_labels(labels)} {value:g}')
+        for (name, labels), counts, total, count in histograms:
+            if name != last_name:
+                lines.append(f'# TYPE {name} histogram')
+                last_name = name
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{_format_labels(labels, bound)} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {total:.6f}')
+            lines.append(f'{name}_count{_format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+_shared_metrics = None
+_shared_metrics_lock = threading.Lock()
+
+
+def shared_metrics() -> Metrics:
+    """The process-wide registry every module records into; enabled by METRICS_ENABLED=1"""
+    global _shared_metrics
+    # Called on hot paths, so the lock is only taken until it exists
+    if _shared_metrics is None:
+        with _shared_metrics_lock:
+            if _shared_metrics is None:
+                _shared_metrics = Metrics(enabled=os.getenv('METRICS_ENABLED', '') in ('1', 'true', 'yes'))
+    return _shared_metrics
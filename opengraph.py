@@ -0,0 +1,128 @@
+import codecs
+from dataclasses import dataclass
+from html.parser import HTMLParser
+from typing import Optional, Iterable, Dict
+from urllib.parse import urljoin
+
+# Stop reading a page after this many bytes even if </head> hasn't been seen
+DEFAULT_MAX_BYTES = 512 * 1024
+
+# Tags tried in order for each field; the first one present wins
+_FIELD_TAGS = {
+    'title': ('og:title', 'twitter:title'),
+    'description': ('og:description', 'twitter:description', 'description'),
+    'image_url': ('og:image', 'og:image:url', 'og:image:secure_url', 'twitter:image', 'twitter:image:src'),
+}
+
+
+@dataclass
+class PageMetadata:
+    """Link card fields of a page; any of them may be missing"""
+    title: Optional[str] = None
+    description: Optional[str] = None
+    image_url: Optional[str] = None
+
+
+class _HeadParser(HTMLParser):
+    """Collects <meta> tags and <title> until the end of <head>"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.meta: Dict[str, str] = {}
+        self.title: Optional[str] = None
+        self.done = False
+        self._in_title = False
+        self._title_parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'meta':
+            attrs = dict(attrs)
+            # Sites use property= or name= and put the attributes in any order
+            key = attrs.get('property') or attrs.get('name')
+            content = attrs.get('content')
+            if key and content is not None:
+                self.meta.setdefault(key.strip().lower(), content.strip())
+                # No need to read the rest of <head> once every og: field is found
+                if all(self.meta.get(tags[0]) for tags in _FIELD_TAGS.values()):
+                    self.done = True
+        elif tag == 'title' and self.title is None:
+            self._in_title = True
+        elif tag == 'body':
+            self.done = True
+
+    def handle_endtag(self, tag):
+        if tag == 'title' and self._in_title:
+            self._in_title = False
+            self.title = ''.join(self._title_parts).strip() or None
+        elif tag == 'head':
+            self.done = True
+
+    def handle_data(self, data):
+        if self._in_title:
+            self._title_parts.append(data)
+
+
+def _charset(content_type: Optional[str]) -> str:
+    """Charset from a Content-Type header, falling back to UTF-8"""
+    if content_type:
+        for param in content_type.split(';')[1:]:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'charset':
+                charset = value.strip().strip('"\'')
+                try:
+                    codecs.lookup(charset)
+                    return charset
+                except LookupError:
+                    break
+    return 'utf-8'
+
+
+class MetadataExtractor:
+    """Incremental <head> parser: feed() it chunks until it reports it is done
+
+    Reading stops at </head> (or <body>) or once max_bytes have been fed,
+    whichever comes first.
+    """
+
+    def __init__(self, url: str = '', content_type: Optional[str] = None,
+                 max_bytes: int = DEFAULT_MAX_BYTES):
+        self.url = url
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+        self._decoder = codecs.getincrementaldecoder(_charset(content_type))(errors='replace')
+        self._parser = _HeadParser()
+
+    @property
+    def done(self) -> bool:
+        return self._parser.done or self.bytes_read >= self.max_bytes
+
+    def feed(self, chunk: bytes) -> bool:
+        """Parse the next chunk of the page; returns True once no more input is needed"""
+        if self.done:
+            return True
+        chunk = chunk[:self.max_bytes - self.bytes_read]
+        self.bytes_read += len(chunk)
+        self._parser.feed(self._decoder.decode(chunk))
+        return self.done
+
+    def result(self) -> PageMetadata:
+        """The metadata found so far"""
+        meta = self._parser.meta
+        fields = {}
+        for field, tags in _FIELD_TAGS.items():
+            fields[field] = next((meta[tag] for tag in tags if meta.get(tag)), None)
+        if fields['title'] is None:
+            fields['title'] = self._parser.title
+        if fields['image_url'] and self.url:
+            fields['image_url'] = urljoin(self.url, fields['image_url'])
+        return PageMetadata(**fields)
+
+
+def extract_metadata(chunks: Iterable[bytes], url: str = '', content_type: Optional[str] = None,
+                     max_bytes: int = DEFAULT_MAX_BYTES) -> PageMetadata:
+    """Read chunks of a page only as far as needed and return its link card metadata"""
+    extractor = MetadataExtractor(url, content_type, max_bytes)
+    for chunk in chunks:
+        if extractor.feed(chunk):
+            break
+    return extractor.result()
@@ -0,0 +1,269 @@
+import time
+import random
+import asyncio
+import logging
+import threading
+from datetime import datetime
+from dataclasses import dataclass
+from typing import Optional, Dict, Mapping, Callable, Any, Tuple, Sequence
+
+from metrics import shared_metrics
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth sending the same request again for
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# The only one of them that is safe to retry for a call that creates something:
+# after a 5xx the server may have carried out the request anyway
+CREATE_RETRY_STATUSES = frozenset({429})
+
+
+@dataclass
+class RateLimitInfo:
+    """Rate limit state a server reported with its last response"""
+    limit: Optional[int] = None
+    remaining: Optional[int] = None
+    # Unix time at which the window resets
+    reset_at: Optional[float] = None
+    # Seconds to wait before the next request (Retry-After)
+    retry_after: Optional[float] = None
+
+
+def _parse_reset(value: str, now: float) -> Optional[float]:
+    """Reset header as Unix time; it may be Unix time, seconds from now or an ISO 8601 date"""
+    try:
+        number = float(value)
+    except ValueError:
+        try:
+            return datetime.fromisoformat(value.strip()).timestamp()
+        except ValueError:
+            return None
+    # Small numbers are a delay (IETF draft), large ones a timestamp (Bluesky)
+    return number if number > 1e9 else now + number
+
+
+def parse_headers(headers: Mapping[str, str]) -> Optional[RateLimitInfo]:
+    """Read X-RateLimit-* (Mastodon) or RateLimit-* (Bluesky) response headers"""
+    headers = {key.lower(): value for key, value in headers.items()}
+    now = time.time()
+    info = RateLimitInfo()
+    for prefix in ('x-ratelimit-', 'ratelimit-'):
+        if prefix + 'remaining' in headers:
+            try:
+                info.limit = int(headers.get(prefix + 'limit', '').split(';')[0] or 0) or None
+                info.remaining = int(headers[prefix + 'remaining'])
+            except ValueError:
+                continue
+            if prefix + 'reset' in headers:
+                info.reset_at = _parse_reset(headers[prefix + 'reset'], now)
+            break
+    if 'retry-after' in headers:
+        try:
+            info.retry_after = max(float(headers['retry-after']), 0.0)
+        except ValueError:
+            pass
+    if info.remaining is None and info.retry_after is None:
+        return None
+    return info
+
+
+class TokenBucket:
+    """Paces calls to `rate` per second with bursts of up to `capacity`
+
+    What the server reports overrides the configured pace: the bucket never
+    holds more tokens than the server says remain, spreads those over the
+    time left in the window, and stops handing out tokens altogether until
+    the window resets once the server says none remain.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self) -> float:
+        """Take a token and return how many seconds to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # Tokens can go negative: each waiter queues behind the previous one
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self._paused_until - now)
+
+    def acquire(self) -> float:
+        """Block until a call may be made, and return how long that took"""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return max(wait, 0.0)
+
+    def pause(self, seconds: float):
+        """Hand out no tokens for the next `seconds`"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def learn(self, info: RateLimitInfo):
+        """Adjust the pace to the limits the server reported"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            until_reset = info.reset_at - time.time() if info.reset_at else None
+            if info.remaining is not None:
+                self.tokens = min(self.tokens, info.remaining)
+                if info.remaining <= 0 and until_reset and until_reset > 0:
+                    self._paused_until = max(self._paused_until, now + until_reset)
+                elif until_reset and until_reset > 0:
+                    # The fastest pace that doesn't run out before the window resets, never
+                    # faster than configured: the server's window may be shared with other clients
+                    self.rate = min(max(info.remaining / until_reset, self.base_rate / 10), self.base_rate)
+                else:
+                    self.rate = self.base_rate
+            if info.retry_after:
+                self._paused_until = max(self._paused_until, now + info.retry_after)
+
+
+class RateLimiter:
+    """Token buckets per platform account, and retries for 429 and 5xx responses
+
+    Buckets are keyed by the adapter's rate_limit_key, so every poster in
+    the process posting as the same account shares one budget. Media
+    uploads and reads have buckets of their own, as platforms limit them
+    separately.
+    Retries use exponential backoff with full jitter, and wait at least as
+    long as the server asked to on a 429.
+    """
+
+    def __init__(self, max_retries: int = 4, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, key: str, rate: float, capacity: int) -> TokenBucket:
+        """The bucket for key, created with rate and capacity on first use"""
+        with self._lock:
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(rate, capacity)
+            return self._buckets[key]
+
+    def backoff(self, attempt: int, status: int, info: Optional[RateLimitInfo]) -> float:
+        """Seconds to wait before retry number attempt + 1"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if status == 429 and info is not None:
+            if info.retry_after is not None:
+                delay = max(delay, info.retry_after)
+            elif info.reset_at is not None:
+                delay = max(delay, info.reset_at - time.time())
+        return min(delay, self.max_delay * 5)
+
+    def _bucket_for(self, adapter, media: bool, read: bool) -> TokenBucket:
+        if media:
+            return self.bucket(adapter.rate_limit_key + ':media', *adapter.media_rate_limit)
+        if read:
+            return self.bucket(adapter.rate_limit_key + ':read', *adapter.read_rate_limit)
+        return self.bucket(adapter.rate_limit_key, *adapter.rate_limit)
+
+    @staticmethod
+    def _attempt(adapter, fn: Callable[..., Any], args: Sequence[Any]) -> Tuple[Any, Optional[Exception],
+                                                                              Optional[RateLimitInfo]]:
+        """Call fn(*args) once: (result, error, rate limit state reported with the response)
+
+        The state is read in the thread that made the call, as adapters keep
+        the last response's headers per thread.
+        """
+        try:
+            result = fn(*args)
+        except Exception as e:
+            return None, e, adapter.rate_limit_info(e)
+        return result, None, adapter.rate_limit_info()
+
+    def _retry_delay(self, adapter, bucket: TokenBucket, error: Exception, info: Optional[RateLimitInfo],
+                     attempt: int, create: bool) -> Optional[float]:
+        """Seconds to wait before retrying a failed call, or None if it shouldn't be retried"""
+        status = adapter.error_status(error)
+        if status not in (CREATE_RETRY_STATUSES if create else RETRY_STATUSES) or attempt >= self.max_retries:
+            return None
+        shared_metrics().count('crosspost_retries_total', platform=adapter.name, status=str(status))
+        delay = self.backoff(attempt, status, info)
+        if status == 429:
+            # Hold back every other caller on this account too
+            bucket.pause(delay)
+        logger.warning(f"{adapter.name} returned {status}; retry {attempt + 1} of "
+                       f"{self.max_retries} in {delay:.1f}s")
+        return delay
+
+    def call(self, adapter, fn: Callable[..., Any], *args, media: bool = False, read: bool = False,
+             create: bool = False) -> Any:
+        """Call fn(*args) for adapter once its bucket allows, retrying 429 and 5xx
+
+        With media, the call is paced by the account's media upload bucket,
+        and with read by the bucket for calls that only fetch. With create,
+        fn creates a post, and only 429s (which the server rejected without
+        acting on) are retried, so a 5xx can't lead to a second copy.
+        """
+        bucket = self._bucket_for(adapter, media, read)
+        metrics = shared_metrics()
+        attempt = 0
+        while True:
+            waited = bucket.acquire()
+            if waited:
+                metrics.observe('crosspost_rate_limit_wait_seconds', waited, platform=adapter.name)
+            result, error, info = self._attempt(adapter, fn, args)
+            if info is not None:
+                bucket.learn(info)
+            if error is None:
+                return result
+            delay = self._retry_delay(adapter, bucket, error, info, attempt, create)
+            if delay is None:
+                raise error
+            time.sleep(delay)
+            attempt += 1
+
+    async def acall(self, adapter, fn: Callable[..., Any], *args, media: bool = False, read: bool = False,
+                    create: bool = False) -> Any:
+        """Like call(), for asyncio: fn runs in a worker thread and waits are asyncio.sleep
+
+        No thread is held while waiting for the bucket or a retry, so calls
+        held back by rate limits don't tie up the default executor.
+        """
+        bucket = self._bucket_for(adapter, media, read)
+        metrics = shared_metrics()
+        attempt = 0
+        while True:
+            waited = max(bucket.reserve(), 0.0)
+            if waited:
+                await asyncio.sleep(waited)
+                metrics.observe('crosspost_rate_limit_wait_seconds', waited, platform=adapter.name)
+            result, error, info = await asyncio.to_thread(self._attempt, adapter, fn, args)
+            if info is not None:
+                bucket.learn(info)
+            if error is None:
+                return result
+            delay = self._retry_delay(adapter, bucket, error, info, attempt, create)
+            if delay is None:
+                raise error
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+_shared_limiter = None
+_shared_limiter_lock = threading.Lock()
+
+
+def shared_limiter() -> RateLimiter:
+    """The process-wide rate limiter used when none is passed in"""
+    global _shared_limiter
+    with _shared_limiter_lock:
+        if _shared_limiter is None:
+            _shared_limiter = RateLimiter()
+        return _shared_limiter
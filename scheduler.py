@@ -0,0 +1,87 @@
+"""Schedule posts for later
+
+Scheduled posts are jobs in the job queue with a due time, so they are
+kept on disk, survive restarts, and are sent by any JobWorkers using the
+same queue file (including the web app's):
+
+    scheduler = Scheduler()
+    scheduler.schedule_post("New article!", at=datetime(2025, 6, 1, 9, 0), link="https://...")
+    scheduler.start()
+"""
+import os
+import time
+import logging
+from datetime import datetime, timedelta
+from typing import Optional, List, Union, BinaryIO
+
+from jobs import JobQueue, JobWorkers
+
+logger = logging.getLogger(__name__)
+
+
+def _timestamp(at: Union[datetime, float]) -> float:
+    """Unix time of at; naive datetimes are taken as local time"""
+    return at.timestamp() if isinstance(at, datetime) else float(at)
+
+
+class Scheduler:
+    """Posts to send at a given time, kept in a JobQueue until they are due"""
+
+    def __init__(self, poster=None, queue: Optional[JobQueue] = None, workers: int = 1):
+        self.queue = queue or JobQueue()
+        self._poster = poster
+        self.workers = workers
+        self._workers: Optional[JobWorkers] = None
+
+    @property
+    def poster(self):
+        """The poster that sends due posts, created on first use"""
+        if self._poster is None:
+            from social_media import SocialMediaPoster
+            self._poster = SocialMediaPoster()
+        return self._poster
+
+    def schedule_post(self, text: str, at: Union[datetime, float], platforms: Optional[List[str]] = None,
+                      link: Optional[str] = None, images: Optional[List[Union[str, bytes, BinaryIO]]] = None,
+                      alt_texts: Optional[List[str]] = None) -> str:
+        """Queue a post to go out at `at` (a datetime or Unix time) and return its job id
+
+        images are up to four paths, bytes or binary files, read now. A time
+        in the past means as soon as possible.
+        """
+        from social_media import read_gallery
+
+        payload = {'text': text, 'platforms': platforms}
+        sources = []
+        if images:
+            sources, payload['alt_texts'] = read_gallery(images, alt_texts)
+            payload['filenames'] = [os.path.basename(image) if isinstance(image, str) else ''
+                                    for image in images]
+        elif link:
+            payload['link'] = link
+        return self.queue.enqueue(payload, sources, run_at=_timestamp(at))
+
+    def post_after(self, delay: Union[timedelta, float], text: str, **kwargs) -> str:
+        """Queue a post to go out after delay (a timedelta or seconds)"""
+        if isinstance(delay, timedelta):
+            delay = delay.total_seconds()
+        return self.schedule_post(text, at=time.time() + delay, **kwargs)
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a scheduled post; returns False if it has already been sent or started"""
+        return self.queue.cancel(job_id)
+
+    def start(self):
+        """Start sending posts as they become due"""
+        if self._workers is None:
+            self._workers = JobWorkers(self.queue, self.poster, workers=self.workers)
+            self._workers.start()
+            due = self.queue.next_due()
+            if due is not None:
+                logger.info(f"Next scheduled post is due at {datetime.fromtimestamp(due)}")
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop the workers once the posts they are sending are done"""
+        if self._workers is not None:
+            self._workers.stop(timeout)
+            self._workers = None
@@ -0,0 +1,174 @@
+import os
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Optional, Dict, TYPE_CHECKING
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+if TYPE_CHECKING:
+    from atproto import Client as BlueskyClient
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SESSION_FILE = '.bluesky_session.json'
+
+
+class SessionStore:
+    """Bluesky session strings kept on disk and shared between worker processes
+
+    Sessions are stored per handle in one JSON file. Every read-modify-write
+    happens under an exclusive lock on a sibling `.lock` file, so concurrent
+    workers never clobber each other's refreshed tokens.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv('BLUESKY_SESSION_FILE', DEFAULT_SESSION_FILE)
+        self._thread_lock = threading.RLock()
+        self._lock_depth = 0
+
+    @contextmanager
+    def lock(self):
+        """Hold an exclusive lock on the store across threads and processes (re-entrant)"""
+        with self._thread_lock:
+            if fcntl is None or self._lock_depth:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            with open(self.path + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self) -> Dict[str, str]:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logger.warning(f"Ignoring unreadable session file {self.path}")
+            return {}
+
+    def _write(self, sessions: Dict[str, str]):
+        # Write to a temporary file and swap it in, so readers never see a partial file
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(sessions, f)
+        os.replace(tmp_path, self.path)
+
+    def load(self, handle: str) -> Optional[str]:
+        """Return the stored session string for handle, if any"""
+        with self.lock():
+            return self._read().get(handle)
+
+    def save(self, handle: str, session_string: str):
+        """Store the session string for handle"""
+        with self.lock():
+            sessions = self._read()
+            sessions[handle] = session_string
+            self._write(sessions)
+
+    def delete(self, handle: str):
+        """Forget the stored session for handle"""
+        with self.lock():
+            sessions = self._read()
+            if sessions.pop(handle, None) is not None:
+                self._write(sessions)
+
+
+def login_bluesky(handle: str, password: str, store: Optional[SessionStore] = None,
+                  client: Optional['BlueskyClient'] = None) -> 'BlueskyClient':
+    """Log into Bluesky, resuming a stored session when possible
+
+    The stored session is imported first; atproto refreshes it if the access
+    token has expired. Only when that fails do we fall back to a password
+    login. The lock is held throughout, so when several workers start at
+    once only the first one calls createSession and the rest resume its
+    session. Refreshes during the run go through the same lock (see
+    _coordinate_refreshes) and are written back to the store.
+    """
+    if store is None:
+        store = SessionStore()
+    if client is None:
+        from atproto import Client as BlueskyClient
+        client = BlueskyClient()
+    _coordinate_refreshes(client, handle, password, store)
+
+    with store.lock():
+        session_string = store.load(handle)
+        resumed = False
+        if session_string:
+            try:
+                client.login(session_string=session_string)
+                resumed = True
+            except Exception as e:
+                logger.info(f"Stored Bluesky session for {handle} could not be resumed: {e}")
+
+        if not resumed:
+            client.login(handle, password)
+        store.save(handle, client.export_session_string())
+
+    def save_session(event, session):
+        store.save(handle, session.export())
+
+    client.on_session_change(save_session)
+    return client
+
+
+# Client internals _coordinate_refreshes relies on, as found in the pinned atproto (0.0.65)
+_CLIENT_INTERNALS = ('_refresh_and_set_session', '_get_and_set_session', '_import_session_string',
+                     '_should_refresh_session', '_session')
+
+
+def _coordinate_refreshes(client: 'BlueskyClient', handle: str, password: str, store: SessionStore):
+    """Make client's token refreshes safe to share between processes, and recoverable
+
+    A refresh token can only be used once, so two workers refreshing the
+    same session would leave one of them logged out. Refreshes happen under
+    the store's lock, and a worker whose tokens another worker already
+    refreshed takes the stored session instead of refreshing again. If the
+    refresh fails, the client logs in with the password rather than staying
+    broken until the process restarts.
+
+    atproto only exposes a callback for after the session changed, so this
+    wraps the client's own refresh method. With an atproto that lacks the
+    internals it needs, the client is left to refresh on its own.
+    """
+    missing = [name for name in _CLIENT_INTERNALS if not hasattr(client, name)]
+    if missing:
+        logger.warning(f"Bluesky session refreshes aren't shared between workers: this atproto has no "
+                       f"{', '.join(missing)}")
+        return
+
+    refresh = client._refresh_and_set_session
+
+    def refresh_under_lock():
+        with store.lock():
+            stored = store.load(handle)
+            if stored and client._session is not None and stored != client._session.export():
+                client._import_session_string(stored)
+                if not client._should_refresh_session():
+                    return None
+            try:
+                return refresh()
+            except Exception as e:
+                logger.warning(f"Refreshing the Bluesky session for {handle} failed, logging in again: {e}")
+                # Sends createSession without the client's refresh check, whose lock is held here
+                return client._get_and_set_session(handle, password)
+
+    client._refresh_and_set_session = refresh_under_lock
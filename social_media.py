@@ -1,16 +1,23 @@
-import os
-import json
-import requests
-from bs4 import BeautifulSoup
-from PIL import Image
-import base64
-from io import BytesIO
-from typing import Optional, List, Dict, Any
-from atproto import Client as BlueskyClient
-from mastodon import Mastodon
+from collections.abc import Mapping
+from typing import Optional, List, Dict, Any, Union, BinaryIO, Sequence, Tuple, TYPE_CHECKING
 from dotenv import load_dotenv
-import mimetypes
+from platforms import PLATFORMS, PlatformAdapter, Attachment, wait_for_media
+from image_cache import ImageCache
+from link_preview import LinkPreview, LinkPreviewCache, get_link_preview, shared_cache
+from rate_limit import RateLimiter, shared_limiter
+from idempotency import IdempotencyStore, PreviousResult, content_key, shared_store
+from metrics import shared_metrics
+from threads import split_text
 import logging
+import threading
+import time
+import uuid
+import warnings
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, Future
+
+if TYPE_CHECKING:
+    from http_client import HttpClient
 
 # Load environment variables
 load_dotenv()
@@ -19,11 +26,144 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class SocialMediaPoster:
+# Most images a post can have on any platform
+MAX_IMAGES = 4
+# Adapter methods that create a post, which are never retried after a 5xx
+CREATE_CALLS = frozenset({'post_text', 'post_reply', 'post_image', 'post_images', 'post_link'})
+
+
+def read_image(image: Union[str, bytes, BinaryIO]) -> bytes:
+    """Contents of an image given as a file path, bytes or a binary file object"""
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return bytes(image)
+    if hasattr(image, 'read'):
+        return image.read()
+    with open(image, 'rb') as f:
+        return f.read()
+
+
+def read_gallery(images: List[Union[str, bytes, BinaryIO]],
+                 alt_texts: Optional[List[str]] = None) -> Tuple[List[bytes], List[str]]:
+    """Read the images of a multi-image post and pair each with its alt text ('' if missing)"""
+    if not images:
+        raise ValueError("No images to post")
+    if len(images) > MAX_IMAGES:
+        raise ValueError(f"At most {MAX_IMAGES} images can be posted at once")
+    alt_texts = list(alt_texts or [])
+    alt_texts += [''] * (len(images) - len(alt_texts))
+    return [read_image(image) for image in images], alt_texts
+
+
+def image_argument(image: Union[str, bytes, BinaryIO, None],
+                   image_path: Optional[str]) -> Union[str, bytes, BinaryIO]:
+    """post_image's image, also accepted under its deprecated name image_path"""
+    if image_path is not None:
+        if image is not None:
+            raise TypeError("post_image() got both image and image_path; pass only image")
+        warnings.warn("post_image(image_path=...) is deprecated; use image=", DeprecationWarning, stacklevel=3)
+        return image_path
+    if image is None:
+        raise TypeError("post_image() missing required argument: 'image'")
+    return image
+
+
+def record_outcome(platform: str, result: Any, elapsed: float):
+    """Count a platform's post as ok, duplicate or error in the shared metrics, with its time"""
+    metrics = shared_metrics()
+    if isinstance(result, PreviousResult):
+        outcome = 'duplicate'
+    elif isinstance(result, dict) and 'error' in result:
+        outcome = 'error'
+    else:
+        outcome = 'ok'
+    metrics.count('crosspost_posts_total', platform=platform, outcome=outcome)
+    metrics.observe('crosspost_post_seconds', elapsed, platform=platform)
+
+
+class ThreadResult(list):
+    """What each post of a thread returned, first post first"""
+
+
+def describe_result(adapter: PlatformAdapter, result: Any) -> Dict[str, Any]:
+    """adapter.describe_result() of a post, or of a thread's first post with every post under 'thread'"""
+    if isinstance(result, ThreadResult):
+        posts = [adapter.describe_result(post) for post in result]
+        return dict(posts[0], thread=posts)
+    return adapter.describe_result(result)
+
+
+class PostResults(dict):
+    """Per-platform results of a post, plus how long each platform took (in seconds)
+
+    For image posts, stages breaks each platform's time down into waiting
+    for its images to be prepared ('prepare'), for the rest of the uploads
+    ('upload'), for the platform to process them ('processing') and for the
+    post to be created ('post').
+    """
     def __init__(self):
-        """Initialize social media poster using environment variables"""
-        self.clients = {}
+        super().__init__()
+        self.timings: Dict[str, float] = {}
+        self.stages: Dict[str, Dict[str, float]] = {}
+
+
+class SocialMediaPoster:
+    def __init__(self, concurrent: bool = True, max_workers: int = 4,
+                 image_cache: Optional[ImageCache] = None,
+                 link_preview_cache: Optional[LinkPreviewCache] = None,
+                 http: Optional['HttpClient'] = None,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 idempotency_store: Optional[IdempotencyStore] = None,
+                 dedupe_window: float = 0,
+                 media_workers: int = 8):
+        """Initialize social media poster using environment variables
+
+        With concurrent=True, posts are sent to all selected platforms at once
+        on a bounded thread pool of max_workers threads. Processed images are
+        kept in image_cache (by default in IMAGE_CACHE_DIR or .image_cache).
+        Link previews are kept in link_preview_cache, by default the cache
+        shared with send_with_card.py. Pages and images are fetched with http,
+        by default the process-wide pooled HttpClient. Platform calls are
+        paced and retried by rate_limiter, by default the one shared by every
+        poster in the process.
+
+        A post made with an idempotency_key is recorded per platform in
+        idempotency_store (by default IDEMPOTENCY_STORE or
+        .idempotency.sqlite3), and repeating it returns the recorded result
+        instead of posting again. With dedupe_window set, posts without a key
+        are keyed by their content, and the same text, image and link are
+        not posted to a platform twice within that many seconds.
+
+        Images of a multi-image post are processed and uploaded in parallel
+        on a separate pool of media_workers threads.
+        """
+        self.image_cache = image_cache if image_cache is not None else ImageCache()
+        self._link_preview_cache = link_preview_cache
+        self._http = http
+        self.rate_limiter = rate_limiter if rate_limiter is not None else shared_limiter()
+        self._idempotency_store = idempotency_store
+        self.dedupe_window = dedupe_window
+        self.concurrent = concurrent
+        self.max_workers = max_workers
+        self.media_workers = media_workers
+        self._executor = None
+        self._media_executor = None
+        self._executor_lock = threading.Lock()
         self._initialize_clients()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Shut down the worker pools used for concurrent posting and media"""
+        with self._executor_lock:
+            for executor in (self._executor, self._media_executor):
+                if executor is not None:
+                    executor.shutdown(wait=True)
+            self._executor = None
+            self._media_executor = None
         
     def print_setup_guide(self):
         """Print a guide for setting up the social media poster"""
@@ -44,177 +184,410 @@ class SocialMediaPoster:
         print("     MASTODON_ACCESS_TOKEN=your_access_token")
         print("     MASTODON_API_BASE_URL=https://your.instance.url")
         
-    def _get_env_var(self, key: str) -> str:
-        """Get environment variable or raise error if not set"""
-        value = os.getenv(key)
-        if not value:
-            raise ValueError(f"Environment variable {key} is not set")
-        return value
-
     def _initialize_clients(self):
-        """Initialize API clients for each platform using environment variables"""
-        # Bluesky
-        try:
-            self.clients['bluesky'] = BlueskyClient()
-            self.clients['bluesky'].login(
-                self._get_env_var('BLUESKY_HANDLE'),
-                self._get_env_var('BLUESKY_PASSWORD')
-            )
-            print("✓ Bluesky client initialized successfully")
-        except Exception as e:
-            print(f"✗ Failed to initialize Bluesky client: {e}")
-
-        # Mastodon
-        try:
-            self.clients['mastodon'] = Mastodon(
-                access_token=self._get_env_var('MASTODON_ACCESS_TOKEN'),
-                api_base_url=self._get_env_var('MASTODON_API_BASE_URL')
-            )
-            print("✓ Mastodon client initialized successfully")
-        except Exception as e:
-            print(f"✗ Failed to initialize Mastodon client: {e}")
-            
+        """Set up an adapter for each registered platform
+
+        Nothing is imported or logged into here; each adapter does that the
+        first time it is used.
+        """
+        self.adapters: Dict[str, PlatformAdapter] = {
+            name: adapter_class() for name, adapter_class in PLATFORMS.items()
+        }
+
         # Print summary of available platforms
         print("\n===== AVAILABLE PLATFORMS =====")
-        for platform, client in self.clients.items():
-            status = "✓ Available" if client is not None else "✗ Not available"
+        for platform, adapter in self.adapters.items():
+            status = "✓ Available" if adapter.is_configured() else "✗ Not configured"
             print(f"{platform}: {status}")
 
-    def _get_image_size(self, image_path: str) -> tuple:
-        """Get image dimensions"""
-        with Image.open(image_path) as img:
-            return img.size
-            
-    def _resize_image(self, image_path: str, max_size_kb: int = 900) -> bytes:
-        """Resize image to be under max_size_kb while maintaining aspect ratio"""
-        with Image.open(image_path) as img:
-            # Convert to RGB if necessary
-            if img.mode in ('RGBA', 'P'):
-                img = img.convert('RGB')
-            
-            # Start with original size
-            width, height = img.size
-            quality = 95
-            
-            while True:
-                # Save to bytes with current quality
-                buffer = BytesIO()
-                img.save(buffer, format='JPEG', quality=quality)
-                size_kb = len(buffer.getvalue()) / 1024
-                
-                if size_kb <= max_size_kb or quality <= 5:
-                    return buffer.getvalue()
-                
-                # Reduce quality or size
-                if quality > 5:
-                    quality -= 5
-                else:
-                    width = int(width * 0.9)
-                    height = int(height * 0.9)
-                    img = img.resize((width, height), Image.Resampling.LANCZOS)
-                    quality = 95
-
-    def post_text(self, text: str, platforms: Optional[List[str]] = None) -> Dict[str, Any]:
-        """Post text content to specified platforms"""
-        if platforms is None:
-            platforms = list(self.clients.keys())
-            
-        results = {}
-        
-        for platform in platforms:
+    @property
+    def clients(self) -> Mapping:
+        """Logged in SDK clients of the configured platforms, by platform name
+
+        Clients are created when first looked up.
+        """
+        return _LazyClients(self.adapters)
+
+    @property
+    def link_preview_cache(self) -> LinkPreviewCache:
+        """The link preview cache, opened on first use"""
+        if self._link_preview_cache is None:
+            self._link_preview_cache = shared_cache()
+        return self._link_preview_cache
+
+    @property
+    def http(self) -> 'HttpClient':
+        """The HTTP client for pages and images, created on first use"""
+        if self._http is None:
+            from http_client import shared_client
+            self._http = shared_client()
+        return self._http
+
+    @property
+    def idempotency_store(self) -> IdempotencyStore:
+        """The store of posts made with an idempotency key, opened on first use"""
+        if self._idempotency_store is None:
+            self._idempotency_store = shared_store()
+        return self._idempotency_store
+
+    def available_platforms(self) -> List[str]:
+        """Names of the platforms whose credentials are configured"""
+        return [name for name, adapter in self.adapters.items() if adapter.is_configured()]
+
+    def describe_results(self, results: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """JSON-friendly per-platform summary of post_* results (post URI/id, or the error)"""
+        described = {}
+        for platform, result in results.items():
+            if isinstance(result, PreviousResult):
+                described[platform] = dict(result, duplicate=True)
+            elif isinstance(result, dict) and 'error' in result:
+                described[platform] = {'error': result['error']}
+            else:
+                described[platform] = describe_result(self._adapter(platform), result)
+        return described
+
+    def _adapter(self, platform: str) -> PlatformAdapter:
+        """Look up the adapter for a platform"""
+        try:
+            return self.adapters[platform]
+        except KeyError:
+            raise ValueError(f"Unsupported platform: {platform}") from None
+
+    @staticmethod
+    def _prepare_call(adapter: PlatformAdapter, method) -> Tuple[Any, str, bool]:
+        """(function to call, method name, whether it creates a post) for a platform call
+
+        Calls that create a post get one idempotency key for all their
+        retries on platforms that accept one.
+        """
+        name = method.__name__
+        create = name in CREATE_CALLS
+        if create and adapter.accepts_idempotency_key:
+            method = partial(method, idempotency_key=uuid.uuid4().hex)
+        return method, name, create
+
+    def _call(self, adapter: PlatformAdapter, method, *args, media: bool = False) -> Any:
+        """Call one of adapter's post_* (or with media, upload_*) methods through the rate limiter
+
+        The time each call takes, including rate limit waits and retries, is
+        recorded by platform and method.
+        """
+        fn, name, create = self._prepare_call(adapter, method)
+        with shared_metrics().timer('crosspost_platform_call_seconds', platform=adapter.name, call=name):
+            return self.rate_limiter.call(adapter, fn, *args, media=media, create=create)
+
+    def _idempotency_key(self, idempotency_key: Optional[str], text: str,
+                         media: Sequence[bytes] = (), link: Optional[str] = None) -> Optional[str]:
+        """The key a post is recorded under, or None if it isn't deduplicated"""
+        if idempotency_key:
+            return 'key:' + idempotency_key
+        if self.dedupe_window:
+            return content_key(text, media, link)
+        return None
+
+    def _once(self, key: Optional[str], adapter: PlatformAdapter, post) -> Any:
+        """Call post() unless adapter's platform already has a result for key
+
+        Returns a PreviousResult when the post was already made.
+        """
+        if key is None:
+            return post()
+        max_age = self.dedupe_window if key.startswith('content:') else None
+        previous = self.idempotency_store.begin(key, adapter.name, max_age)
+        if previous is not None:
+            return PreviousResult(previous)
+        try:
+            result = post()
+        except Exception:
+            self.idempotency_store.abandon(key, adapter.name)
+            raise
+        self.idempotency_store.complete(key, adapter.name, describe_result(adapter, result))
+        return result
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Create the worker pool on first use"""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='social-media-poster'
+                )
+            return self._executor
+
+    def _get_media_executor(self) -> ThreadPoolExecutor:
+        """Create the media pool on first use
+
+        It is separate from the posting pool, whose threads wait on media
+        tasks; sharing one pool could leave every thread waiting.
+        """
+        with self._executor_lock:
+            if self._media_executor is None:
+                self._media_executor = ThreadPoolExecutor(
+                    max_workers=self.media_workers,
+                    thread_name_prefix='social-media-media'
+                )
+            return self._media_executor
+
+    def _fan_out(self, platforms: List[str], post_to_platform) -> PostResults:
+        """Call post_to_platform(platform) for each platform and collect the results
+
+        Errors are stored per platform as {'error': ...} and never abort the
+        other platforms. Runs concurrently when enabled and there is more than
+        one platform, otherwise one platform after the other.
+        """
+        def run(platform):
+            start = time.perf_counter()
             try:
-                if platform == 'bluesky':
-                    results['bluesky'] = self.clients['bluesky'].send_post(text=text)
-                elif platform == 'mastodon':
-                    results['mastodon'] = self.clients['mastodon'].toot(text)
+                result = post_to_platform(platform)
             except Exception as e:
-                results[platform] = {'error': str(e)}
-                
+                logger.warning(f"Posting to {platform} failed: {e}")
+                result = {'error': str(e)}
+            return result, time.perf_counter() - start
+
+        results = PostResults()
+        if self.concurrent and len(platforms) > 1:
+            executor = self._get_executor()
+            futures = {platform: executor.submit(run, platform) for platform in platforms}
+            outcomes = {platform: future.result() for platform, future in futures.items()}
+        else:
+            outcomes = {platform: run(platform) for platform in platforms}
+
+        for platform, (result, elapsed) in outcomes.items():
+            results[platform] = result
+            results.timings[platform] = elapsed
+            record_outcome(platform, result, elapsed)
         return results
 
-    def post_image(self, text: str, image_path: str, alt_text: str = '', 
-                  platforms: Optional[List[str]] = None) -> Dict[str, Any]:
-        """Post image with caption to specified platforms"""
-        if platforms is None:
-            platforms = list(self.clients.keys())
-            
-        results = {}
-        
-        # Get image dimensions
-        width, height = self._get_image_size(image_path)
-        
-        # Resize image for Bluesky (max 976.56KB)
-        resized_image = self._resize_image(image_path, max_size_kb=900)
-            
-        # Get mime type
-        mime_type = mimetypes.guess_type(image_path)[0]
-        if not mime_type or not mime_type.startswith('image/'):
-            mime_type = 'image/jpeg'
-            
-        for platform in platforms:
+    def _prepare_image_variants(self, source: bytes, platforms: List[str], on_variant=None) -> Dict[str, Any]:
+        """Decode an image once and return an ImageVariant for each known platform
+
+        Variants already in the image cache are not processed again.
+        on_variant(platform, variant) is called as each one is ready.
+        """
+        limits = {platform: self.adapters[platform].image_limits
+                  for platform in platforms if platform in self.adapters}
+        return self.image_cache.get_variants(source, limits, on_variant)
+
+    def _prepare_gallery(self, sources: List[bytes], platforms: List[str]) -> List[Dict[str, Future]]:
+        """Start preparing every image on the media pool
+
+        Returns a Future per image and platform that resolves to the
+        ImageVariant as soon as that platform's variant is ready, so its
+        upload can start while other platforms' variants are still encoding.
+        """
+        def prepare(source, pending):
+            try:
+                self._prepare_image_variants(
+                    source, platforms, lambda platform, variant: pending[platform].set_result(variant)
+                )
+            except Exception as e:
+                for future in pending.values():
+                    if not future.done():
+                        future.set_exception(e)
+
+        executor = self._get_media_executor()
+        gallery = []
+        for source in sources:
+            pending = {platform: Future() for platform in platforms if platform in self.adapters}
+            executor.submit(prepare, source, pending)
+            gallery.append(pending)
+        return gallery
+
+    def _post_gallery(self, adapter: PlatformAdapter, text: str, variants: List[Future],
+                      alt_texts: List[str], started: float, stages: Dict[str, Dict[str, float]]) -> Any:
+        """Upload images to one platform as each is prepared, then post them once all are ready
+
+        Each upload starts on the media pool as soon as its variant resolves
+        (and never waits in a pool thread, so the pool can't deadlock). The
+        post is only created once the platform has finished processing every
+        upload. Time spent in each stage since started is put in stages.
+        """
+        if len(variants) > adapter.max_images:
+            raise ValueError(f"{adapter.name.title()} allows at most {adapter.max_images} images per post")
+        executor = self._get_media_executor()
+        attachments: List[Optional[Attachment]] = [None] * len(variants)
+        uploads = [Future() for _ in variants]
+        prepared_at = [started] * len(variants)
+
+        def upload(index):
             try:
-                if platform == 'bluesky':
-                    results['bluesky'] = self.clients['bluesky'].send_image(
-                        text=text,
-                        image=resized_image,
-                        image_alt=alt_text,
-                        image_aspect_ratio={'width': width, 'height': height}
-                    )
-                elif platform == 'mastodon':
-                    # Upload media first
-                    media = self.clients['mastodon'].media_post(
-                        resized_image,
-                        mime_type=mime_type,
-                        description=alt_text
-                    )
-                    # Then post with media
-                    results['mastodon'] = self.clients['mastodon'].status_post(
-                        text,
-                        media_ids=[media['id']]
-                    )
+                uploads[index].set_result(
+                    self._call(adapter, adapter.upload_image, attachments[index], media=True)
+                )
             except Exception as e:
-                results[platform] = {'error': str(e)}
-                
+                uploads[index].set_exception(e)
+
+        def start_upload(index, prepared: Future):
+            prepared_at[index] = time.perf_counter()
+            try:
+                variant = prepared.result()
+                attachments[index] = Attachment(variant.data, variant.mime_type, variant.width,
+                                                variant.height, alt_texts[index])
+                executor.submit(upload, index)
+            except Exception as e:
+                uploads[index].set_exception(e)
+
+        for index, prepared in enumerate(variants):
+            prepared.add_done_callback(partial(start_upload, index))
+
+        uploaded = [future.result() for future in uploads]
+        uploaded_at = time.perf_counter()
+        ready = wait_for_media(adapter, uploaded, lambda fn, *args: self._call(adapter, fn, *args))
+        processed_at = time.perf_counter()
+        shared_metrics().observe('crosspost_media_processing_seconds', processed_at - uploaded_at,
+                                 platform=adapter.name)
+        result = self._call(adapter, adapter.post_images, text, ready, attachments)
+
+        prepare_done = max(prepared_at)
+        stages[adapter.name] = {
+            'prepare': prepare_done - started,
+            'upload': uploaded_at - prepare_done,
+            'processing': processed_at - uploaded_at,
+            'post': time.perf_counter() - processed_at,
+        }
+        return result
+
+    def _get_link_preview(self, url: str) -> LinkPreview:
+        """Get the link preview for url through the link preview cache"""
+        return get_link_preview(url, self.link_preview_cache, self.http)
+
+    def _post_thread(self, adapter: PlatformAdapter, text: str, key: Optional[str] = None) -> Any:
+        """Post text to one platform, as a thread of replies if it is too long for one post
+
+        Returns a ThreadResult when it took more than one post. If a reply
+        fails, the posts already made stay up and the error says how many.
+        With an idempotency key, each post is recorded as it is made, and a
+        retry with the key replies to the last of them rather than posting
+        the thread again from the start.
+        """
+        limit = adapter.max_text_length
+        posts = split_text(text, limit, adapter.counts_graphemes) if limit else [text]
+        if len(posts) < 2:
+            return self._call(adapter, adapter.post_text, text)
+        thread = self._thread_progress(key, adapter)
+        adapter.prepare_thread(posts[len(thread):])
+        if not thread:
+            thread.append(self._call(adapter, adapter.post_text, posts[0]))
+            self._save_thread_progress(key, adapter, thread)
+        for post in posts[len(thread):]:
+            try:
+                thread.append(self._call(adapter, adapter.post_reply, post, thread[-1], thread[0]))
+            except Exception as e:
+                raise RuntimeError(f"Thread stopped after {len(thread)} of {len(posts)} posts: {e}") from e
+            self._save_thread_progress(key, adapter, thread)
+        return thread
+
+    def _thread_progress(self, key: Optional[str], adapter: PlatformAdapter) -> ThreadResult:
+        """Posts of the thread for key that an earlier attempt made on adapter's platform"""
+        progress = self.idempotency_store.progress(key, adapter.name) if key else None
+        return ThreadResult(adapter.thread_post(post) for post in (progress or {}).get('thread', []))
+
+    def _save_thread_progress(self, key: Optional[str], adapter: PlatformAdapter, thread: ThreadResult):
+        if key:
+            self.idempotency_store.save_progress(key, adapter.name, describe_result(adapter, thread))
+
+    def post_text(self, text: str, platforms: Optional[List[str]] = None,
+                  idempotency_key: Optional[str] = None, thread: bool = False) -> Dict[str, Any]:
+        """Post text content to specified platforms
+
+        With thread=True, text longer than a platform allows is split at
+        sentence or word boundaries and posted as a chain of replies. Each
+        platform's chain is posted independently, so a slow platform doesn't
+        hold up the others.
+        """
+        if platforms is None:
+            platforms = self.available_platforms()
+        key = self._idempotency_key(idempotency_key, text)
+
+        def post_to_platform(platform):
+            adapter = self._adapter(platform)
+            if thread:
+                return self._once(key, adapter, lambda: self._post_thread(adapter, text, key))
+            return self._once(key, adapter, lambda: self._call(adapter, adapter.post_text, text))
+
+        return self._fan_out(platforms, post_to_platform)
+
+    def post_image(self, text: str, image: Union[str, bytes, BinaryIO, None] = None, alt_text: str = '',
+                  platforms: Optional[List[str]] = None,
+                  idempotency_key: Optional[str] = None, *,
+                  image_path: Optional[str] = None) -> Dict[str, Any]:
+        """Post image with caption to specified platforms
+
+        image is a file path, the image's bytes, or a binary file object such
+        as an upload stream; it is read once and never written to disk.
+        image_path is its deprecated former name.
+        """
+        image = image_argument(image, image_path)
+        return self.post_images(text, [image], [alt_text], platforms=platforms,
+                                idempotency_key=idempotency_key)
+
+    def post_images(self, text: str, images: List[Union[str, bytes, BinaryIO]],
+                    alt_texts: Optional[List[str]] = None, platforms: Optional[List[str]] = None,
+                    idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        """Post up to four images with one caption to specified platforms
+
+        Images are given like post_image's, with alt texts in the same order.
+        The steps are pipelined: images are resized in parallel, each
+        platform's upload starts as soon as its variant is ready, and the
+        post is created once the platform has processed every upload. The
+        time each stage took is in the results' stages.
+        """
+        if platforms is None:
+            platforms = self.available_platforms()
+        sources, alt_texts = read_gallery(images, alt_texts)
+
+        started = time.perf_counter()
+        key = self._idempotency_key(idempotency_key, text, media=sources)
+        variants = self._prepare_gallery(sources, platforms)
+        stages = {}
+
+        def post_to_platform(platform):
+            adapter = self._adapter(platform)
+            return self._once(key, adapter, lambda: self._post_gallery(
+                adapter, text, [variant[platform] for variant in variants], alt_texts, started, stages
+            ))
+
+        results = self._fan_out(platforms, post_to_platform)
+        results.stages.update(stages)
         return results
 
-    def post_link(self, text: str, url: str, platforms: Optional[List[str]] = None) -> Dict[str, Any]:
+    def post_link(self, text: str, url: str, platforms: Optional[List[str]] = None,
+                  idempotency_key: Optional[str] = None) -> Dict[str, Any]:
         """Post link with text to specified platforms"""
         if platforms is None:
-            platforms = list(self.clients.keys())
-            
-        results = {}
-        
-        for platform in platforms:
-            try:
-                if platform == 'bluesky':
-                    # Get link preview data
-                    response = requests.get(url)
-                    soup = BeautifulSoup(response.text, 'html.parser')
-                    
-                    # Extract metadata
-                    title = soup.find('meta', property='og:title')['content']
-                    description = soup.find('meta', property='og:description')['content']
-                    image_url = soup.find('meta', property='og:image')['content']
-                    
-                    # Download and upload image
-                    image_data = requests.get(image_url).content
-                    
-                    # Create link card
-                    results['bluesky'] = self.clients['bluesky'].send_post(
-                        text=text,
-                        embed={
-                            'type': 'app.bsky.embed.external',
-                            'external': {
-                                'uri': url,
-                                'title': title,
-                                'description': description,
-                                'thumb': image_data
-                            }
-                        }
-                    )
-                elif platform == 'mastodon':
-                    results['mastodon'] = self.clients['mastodon'].toot(f"{text}\n\n{url}")
-            except Exception as e:
-                results[platform] = {'error': str(e)}
-                
-        return results 
\ No newline at end of file
+            platforms = self.available_platforms()
+        key = self._idempotency_key(idempotency_key, text, link=url)
+
+        def post_to_platform(platform):
+            adapter = self._adapter(platform)
+            if not adapter.uses_link_preview:
+                return self._call(adapter, adapter.post_link, text, url)
+
+            # Get link preview data and image for the link card
+            preview = self._get_link_preview(url)
+            return self._call(adapter, adapter.post_link,
+                              text, url, preview.title, preview.description, preview.thumb)
+
+        def post_once(platform):
+            return self._once(key, self._adapter(platform), lambda: post_to_platform(platform))
+
+        return self._fan_out(platforms, post_once)
+
+
+class _LazyClients(Mapping):
+    """Read-only view of the adapters' SDK clients that logs in on lookup"""
+
+    def __init__(self, adapters: Dict[str, PlatformAdapter]):
+        self._adapters = adapters
+
+    def __getitem__(self, platform):
+        adapter = self._adapters[platform]
+        if not adapter.is_configured():
+            raise KeyError(platform)
+        return adapter.client
+
+    def __iter__(self):
+        return (name for name, adapter in self._adapters.items() if adapter.is_configured())
+
+    def __len__(self):
+        return sum(1 for _ in self)
@@ -0,0 +1,289 @@
+import asyncio
+import time
+import logging
+from functools import partial
+from collections.abc import Mapping
+from concurrent.futures import Future
+from typing import Optional, List, Dict, Any, Union, BinaryIO
+
+from http_client import AsyncHttpClient
+from link_preview import (CHUNK_SIZE, MAX_THUMBNAIL_DOWNLOAD, REFETCH_HEADERS, LinkPreview,
+                          preview_from_response)
+from opengraph import MetadataExtractor
+from social_media import (SocialMediaPoster, PostResults, read_gallery, record_outcome,
+                          describe_result, image_argument)
+from platforms import PlatformAdapter, Attachment, wait_for_media_async
+from idempotency import PreviousResult
+from threads import split_text
+from metrics import shared_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncSocialMediaPoster:
+    """Asyncio version of SocialMediaPoster with the same post_* methods
+
+    Link previews and thumbnails are fetched with async HTTP, so many posts
+    can be in flight on one event loop. Only the blocking platform SDK calls
+    and image encoding are handed to worker threads; waits for rate limits,
+    retries and media processing happen on the event loop and hold no thread.
+    """
+
+    def __init__(self, poster: Optional[SocialMediaPoster] = None,
+                 http_client: Optional[AsyncHttpClient] = None):
+        """Wrap an existing SocialMediaPoster, or create one from environment variables
+
+        Creating the poster doesn't block: each platform logs in on its first
+        post, inside the worker thread that makes it, so this is safe to call
+        from a running event loop.
+        Without an http_client, one is created with the poster's HTTP settings.
+        """
+        self.poster = poster if poster is not None else SocialMediaPoster()
+        self._http = http_client
+        self._owns_http = http_client is None
+
+    @property
+    def clients(self) -> Mapping:
+        """Platform clients of the wrapped poster"""
+        return self.poster.clients
+
+    @classmethod
+    async def create(cls, **kwargs) -> 'AsyncSocialMediaPoster':
+        """Create a poster in a worker thread"""
+        poster = await asyncio.to_thread(SocialMediaPoster)
+        return cls(poster=poster, **kwargs)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    async def aclose(self):
+        """Close the HTTP client (if we created it) and the wrapped poster"""
+        if self._http is not None and self._owns_http:
+            await self._http.aclose()
+            self._http = None
+        await asyncio.to_thread(self.poster.close)
+
+    def _get_http(self) -> AsyncHttpClient:
+        """Create the HTTP client on first use"""
+        if self._http is None:
+            self._http = AsyncHttpClient(self.poster.http.config)
+        return self._http
+
+    async def _fetch_metadata(self, url: str, headers: Dict[str, str]):
+        """GET url and read its metadata, or None for a 304"""
+        async with self._get_http().stream('GET', url, headers=headers) as response:
+            metadata = None
+            if response.status_code != 304:
+                response.raise_for_status()
+                extractor = MetadataExtractor(str(response.url), response.headers.get('Content-Type'))
+                async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                    if extractor.feed(chunk):
+                        break
+                metadata = extractor.result()
+        return response, metadata
+
+    async def _get_link_preview(self, url: str) -> LinkPreview:
+        """Get the link preview for url through the poster's link preview cache"""
+        cache = self.poster.link_preview_cache
+        metrics = shared_metrics()
+        previous = await asyncio.to_thread(cache.get, url)
+        if previous is not None and cache.is_fresh(previous):
+            metrics.count('crosspost_link_previews_total', result='cached')
+            return previous
+
+        start = time.perf_counter()
+        response, metadata = await self._fetch_metadata(url, cache.revalidation_headers(previous))
+        if response.status_code == 304 and previous is None:
+            # A cache along the way answered a request we never made conditional
+            response, metadata = await self._fetch_metadata(url, REFETCH_HEADERS)
+        metrics.observe('crosspost_link_preview_fetch_seconds', time.perf_counter() - start)
+        metrics.count('crosspost_link_previews_total',
+                      result='not_modified' if response.status_code == 304 else 'fetched')
+        preview, needs_thumb = preview_from_response(
+            url, previous, response.status_code, response.headers, metadata
+        )
+        if needs_thumb:
+            from images import make_thumbnail
+            try:
+                start = time.perf_counter()
+                data = await self._get_http().download(
+                    preview.image_url, MAX_THUMBNAIL_DOWNLOAD, content_type_prefix='image/'
+                )
+                metrics.observe('crosspost_thumbnail_download_seconds', time.perf_counter() - start)
+                preview.thumb = await asyncio.to_thread(make_thumbnail, data)
+            except Exception as e:
+                logger.warning(f"Skipping link card image {preview.image_url}: {e}")
+        await asyncio.to_thread(cache.put, preview)
+        return preview
+
+    async def _fan_out(self, platforms: List[str], post_to_platform) -> PostResults:
+        """Await post_to_platform(platform) for every platform at once and collect the results"""
+        async def run(platform):
+            start = time.perf_counter()
+            try:
+                result = await post_to_platform(platform)
+            except Exception as e:
+                logger.warning(f"Posting to {platform} failed: {e}")
+                result = {'error': str(e)}
+            return result, time.perf_counter() - start
+
+        outcomes = await asyncio.gather(*(run(platform) for platform in platforms))
+
+        results = PostResults()
+        for platform, (result, elapsed) in zip(platforms, outcomes):
+            results[platform] = result
+            results.timings[platform] = elapsed
+            record_outcome(platform, result, elapsed)
+        return results
+
+    async def _call(self, adapter: PlatformAdapter, method, *args, media: bool = False) -> Any:
+        """SocialMediaPoster._call for asyncio: the SDK call runs in a worker thread, waits on the loop"""
+        fn, name, create = self.poster._prepare_call(adapter, method)
+        with shared_metrics().timer('crosspost_platform_call_seconds', platform=adapter.name, call=name):
+            return await self.poster.rate_limiter.acall(adapter, fn, *args, media=media, create=create)
+
+    async def _once(self, key: Optional[str], adapter: PlatformAdapter, post) -> Any:
+        """SocialMediaPoster._once for asyncio: awaits post() unless the platform has a result for key"""
+        if key is None:
+            return await post()
+        store = self.poster.idempotency_store
+        max_age = self.poster.dedupe_window if key.startswith('content:') else None
+        previous = await asyncio.to_thread(store.begin, key, adapter.name, max_age)
+        if previous is not None:
+            return PreviousResult(previous)
+        try:
+            result = await post()
+        except Exception:
+            await asyncio.to_thread(store.abandon, key, adapter.name)
+            raise
+        await asyncio.to_thread(store.complete, key, adapter.name, describe_result(adapter, result))
+        return result
+
+    async def _post_thread(self, adapter: PlatformAdapter, text: str, key: Optional[str] = None) -> Any:
+        """SocialMediaPoster._post_thread for asyncio, resuming from the key's recorded posts alike"""
+        limit = adapter.max_text_length
+        posts = split_text(text, limit, adapter.counts_graphemes) if limit else [text]
+        if len(posts) < 2:
+            return await self._call(adapter, adapter.post_text, text)
+        thread = await asyncio.to_thread(self.poster._thread_progress, key, adapter)
+        await asyncio.to_thread(adapter.prepare_thread, posts[len(thread):])
+        if not thread:
+            thread.append(await self._call(adapter, adapter.post_text, posts[0]))
+            await asyncio.to_thread(self.poster._save_thread_progress, key, adapter, thread)
+        for post in posts[len(thread):]:
+            try:
+                thread.append(await self._call(adapter, adapter.post_reply, post, thread[-1], thread[0]))
+            except Exception as e:
+                raise RuntimeError(f"Thread stopped after {len(thread)} of {len(posts)} posts: {e}") from e
+            await asyncio.to_thread(self.poster._save_thread_progress, key, adapter, thread)
+        return thread
+
+    async def _post_gallery(self, adapter: PlatformAdapter, text: str, variants: List[Future],
+                            alt_texts: List[str], started: float, stages: Dict[str, Dict[str, float]]) -> Any:
+        """SocialMediaPoster._post_gallery for asyncio: each upload starts as soon as its variant is ready"""
+        if len(variants) > adapter.max_images:
+            raise ValueError(f"{adapter.name.title()} allows at most {adapter.max_images} images per post")
+        attachments: List[Optional[Attachment]] = [None] * len(variants)
+        prepared_at = [started] * len(variants)
+
+        async def upload(index, prepared):
+            variant = await asyncio.wrap_future(prepared)
+            prepared_at[index] = time.perf_counter()
+            attachments[index] = Attachment(variant.data, variant.mime_type, variant.width,
+                                            variant.height, alt_texts[index])
+            return await self._call(adapter, adapter.upload_image, attachments[index], media=True)
+
+        uploaded = await asyncio.gather(*(upload(index, prepared) for index, prepared in enumerate(variants)))
+        uploaded_at = time.perf_counter()
+        ready = await wait_for_media_async(adapter, uploaded, lambda fn, *args: self._call(adapter, fn, *args))
+        processed_at = time.perf_counter()
+        shared_metrics().observe('crosspost_media_processing_seconds', processed_at - uploaded_at,
+                                 platform=adapter.name)
+        result = await self._call(adapter, adapter.post_images, text, ready, attachments)
+
+        prepare_done = max(prepared_at)
+        stages[adapter.name] = {
+            'prepare': prepare_done - started,
+            'upload': uploaded_at - prepare_done,
+            'processing': processed_at - uploaded_at,
+            'post': time.perf_counter() - processed_at,
+        }
+        return result
+
+    async def post_text(self, text: str, platforms: Optional[List[str]] = None,
+                        idempotency_key: Optional[str] = None, thread: bool = False) -> Dict[str, Any]:
+        """Post text content to specified platforms; with thread=True, long text as a reply chain"""
+        if platforms is None:
+            platforms = self.poster.available_platforms()
+        key = self.poster._idempotency_key(idempotency_key, text)
+
+        async def post_to_platform(platform):
+            adapter = self.poster._adapter(platform)
+            if thread:
+                post = partial(self._post_thread, adapter, text, key)
+            else:
+                post = partial(self._call, adapter, adapter.post_text, text)
+            return await self._once(key, adapter, post)
+
+        return await self._fan_out(platforms, post_to_platform)
+
+    async def post_image(self, text: str, image: Union[str, bytes, BinaryIO, None] = None, alt_text: str = '',
+                         platforms: Optional[List[str]] = None,
+                         idempotency_key: Optional[str] = None, *,
+                         image_path: Optional[str] = None) -> Dict[str, Any]:
+        """Post image with caption to specified platforms; image is a path, bytes or a binary file
+
+        image_path is image's deprecated former name.
+        """
+        image = image_argument(image, image_path)
+        return await self.post_images(text, [image], [alt_text], platforms=platforms,
+                                      idempotency_key=idempotency_key)
+
+    async def post_images(self, text: str, images: List[Union[str, bytes, BinaryIO]],
+                          alt_texts: Optional[List[str]] = None, platforms: Optional[List[str]] = None,
+                          idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        """Post up to four images with one caption to specified platforms, pipelined as in SocialMediaPoster"""
+        if platforms is None:
+            platforms = self.poster.available_platforms()
+
+        sources, alt_texts = await asyncio.to_thread(read_gallery, images, alt_texts)
+        started = time.perf_counter()
+        key = self.poster._idempotency_key(idempotency_key, text, media=sources)
+        variants = self.poster._prepare_gallery(sources, platforms)
+        stages = {}
+
+        async def post_to_platform(platform):
+            adapter = self.poster._adapter(platform)
+            return await self._once(key, adapter, partial(
+                self._post_gallery, adapter, text, [variant[platform] for variant in variants],
+                alt_texts, started, stages
+            ))
+
+        results = await self._fan_out(platforms, post_to_platform)
+        results.stages.update(stages)
+        return results
+
+    async def post_link(self, text: str, url: str, platforms: Optional[List[str]] = None,
+                        idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        """Post link with text to specified platforms"""
+        if platforms is None:
+            platforms = self.poster.available_platforms()
+        key = self.poster._idempotency_key(idempotency_key, text, link=url)
+
+        async def post_to_platform(adapter):
+            if not adapter.uses_link_preview:
+                return await self._call(adapter, adapter.post_link, text, url)
+
+            # Get link preview data and image for the link card
+            preview = await self._get_link_preview(url)
+            return await self._call(adapter, adapter.post_link,
+                                    text, url, preview.title, preview.description, preview.thumb)
+
+        async def post_once(platform):
+            adapter = self.poster._adapter(platform)
+            return await self._once(key, adapter, partial(post_to_platform, adapter))
+
+        return await self._fan_out(platforms, post_once)
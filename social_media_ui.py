@@ -1,7 +1,5 @@
 import ui
 import photos
-import tempfile
-import os
 from social_media import SocialMediaPoster
 from PIL import Image
 import io
@@ -136,21 +134,17 @@ class SocialMediaUI:
         # Post based on content type
         try:
             if self.selected_image:
-                # Save image to temporary file
-                with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
-                    self.selected_image.save(temp_file.name, 'JPEG')
-                    temp_path = temp_file.name
+                # Encode the image in memory
+                buffer = io.BytesIO()
+                self.selected_image.convert('RGB').save(buffer, 'JPEG')
                 
                 # Post image
                 result = self.poster.post_image(
                     text=text,
-                    image_path=temp_path,
+                    image=buffer.getvalue(),
                     platforms=selected_platforms
                 )
                 
-                # Clean up temp file
-                os.unlink(temp_path)
-                
             elif link:
                 # Post link
                 result = self.poster.post_link(
@@ -0,0 +1,599 @@
+"""Local stand-ins for the Bluesky (atproto XRPC) and Mastodon APIs
+
+They answer the calls SocialMediaPoster makes the way the real services
+do, so posting can be benchmarked and exercised without network access or
+accounts. Latency, rate limit headers and injected errors are set with
+StubConfig; random choices come from a seeded generator. A third server
+serves article pages with OpenGraph tags and card images for link posts,
+and RSS feeds of them.
+
+    with StubServers(StubConfig(latency=0.05, error_rate=0.01)) as servers:
+        os.environ.update(servers.environ())
+        poster = SocialMediaPoster()
+        poster.post_link("Read this", servers.article_url(1))
+"""
+import io
+import html
+import json
+import time
+import base64
+import random
+import hashlib
+import itertools
+import threading
+from datetime import datetime, timezone
+from dataclasses import dataclass
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional, Dict, Any, Tuple, List, Set
+from urllib.parse import urlparse, parse_qs
+
+from threads import text_length
+
+STUB_HANDLE = 'bench.stub.test'
+STUB_DID = 'did:plc:benchstubaccount0000000'
+# Longest posts the stand-ins accept, as the real services' defaults
+BLUESKY_MAX_GRAPHEMES = 300
+MASTODON_MAX_CHARACTERS = 500
+
+
+@dataclass
+class StubConfig:
+    """How the stand-in servers behave"""
+    # Seconds added to every response, plus up to `jitter` more at random
+    latency: float = 0.0
+    jitter: float = 0.0
+    # Upload speed in bytes per second for request bodies (0: instant)
+    bandwidth: float = 0.0
+    # Requests allowed per window before answering 429 (0: no limit or headers)
+    rate_limit: int = 0
+    rate_window: float = 300.0
+    # Share of uploads and posts answered with a 503
+    error_rate: float = 0.0
+    # Seconds Mastodon takes to process an upload before it can be attached
+    media_processing: float = 0.0
+    # Posts each account already has, for feed and archive syncs
+    feed_size: int = 0
+    # Seconds Bluesky access tokens are valid for; under 15 minutes, atproto refreshes before every call
+    session_lifetime: int = 7200
+    seed: int = 0
+
+
+def _cid(data: bytes) -> str:
+    """CIDv1 (raw, sha2-256) of data in base32, as atproto uses for blobs"""
+    digest = bytes([0x01, 0x55, 0x12, 0x20]) + hashlib.sha256(data).digest()
+    return 'b' + base64.b32encode(digest).decode().lower().rstrip('=')
+
+
+def _stub_did(handle: str) -> str:
+    """A stable made-up DID for handle"""
+    return 'did:plc:' + hashlib.sha256(handle.lower().encode()).hexdigest()[:24]
+
+
+def _jwt(payload: Dict[str, Any]) -> str:
+    """An unsigned JWT; clients only read its expiry"""
+    def encode(part):
+        return base64.urlsafe_b64encode(json.dumps(part).encode()).decode().rstrip('=')
+    return f"{encode({'typ': 'at+jwt', 'alg': 'HS256'})}.{encode(payload)}.c2lnbmF0dXJl"
+
+
+class _Window:
+    """Fixed rate limit window shared by all requests to one server"""
+
+    def __init__(self, limit: int, seconds: float):
+        self.limit = limit
+        self.seconds = seconds
+        self._start = time.time()
+        self._used = 0
+        self._lock = threading.Lock()
+
+    def hit(self) -> Tuple[bool, int, float]:
+        """Count a request; returns whether it is allowed, how many remain and the reset time"""
+        with self._lock:
+            now = time.time()
+            if now - self._start >= self.seconds:
+                self._start = now
+                self._used = 0
+            self._used += 1
+            reset_at = self._start + self.seconds
+            return self._used <= self.limit, max(self.limit - self._used, 0), reset_at
+
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler, config: StubConfig, seed_offset: int):
+        super().__init__(('127.0.0.1', 0), handler)
+        self.config = config
+        self.random = random.Random(config.seed + seed_offset)
+        self.random_lock = threading.Lock()
+        self.window = _Window(config.rate_limit, config.rate_window) if config.rate_limit else None
+        self.counts: Dict[str, int] = {}
+        self.counts_lock = threading.Lock()
+        # Ids up to feed_size belong to the posts the account already has
+        self.ids = itertools.count(config.feed_size + 1)
+        self.media: Dict[str, Dict[str, Any]] = {}
+        self.posts: Dict[int, Dict[str, Any]] = {}
+        self.newest_post = config.feed_size
+        # Statuses created with an Idempotency-Key header, by key
+        self.idempotent: Dict[str, Dict[str, Any]] = {}
+        # Refresh tokens not used yet; like a real PDS, each is good for one refreshSession
+        self.refresh_tokens: Set[str] = set()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def uniform(self, a: float, b: float) -> float:
+        with self.random_lock:
+            return self.random.uniform(a, b)
+
+    def count(self, endpoint: str):
+        with self.counts_lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+
+    def add_post(self, post_id: int, text: str):
+        self.posts[post_id] = {'text': text, 'created_at': datetime.now(timezone.utc)}
+        with self.counts_lock:
+            self.newest_post = max(self.newest_post, post_id)
+
+    def feed(self, before: Optional[int], after: int, limit: int) -> List[Tuple[int, Dict[str, Any]]]:
+        """Up to limit of the account's posts, newest first, with ids between after and before"""
+        page = []
+        post_id = (before if before is not None else self.newest_post + 1) - 1
+        while post_id > after and len(page) < limit:
+            post = self.posts.get(post_id)
+            if post is None and post_id <= self.config.feed_size:
+                # Older posts are made up when asked for, an hour apart
+                post = {'text': f'Older post {post_id}',
+                        'created_at': datetime.fromtimestamp(1.6e9 + post_id * 3600, timezone.utc)}
+            if post is not None:
+                page.append((post_id, post))
+            post_id -= 1
+        return page
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send headers and body in one segment; separate small writes would
+    # wait on the client's delayed ACK and add ~40ms to every response
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+    server: _StubServer
+    # Endpoints that injected errors apply to
+    faulty: Tuple[str, ...] = ()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self) -> bytes:
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _send(self, status: int, body: Any = None, headers: Optional[Dict[str, str]] = None,
+              content_type: str = 'application/json'):
+        data = body if isinstance(body, bytes) else json.dumps(body if body is not None else {}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def rate_limit_headers(self, remaining: int, reset_at: float) -> Dict[str, str]:
+        raise NotImplementedError
+
+    def _admit(self, endpoint: str, body: bytes) -> Optional[Dict[str, str]]:
+        """Delay, rate limit and fail requests as configured
+
+        Returns the rate limit headers to send, or None once the request has
+        been answered with an error.
+        """
+        config = self.server.config
+        self.server.count(endpoint)
+        delay = config.latency + (self.server.uniform(0, config.jitter) if config.jitter else 0)
+        if config.bandwidth and body:
+            delay += len(body) / config.bandwidth
+        if delay:
+            time.sleep(delay)
+        headers = {}
+        if self.server.window is not None:
+            allowed, remaining, reset_at = self.server.window.hit()
+            headers = self.rate_limit_headers(remaining, reset_at)
+            if not allowed:
+                headers['Retry-After'] = str(max(int(reset_at - time.time()) + 1, 1))
+                self._send(429, {'error': 'RateLimitExceeded', 'message': 'Rate Limit Exceeded'}, headers)
+                return None
+        if endpoint in self.faulty and config.error_rate and self.server.uniform(0, 1) < config.error_rate:
+            self._send(503, {'error': 'InternalServerError', 'message': 'Injected failure'}, headers)
+            return None
+        return headers
+
+
+class BlueskyHandler(_Handler):
+    """XRPC endpoints of a PDS that the atproto client uses to log in, upload and post"""
+    faulty = ('com.atproto.repo.uploadBlob', 'com.atproto.repo.createRecord')
+
+    def rate_limit_headers(self, remaining, reset_at):
+        return {
+            'RateLimit-Limit': str(self.server.window.limit),
+            'RateLimit-Remaining': str(remaining),
+            'RateLimit-Reset': str(int(reset_at)),
+            'RateLimit-Policy': f'{self.server.window.limit};w={int(self.server.window.seconds)}',
+        }
+
+    def _session(self) -> Dict[str, Any]:
+        now = int(time.time())
+        refresh_jwt = _jwt({'scope': 'com.atproto.refresh', 'sub': STUB_DID, 'iat': now,
+                            'exp': now + 90 * 86400, 'jti': str(next(self.server.ids))})
+        with self.server.counts_lock:
+            self.server.refresh_tokens.add(refresh_jwt)
+        return {
+            'did': STUB_DID,
+            'handle': STUB_HANDLE,
+            'active': True,
+            'accessJwt': _jwt({'scope': 'com.atproto.access', 'sub': STUB_DID, 'iat': now,
+                               'exp': now + self.server.config.session_lifetime}),
+            'refreshJwt': refresh_jwt,
+        }
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def _handle(self, method: str):
+        url = urlparse(self.path)
+        endpoint = url.path.rsplit('/', 1)[-1]
+        body = self._body() if method == 'POST' else b''
+        headers = self._admit(endpoint, body)
+        if headers is None:
+            return
+        if not url.path.startswith('/xrpc/'):
+            return self._send(404, {'error': 'NotFound'}, headers)
+        if endpoint == 'com.atproto.server.createSession':
+            return self._send(200, self._session(), headers)
+        if endpoint == 'com.atproto.server.refreshSession':
+            token = self.headers.get('Authorization', '').partition('Bearer ')[2]
+            with self.server.counts_lock:
+                valid = token in self.server.refresh_tokens
+                self.server.refresh_tokens.discard(token)
+            if not valid:
+                return self._send(400, {'error': 'ExpiredToken', 'message': 'Token has been revoked'}, headers)
+            return self._send(200, self._session(), headers)
+        if not self.headers.get('Authorization', '').startswith('Bearer '):
+            return self._send(401, {'error': 'AuthMissing', 'message': 'Authentication Required'}, headers)
+        if endpoint == 'com.atproto.server.getSession':
+            return self._send(200, {'did': STUB_DID, 'handle': STUB_HANDLE, 'active': True}, headers)
+        if endpoint == 'app.bsky.actor.getProfile':
+            return self._send(200, {'did': STUB_DID, 'handle': STUB_HANDLE, 'displayName': 'Benchmark'}, headers)
+        if endpoint == 'app.bsky.feed.getAuthorFeed':
+            query = parse_qs(url.query)
+            limit = int(query.get('limit', ['50'])[0])
+            cursor = query.get('cursor', [None])[0]
+            page = self.server.feed(int(cursor) if cursor else None, 0, limit)
+            feed = {'feed': [{'post': {
+                'uri': f'at://{STUB_DID}/app.bsky.feed.post/3stub{post_id:010d}',
+                'cid': _cid(str(post_id).encode()),
+                'author': {'did': STUB_DID, 'handle': STUB_HANDLE},
+                'record': {'$type': 'app.bsky.feed.post', 'text': post['text'],
+                           'createdAt': post['created_at'].isoformat(timespec='milliseconds')},
+                'indexedAt': post['created_at'].isoformat(timespec='milliseconds'),
+            }} for post_id, post in page]}
+            if len(page) == limit:
+                feed['cursor'] = str(page[-1][0])
+            return self._send(200, feed, headers)
+        if endpoint == 'app.bsky.actor.getProfiles':
+            # Every handle exists except those under .invalid
+            actors = parse_qs(url.query).get('actors', [])
+            return self._send(200, {'profiles': [
+                {'did': _stub_did(actor), 'handle': actor.lower()}
+                for actor in actors if not actor.lower().endswith('.invalid')
+            ]}, headers)
+        if endpoint == 'com.atproto.repo.uploadBlob':
+            return self._send(200, {'blob': {
+                '$type': 'blob',
+                'ref': {'$link': _cid(body)},
+                'mimeType': self.headers.get('Content-Type', 'application/octet-stream'),
+                'size': len(body),
+            }}, headers)
+        if endpoint == 'com.atproto.repo.createRecord':
+            request = json.loads(body or b'{}')
+            text = request.get('record', {}).get('text', '')
+            if text_length(text) > BLUESKY_MAX_GRAPHEMES:
+                message = f'Record/text must not be longer than {BLUESKY_MAX_GRAPHEMES} graphemes'
+                return self._send(400, {'error': 'InvalidRequest', 'message': message}, headers)
+            post_id = next(self.server.ids)
+            rkey = f'3stub{post_id:010d}'
+            if request.get('collection') == 'app.bsky.feed.post':
+                self.server.add_post(post_id, text)
+            return self._send(200, {
+                'uri': f"at://{request.get('repo', STUB_DID)}/{request.get('collection')}/{rkey}",
+                'cid': _cid(body),
+            }, headers)
+        self._send(501, {'error': 'MethodNotImplemented', 'message': f'{endpoint} is not stubbed'}, headers)
+
+
+class MastodonHandler(_Handler):
+    """Mastodon REST endpoints for uploading media (processed asynchronously) and posting statuses"""
+    faulty = ('media', 'statuses')
+
+    def rate_limit_headers(self, remaining, reset_at):
+        return {
+            'X-RateLimit-Limit': str(self.server.window.limit),
+            'X-RateLimit-Remaining': str(remaining),
+            'X-RateLimit-Reset': datetime.fromtimestamp(reset_at, timezone.utc).isoformat(timespec='seconds'),
+        }
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def _media_state(self, media_id: str) -> Tuple[int, Dict[str, Any]]:
+        media = self.server.media.get(media_id)
+        if media is None:
+            return 404, {'error': 'Record not found'}
+        ready = time.time() >= media['ready_at']
+        attachment = {
+            'id': media_id,
+            'type': 'image',
+            'url': f'{self.server.url}/media/{media_id}.jpg' if ready else None,
+            'preview_url': f'{self.server.url}/media/{media_id}_small.jpg',
+            'description': media['description'],
+            'blurhash': None,
+        }
+        return (200 if ready else 206), attachment
+
+    def _account(self) -> Dict[str, Any]:
+        return {'id': '1', 'username': 'bench', 'acct': 'bench', 'display_name': 'Benchmark',
+                'url': f'{self.server.url}/@bench'}
+
+    def _status(self, status_id: str, text: str, created_at: datetime) -> Dict[str, Any]:
+        return {
+            'id': status_id,
+            'uri': f'{self.server.url}/users/bench/statuses/{status_id}',
+            'url': f'{self.server.url}/@bench/{status_id}',
+            'created_at': created_at.isoformat(timespec='milliseconds'),
+            'account': self._account(),
+            'content': '<p>' + html.escape(text).replace('\n', '<br />') + '</p>',
+            'visibility': 'public',
+            'in_reply_to_id': None,
+            'reblog': None,
+            'media_attachments': [],
+        }
+
+    def _handle(self, method: str):
+        url = urlparse(self.path)
+        path = url.path.rstrip('/')
+        parts = path.strip('/').split('/')
+        if 'media' in parts:
+            endpoint = 'media' if method == 'POST' else 'media_status'
+        else:
+            endpoint = parts[-1]
+        body = self._body() if method == 'POST' else b''
+        headers = self._admit(endpoint, body)
+        if headers is None:
+            return
+        if path in ('/api/v1/instance', '/api/v2/instance'):
+            return self._send(200, {'uri': '127.0.0.1', 'domain': '127.0.0.1', 'title': 'Stub',
+                                    'version': '4.2.0'}, headers)
+        if not self.headers.get('Authorization', '').startswith('Bearer '):
+            return self._send(401, {'error': 'The access token is invalid'}, headers)
+        if method == 'POST' and path in ('/api/v1/media', '/api/v2/media'):
+            media_id = str(next(self.server.ids))
+            fields = _multipart_fields(self.headers.get('Content-Type', ''), body)
+            self.server.media[media_id] = {
+                'ready_at': time.time() + (self.server.config.media_processing if path.endswith('v2/media') else 0),
+                'description': fields.get('description'),
+            }
+            status, attachment = self._media_state(media_id)
+            # The v2 endpoint answers 202 while the file is still being processed
+            return self._send(202 if status == 206 else 200, attachment, headers)
+        if method == 'GET' and len(parts) == 4 and parts[:3] == ['api', 'v1', 'media']:
+            status, attachment = self._media_state(parts[3])
+            return self._send(status, attachment, headers)
+        if method == 'GET' and path == '/api/v1/accounts/verify_credentials':
+            return self._send(200, self._account(), headers)
+        if method == 'GET' and len(parts) == 5 and parts[:3] == ['api', 'v1', 'accounts'] and parts[4] == 'statuses':
+            query = parse_qs(url.query)
+            max_id = query.get('max_id', [None])[0]
+            since_id = int(query.get('since_id', ['0'])[0])
+            limit = min(int(query.get('limit', ['20'])[0]), 40)
+            page = self.server.feed(int(max_id) if max_id else None, since_id, limit)
+            return self._send(200, [self._status(str(post_id), post['text'], post['created_at'])
+                                    for post_id, post in page], headers)
+        if method == 'POST' and path == '/api/v1/statuses':
+            key = self.headers.get('Idempotency-Key')
+            if key and key in self.server.idempotent:
+                # Mastodon answers a repeated key with the status it created the first time
+                return self._send(200, self.server.idempotent[key], headers)
+            fields = _form_fields(self.headers.get('Content-Type', ''), body)
+            media_ids = fields.get('media_ids[]', []) + fields.get('media_ids', [])
+            attachments = []
+            for media_id in media_ids:
+                status, attachment = self._media_state(str(media_id))
+                if status != 200:
+                    return self._send(422, {'error': 'Cannot attach files that have not finished '
+                                                     'processing. Try again in a moment!'}, headers)
+                attachments.append(attachment)
+            text = (fields.get('status') or [''])[0]
+            if len(text) > MASTODON_MAX_CHARACTERS:
+                return self._send(422, {'error': 'Validation failed: Text character limit of '
+                                                 f'{MASTODON_MAX_CHARACTERS} exceeded'}, headers)
+            status_id = str(next(self.server.ids))
+            self.server.add_post(int(status_id), text)
+            status = self._status(status_id, text, datetime.now(timezone.utc))
+            status.update(in_reply_to_id=(fields.get('in_reply_to_id') or [None])[0],
+                          media_attachments=attachments)
+            if key:
+                self.server.idempotent[key] = status
+            return self._send(200, status, headers)
+        self._send(404, {'error': 'Record not found'}, headers)
+
+
+def _form_fields(content_type: str, body: bytes) -> Dict[str, list]:
+    """Fields of a JSON, urlencoded or multipart request body, each as a list of values"""
+    if content_type.startswith('application/json'):
+        data = json.loads(body or b'{}')
+        return {key: value if isinstance(value, list) else [value] for key, value in data.items()}
+    if content_type.startswith('multipart/form-data'):
+        return {key: [value] for key, value in _multipart_fields(content_type, body).items()}
+    return parse_qs(body.decode())
+
+
+def _multipart_fields(content_type: str, body: bytes) -> Dict[str, str]:
+    """Text fields of a multipart body (file parts are skipped)"""
+    boundary = content_type.partition('boundary=')[2].strip('"')
+    fields = {}
+    if not boundary:
+        return fields
+    for part in body.split(b'--' + boundary.encode()):
+        head, _, value = part.partition(b'\r\n\r\n')
+        if b'filename=' in head or b'name="' not in head:
+            continue
+        name = head.split(b'name="', 1)[1].split(b'"', 1)[0].decode()
+        fields[name] = value.rstrip(b'\r\n').decode(errors='replace')
+    return fields
+
+
+class PageHandler(_Handler):
+    """Article pages with OpenGraph tags, the card images they point to, and feeds of them"""
+
+    def rate_limit_headers(self, remaining, reset_at):
+        return {}
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        headers = self._admit('page', b'')
+        if headers is None:
+            return
+        if path.startswith('/article/'):
+            number = path.rsplit('/', 1)[-1]
+            base = self.server.url
+            page = (
+                f'<!doctype html><html><head><title>Article {number}</title>'
+                f'<meta property="og:title" content="Article {number}">'
+                f'<meta property="og:description" content="Benchmark article number {number}">'
+                f'<meta property="og:image" content="{base}/card/{number}.jpg">'
+                f'</head><body>{"<p>Lorem ipsum dolor sit amet.</p>" * 200}</body></html>'
+            ).encode()
+            return self._send(200, page, headers, 'text/html; charset=utf-8')
+        if path.startswith('/card/'):
+            return self._send(200, card_image(path), headers, 'image/jpeg')
+        if path.startswith('/feed/'):
+            # /feed/<n>: the 20 newest of articles 1 to n, validated by n like a real blog's feed
+            newest = int(path.rsplit('/', 1)[-1])
+            etag = f'"feed-{newest}"'
+            headers['ETag'] = etag
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', '0')
+                return self.end_headers()
+            items = ''.join(
+                f'<item><title>Article {number}</title><link>{self.server.url}/article/{number}</link>'
+                f'<guid isPermaLink="false">article-{number}</guid></item>'
+                for number in range(newest, max(newest - 20, 0), -1)
+            )
+            feed = (f'<?xml version="1.0" encoding="utf-8"?><rss version="2.0"><channel>'
+                    f'<title>Benchmark blog</title><link>{self.server.url}/</link>{items}</channel></rss>')
+            return self._send(200, feed.encode(), headers, 'application/rss+xml')
+        self._send(404, b'not found', headers, 'text/plain')
+
+
+_card_images: Dict[str, bytes] = {}
+
+
+def card_image(key: str, size: Tuple[int, int] = (1600, 900)) -> bytes:
+    """A photo-sized JPEG that differs per key, so every card is processed afresh"""
+    if key not in _card_images:
+        from PIL import Image
+        rng = random.Random(key)
+        small = Image.frombytes('RGB', (size[0] // 16, size[1] // 16),
+                                rng.randbytes(size[0] // 16 * size[1] // 16 * 3))
+        buffer = io.BytesIO()
+        small.resize(size, Image.Resampling.BILINEAR).save(buffer, format='JPEG', quality=92)
+        _card_images[key] = buffer.getvalue()
+    return _card_images[key]
+
+
+class StubServers:
+    """The Bluesky, Mastodon and article page stand-ins, each on its own local port"""
+
+    def __init__(self, config: Optional[StubConfig] = None):
+        self.config = config or StubConfig()
+        self.bluesky = _StubServer(BlueskyHandler, self.config, 1)
+        self.mastodon = _StubServer(MastodonHandler, self.config, 2)
+        self.pages = _StubServer(PageHandler, StubConfig(latency=self.config.latency), 3)
+        self._threads = []
+
+    def start(self) -> 'StubServers':
+        for server in (self.bluesky, self.mastodon, self.pages):
+            thread = threading.Thread(target=server.serve_forever, name=f'stub-{server.url}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        for server in (self.bluesky, self.mastodon, self.pages):
+            server.shutdown()
+            server.server_close()
+        self._threads = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def environ(self) -> Dict[str, str]:
+        """Environment variables that point SocialMediaPoster at the stand-ins"""
+        return {
+            'BLUESKY_HANDLE': STUB_HANDLE,
+            'BLUESKY_PASSWORD': 'stub-password',
+            'BLUESKY_BASE_URL': self.bluesky.url,
+            'MASTODON_ACCESS_TOKEN': 'stub-token',
+            'MASTODON_API_BASE_URL': self.mastodon.url,
+        }
+
+    def article_url(self, number: int) -> str:
+        """URL of an article page whose card image is unique to number"""
+        return f'{self.pages.url}/article/{number}'
+
+    def feed_url(self, newest: int) -> str:
+        """URL of an RSS feed whose newest entry is article_url(newest)"""
+        return f'{self.pages.url}/feed/{newest}'
+
+    def counts(self) -> Dict[str, Dict[str, int]]:
+        """Requests served so far, by server and endpoint"""
+        return {'bluesky': dict(self.bluesky.counts), 'mastodon': dict(self.mastodon.counts),
+                'pages': dict(self.pages.counts)}
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--rate-limit', type=int, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--media-processing', type=float, default=0.5)
+    args = parser.parse_args()
+
+    config = StubConfig(latency=args.latency, rate_limit=args.rate_limit,
+                        error_rate=args.error_rate, media_processing=args.media_processing)
+    with StubServers(config) as servers:
+        for key, value in servers.environ().items():
+            print(f'{key}={value}')
+        print(f'# Articles at {servers.article_url(1)}; Ctrl-C to stop')
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
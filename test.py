@@ -1,12 +1,12 @@
 import sys
 from PIL import Image 
-from atproto import Client, client_utils, models
+from atproto import client_utils, models
+from session_store import login_bluesky
 
 
 def login(handle, password):
-    client = Client()
-    profile = client.login(handle, password)
-    print('Logged in as ', profile.display_name)
+    client = login_bluesky(handle, password)
+    print('Logged in as ', client.me.display_name)
     return client
 
 def post(client, message, anchortext='', link=''):
@@ -1,5 +1,4 @@
 from social_media import SocialMediaPoster
-import time
 
 def main():
     # Initialize the poster
@@ -17,9 +16,6 @@ def main():
     except Exception as e:
         print(f"Error posting image: {e}")
     
-    # Wait a bit between posts to avoid rate limits
-    time.sleep(5)
-    
     # Test 2: Link post
     print("\nTest 2: Posting link...")
     try:
@@ -31,9 +27,6 @@ def main():
     except Exception as e:
         print(f"Error posting link: {e}")
     
-    # Wait a bit between posts
-    time.sleep(5)
-    
     # Test 3: Text-only post
     print("\nTest 3: Posting text only...")
     try:
@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the top of the repository, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_servers import StubServers, StubConfig  # noqa: E402
+
+
+@pytest.fixture
+def stubs(monkeypatch, tmp_path):
+    """Stand-in Bluesky, Mastodon and page servers, with the environment pointing at them
+
+    The working directory is a fresh temporary one, so session, cache and
+    store files from one test never leak into another.
+    """
+    monkeypatch.chdir(tmp_path)
+    with StubServers(StubConfig()) as servers:
+        for key, value in servers.environ().items():
+            monkeypatch.setenv(key, value)
+        yield servers
+
+
+@pytest.fixture
+def poster(stubs, tmp_path):
+    """A SocialMediaPoster for the stand-ins, with its own idempotency store and link preview cache"""
+    pytest.importorskip('mastodon')
+    from idempotency import IdempotencyStore
+    from link_preview import LinkPreviewCache
+    from social_media import SocialMediaPoster
+
+    with SocialMediaPoster(idempotency_store=IdempotencyStore(str(tmp_path / 'idempotency.sqlite3')),
+                           link_preview_cache=LinkPreviewCache(str(tmp_path / 'previews.sqlite3'))) as poster:
+        yield poster
@@ -0,0 +1,80 @@
+import functools
+
+import pytest
+
+from archive import PostArchive, sync_account, newer
+from stub_servers import StubServers, StubConfig
+
+pytest.importorskip('atproto')
+
+FEED_SIZE = 150
+
+
+@pytest.fixture
+def stubs(monkeypatch, tmp_path):
+    """The stand-ins, with a Bluesky account that already has FEED_SIZE posts"""
+    monkeypatch.chdir(tmp_path)
+    with StubServers(StubConfig(feed_size=FEED_SIZE)) as servers:
+        for key, value in servers.environ().items():
+            monkeypatch.setenv(key, value)
+        yield servers
+
+
+def _rkey(post_id):
+    return f'3stub{post_id:010d}'
+
+
+def _add_posts(stubs, first, last):
+    for post_id in range(first, last + 1):
+        stubs.bluesky.add_post(post_id, f'New post {post_id}')
+
+
+def test_newer_orders_mastodon_ids_and_record_keys():
+    assert newer('100', '99')
+    assert not newer('99', '100')
+    assert newer(_rkey(151), _rkey(150))
+
+
+def test_incremental_sync_stops_at_the_newest_archived_post(poster, stubs, tmp_path):
+    adapter = poster._adapter('bluesky')
+    archive = PostArchive(str(tmp_path / 'archive.sqlite3'))
+
+    report = sync_account(adapter, archive, poster.rate_limiter)
+    assert report.complete and report.new == FEED_SIZE
+    assert archive.state('bluesky', adapter.rate_limit_key) == (_rkey(FEED_SIZE), None, True)
+
+    _add_posts(stubs, FEED_SIZE + 1, FEED_SIZE + 5)
+    report = sync_account(adapter, archive, poster.rate_limiter)
+    # One page reaches the newest archived post, and nothing older is fetched again
+    assert (report.pages, report.new) == (1, 5)
+    assert archive.state('bluesky', adapter.rate_limit_key)[0] == _rkey(FEED_SIZE + 5)
+    assert archive.count('bluesky') == FEED_SIZE + 5
+
+
+def test_interrupted_incremental_sync_fetches_the_gap_again(poster, stubs, tmp_path, monkeypatch):
+    adapter = poster._adapter('bluesky')
+    archive = PostArchive(str(tmp_path / 'archive.sqlite3'))
+    sync_account(adapter, archive, poster.rate_limiter)
+
+    # More new posts than fit on one page, and the second page fails
+    _add_posts(stubs, FEED_SIZE + 1, FEED_SIZE + 150)
+    feed_page = adapter.feed_page
+    calls = []
+
+    @functools.wraps(feed_page)
+    def failing(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 2:
+            raise ConnectionError('connection reset')
+        return feed_page(*args, **kwargs)
+
+    monkeypatch.setattr(adapter, 'feed_page', failing)
+    with pytest.raises(ConnectionError):
+        sync_account(adapter, archive, poster.rate_limiter)
+    # newest stays put, so the posts below the stored page aren't skipped
+    assert archive.state('bluesky', adapter.rate_limit_key)[0] == _rkey(FEED_SIZE)
+
+    report = sync_account(adapter, archive, poster.rate_limiter)
+    assert report.new == 150
+    assert archive.state('bluesky', adapter.rate_limit_key)[0] == _rkey(FEED_SIZE + 150)
+    assert archive.count('bluesky') == FEED_SIZE + 150
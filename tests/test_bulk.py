@@ -0,0 +1,46 @@
+import json
+import functools
+
+from bulk import run_batch, read_progress
+
+
+def _write_posts(path, texts):
+    with open(path, 'w') as f:
+        for number, text in enumerate(texts, start=1):
+            f.write(json.dumps({'text': text, 'platforms': ['mastodon'],
+                                'idempotency_key': f'bulk-{number}'}) + '\n')
+
+
+def test_rerun_skips_posted_lines_and_retries_failed_ones(poster, stubs, tmp_path, monkeypatch):
+    input_path, output_path = str(tmp_path / 'posts.jsonl'), str(tmp_path / 'results.jsonl')
+    _write_posts(input_path, ['First', 'Second', 'Third'])
+
+    adapter = poster._adapter('mastodon')
+    post_text = adapter.post_text
+
+    @functools.wraps(post_text)
+    def failing(text, *args, **kwargs):
+        if text == 'Second':
+            raise ConnectionError('connection reset')
+        return post_text(text, *args, **kwargs)
+
+    monkeypatch.setattr(adapter, 'post_text', failing)
+    report = run_batch(poster, input_path, output_path, concurrency=2)
+    assert (report.posted, report.failed, report.skipped) == (2, 1, 0)
+    done, reached = read_progress(output_path)
+    assert done == {1, 3} and reached == {2: set()}
+
+    monkeypatch.setattr(adapter, 'post_text', post_text)
+    report = run_batch(poster, input_path, output_path, concurrency=2)
+    assert (report.posted, report.failed, report.skipped) == (1, 0, 2)
+    assert read_progress(output_path) == ({1, 2, 3}, {})
+    assert sorted(post['text'] for post in stubs.mastodon.posts.values()) == ['First', 'Second', 'Third']
+
+
+def test_line_cut_short_by_a_crash_is_posted_again(tmp_path):
+    output_path = str(tmp_path / 'results.jsonl')
+    with open(output_path, 'w') as f:
+        f.write(json.dumps({'line': 1, 'results': {'mastodon': {'id': '1'}}}) + '\n')
+        f.write(json.dumps({'line': 2, 'results': {'mastodon': {'id': '2'}, 'bluesky': {'error': 'x'}}}) + '\n')
+        f.write('{"line": 3, "resu')
+    assert read_progress(output_path) == ({1}, {2: {'mastodon'}})
@@ -0,0 +1,62 @@
+import pytest
+
+from feed_watcher import FeedWatcher, FeedStore, MAX_POST_ATTEMPTS
+
+
+class RecordingPoster:
+    """Stands in for SocialMediaPoster: records post_link calls, failing while `failing` is set"""
+
+    def __init__(self):
+        self.failing = False
+        self.posted = []
+
+    def post_link(self, text, url, platforms=None, idempotency_key=None):
+        if self.failing:
+            return {'mastodon': {'error': 'connection reset'}}
+        self.posted.append(url)
+        return {'mastodon': {'id': str(len(self.posted))}}
+
+
+@pytest.fixture
+def watcher(stubs, tmp_path, monkeypatch):
+    watcher = FeedWatcher(RecordingPoster(), FeedStore(str(tmp_path / 'feeds.sqlite3')), post_existing=True)
+    fetched = watcher.fetched = []
+    fetch = watcher._fetch
+
+    def recording_fetch(state):
+        entries = fetch(state)
+        fetched.append(entries)
+        return entries
+
+    monkeypatch.setattr(watcher, '_fetch', recording_fetch)
+    return watcher
+
+
+def test_failed_entries_are_retried_when_the_feed_is_unchanged(watcher, stubs):
+    url = stubs.feed_url(3)
+    watcher.add_feed(url)
+
+    watcher.poster.failing = True
+    assert watcher.poll(url) == []
+    assert len(watcher.fetched[-1]) == 3
+
+    watcher.poster.failing = False
+    posted = watcher.poll(url)
+    # The feed answered 304, and the entries came from the store, oldest first
+    assert watcher.fetched[-1] is None
+    assert [entry.link for entry in posted] == [stubs.article_url(n) for n in (1, 2, 3)]
+    assert watcher.poster.posted == [stubs.article_url(n) for n in (1, 2, 3)]
+
+    assert watcher.poll(url) == []
+    assert len(watcher.poster.posted) == 3
+
+
+def test_entry_is_given_up_after_max_attempts(watcher, stubs):
+    url = stubs.feed_url(1)
+    watcher.add_feed(url)
+    watcher.poster.failing = True
+    for _ in range(MAX_POST_ATTEMPTS):
+        watcher.poll(url)
+    watcher.poster.failing = False
+    assert watcher.poll(url) == []
+    assert watcher.store.unposted(url) == []
@@ -0,0 +1,73 @@
+import pytest
+
+from idempotency import IdempotencyStore, PostInProgress, PreviousResult
+
+
+@pytest.fixture
+def store(tmp_path):
+    return IdempotencyStore(str(tmp_path / 'idempotency.sqlite3'))
+
+
+def _status(store, key, platform):
+    row = store._db.execute('SELECT status FROM posts WHERE key = ? AND platform = ?', (key, platform)).fetchone()
+    return row[0] if row else None
+
+
+def test_pending_post_blocks_a_second_attempt(store):
+    assert store.begin('k', 'mastodon') is None
+    assert _status(store, 'k', 'mastodon') == 'pending'
+    with pytest.raises(PostInProgress):
+        store.begin('k', 'mastodon')
+    # Each platform is tracked on its own
+    assert store.begin('k', 'bluesky') is None
+
+
+def test_stale_pending_post_is_taken_over(tmp_path):
+    store = IdempotencyStore(str(tmp_path / 'idempotency.sqlite3'), pending_timeout=0)
+    store.begin('k', 'mastodon')
+    assert store.begin('k', 'mastodon') is None
+
+
+def test_done_post_returns_its_result(store):
+    store.begin('k', 'mastodon')
+    store.complete('k', 'mastodon', {'id': '1'})
+    assert _status(store, 'k', 'mastodon') == 'done'
+    assert store.begin('k', 'mastodon') == {'id': '1'}
+    assert store.get('k', 'mastodon') == {'id': '1'}
+
+
+def test_done_post_older_than_max_age_is_posted_again(store):
+    store.begin('k', 'mastodon')
+    store.complete('k', 'mastodon', {'id': '1'})
+    assert store.begin('k', 'mastodon', max_age=-1) is None
+    assert _status(store, 'k', 'mastodon') == 'pending'
+
+
+def test_abandoned_post_without_progress_is_forgotten(store):
+    store.begin('k', 'mastodon')
+    store.abandon('k', 'mastodon')
+    assert _status(store, 'k', 'mastodon') is None
+    assert store.begin('k', 'mastodon') is None
+
+
+def test_abandoned_post_keeps_its_progress_for_the_next_attempt(store):
+    store.begin('k', 'mastodon')
+    store.save_progress('k', 'mastodon', {'thread': [{'id': '1'}]})
+    store.abandon('k', 'mastodon')
+    assert _status(store, 'k', 'mastodon') == 'partial'
+    # Progress is only read back by the attempt that picks it up
+    assert store.progress('k', 'mastodon') is None
+
+    assert store.begin('k', 'mastodon') is None
+    assert store.progress('k', 'mastodon') == {'thread': [{'id': '1'}]}
+    store.complete('k', 'mastodon', {'thread': [{'id': '1'}, {'id': '2'}]})
+    assert store.progress('k', 'mastodon') is None
+
+
+def test_repeated_key_is_not_posted_again(poster, stubs):
+    first = poster.post_text('Hello', platforms=['mastodon'], idempotency_key='hello')
+    second = poster.post_text('Hello', platforms=['mastodon'], idempotency_key='hello')
+    assert not isinstance(first['mastodon'], PreviousResult)
+    assert isinstance(second['mastodon'], PreviousResult)
+    assert second['mastodon']['id'] == str(first['mastodon']['id'])
+    assert stubs.counts()['mastodon']['statuses'] == 1
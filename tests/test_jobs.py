@@ -0,0 +1,57 @@
+import time
+
+import pytest
+
+from jobs import JobQueue
+
+
+@pytest.fixture
+def queue_path(tmp_path):
+    return str(tmp_path / 'jobs.sqlite3')
+
+
+def test_claimed_job_is_not_handed_out_twice(queue_path):
+    queue = JobQueue(queue_path)
+    job_id = queue.enqueue({'text': 'Hello'})
+    job = queue.claim()
+    assert job.id == job_id and job.attempts == 1
+    assert queue.claim() is None
+    assert queue.get(job_id)['status'] == 'running'
+
+
+def test_expired_lease_hands_the_job_out_again(queue_path):
+    queue = JobQueue(queue_path, lease=0.2)
+    job_id = queue.enqueue({'text': 'Hello'}, [b'image'])
+    queue.claim()
+    time.sleep(0.3)
+    # As a second worker would after the first crashed
+    job = JobQueue(queue_path, lease=0.2).claim()
+    assert job.id == job_id
+    assert job.attempts == 2
+    assert job.images == [b'image']
+
+
+def test_renewed_lease_keeps_the_job(queue_path):
+    queue = JobQueue(queue_path, lease=0.3)
+    job_id = queue.enqueue({'text': 'Hello'})
+    queue.claim()
+    for _ in range(3):
+        time.sleep(0.15)
+        assert queue.renew(job_id)
+        assert queue.claim() is None
+    queue.complete(job_id, {}, {})
+    # A finished job has no lease left to renew
+    assert not queue.renew(job_id)
+
+
+def test_job_is_failed_after_max_attempts(queue_path):
+    queue = JobQueue(queue_path, lease=0.05, max_attempts=2)
+    job_id = queue.enqueue({'text': 'Hello'})
+    assert queue.claim().attempts == 1
+    time.sleep(0.1)
+    assert queue.claim().attempts == 2
+    time.sleep(0.1)
+    assert queue.claim() is None
+    job = queue.get(job_id)
+    assert job['status'] == 'failed'
+    assert job['error'] == 'Abandoned after 2 attempts'
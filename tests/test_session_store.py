@@ -0,0 +1,72 @@
+import threading
+
+import pytest
+
+from session_store import SessionStore, login_bluesky
+from stub_servers import StubServers, StubConfig, STUB_HANDLE
+
+atproto = pytest.importorskip('atproto')
+
+
+@pytest.fixture
+def short_sessions(monkeypatch, tmp_path):
+    """Stub servers whose access tokens are always due for a refresh"""
+    monkeypatch.chdir(tmp_path)
+    with StubServers(StubConfig(session_lifetime=60)) as servers:
+        yield servers
+
+
+def _client(servers):
+    return atproto.Client(base_url=servers.bluesky.url)
+
+
+def _in_thread(fn, timeout=10):
+    """Run fn in a thread and fail the test if it doesn't return within timeout"""
+    outcome = {}
+
+    def run():
+        try:
+            outcome['result'] = fn()
+        except Exception as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), f"still blocked after {timeout}s"
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['result']
+
+
+def test_second_login_resumes_stored_session(short_sessions, tmp_path):
+    store = SessionStore(str(tmp_path / 'sessions.json'))
+    login_bluesky(STUB_HANDLE, 'password', store, _client(short_sessions))
+    login_bluesky(STUB_HANDLE, 'password', store, _client(short_sessions))
+    assert short_sessions.counts()['bluesky']['com.atproto.server.createSession'] == 1
+
+
+def test_workers_share_refreshes(short_sessions, tmp_path):
+    store = SessionStore(str(tmp_path / 'sessions.json'))
+    first = login_bluesky(STUB_HANDLE, 'password', store, _client(short_sessions))
+    second = login_bluesky(STUB_HANDLE, 'password', store, _client(short_sessions))
+    # Refresh tokens are single use: without coordination the second worker's refresh would fail
+    for _ in range(3):
+        first.get_profile(STUB_HANDLE)
+        second.get_profile(STUB_HANDLE)
+    counts = short_sessions.counts()['bluesky']
+    assert counts['com.atproto.server.createSession'] == 1
+    assert counts['com.atproto.server.refreshSession'] >= 3
+
+
+def test_failed_refresh_logs_in_with_password(short_sessions, tmp_path):
+    store = SessionStore(str(tmp_path / 'sessions.json'))
+    client = login_bluesky(STUB_HANDLE, 'password', store, _client(short_sessions))
+    # The server forgets every refresh token, as after a password change or a revoked session
+    short_sessions.bluesky.refresh_tokens.clear()
+
+    profile = _in_thread(lambda: client.get_profile(STUB_HANDLE))
+
+    assert profile.handle == STUB_HANDLE
+    assert short_sessions.counts()['bluesky']['com.atproto.server.createSession'] == 2
+    assert store.load(STUB_HANDLE) == client.export_session_string()
@@ -0,0 +1,45 @@
+import functools
+
+from threads import split_text
+
+TEXT = ' '.join(f'This is sentence number {number} of a post far too long for one toot.'
+                for number in range(1, 31))
+
+
+def _fail_reply(monkeypatch, adapter, on_call):
+    """Make adapter's on_call-th reply (counting from 1) fail once"""
+    calls = []
+    post_reply = adapter.post_reply
+
+    @functools.wraps(post_reply)
+    def failing(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == on_call:
+            raise ConnectionError('connection reset')
+        return post_reply(*args, **kwargs)
+
+    monkeypatch.setattr(adapter, 'post_reply', failing)
+
+
+def test_failed_thread_resumes_where_it_stopped(poster, stubs, monkeypatch):
+    adapter = poster._adapter('mastodon')
+    parts = split_text(TEXT, adapter.max_text_length, adapter.counts_graphemes)
+    assert len(parts) >= 4
+    _fail_reply(monkeypatch, adapter, on_call=2)
+
+    first = poster.post_text(TEXT, platforms=['mastodon'], idempotency_key='thread', thread=True)
+    assert 'error' in first['mastodon']
+    # The opening post and the first reply went out
+    assert stubs.counts()['mastodon']['statuses'] == 2
+
+    second = poster.post_text(TEXT, platforms=['mastodon'], idempotency_key='thread', thread=True)
+    thread = second['mastodon']
+    assert len(thread) == len(parts)
+    assert stubs.counts()['mastodon']['statuses'] == len(parts)
+    assert [stubs.mastodon.posts[int(post['id'])]['text'] for post in thread] == parts
+    # The resumed replies carry on the chain from the last post made
+    assert str(thread[2]['in_reply_to_id']) == str(thread[1]['id'])
+
+    third = poster.post_text(TEXT, platforms=['mastodon'], idempotency_key='thread', thread=True)
+    assert len(third['mastodon']['thread']) == len(parts)
+    assert stubs.counts()['mastodon']['statuses'] == len(parts)
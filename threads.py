@@ -0,0 +1,134 @@
+"""Splitting text that is too long for one post into a thread
+
+Limits are counted the way the platform counts them: Bluesky in graphemes
+(what a reader sees as one character, e.g. an emoji with a skin tone),
+Mastodon in code points. Either way a post never ends in the middle of a
+grapheme, a word, or a link, mention or hashtag. The text is scanned once,
+and each cut is then chosen from precomputed break positions.
+"""
+import unicodedata
+from typing import List
+
+from facets import find_facets
+
+ZWJ = '\u200d'
+# Sentences end with these; a cut after one reads better than one mid-sentence
+SENTENCE_ENDS = '.!?…。！？'
+
+
+def _extends(char: str, previous: str) -> bool:
+    """Whether char belongs to the same grapheme as the character before it"""
+    code = ord(char)
+    return (
+        previous == ZWJ or char == ZWJ
+        or (previous == '\r' and char == '\n')
+        or unicodedata.category(char) in ('Mn', 'Me', 'Mc')
+        or 0xFE00 <= code <= 0xFE0F  # Variation selectors
+        or 0x1F3FB <= code <= 0x1F3FF  # Skin tones
+        or 0xE0020 <= code <= 0xE007F  # Tags in subdivision flags
+        or 0x1160 <= code <= 0x11FF  # Hangul vowel and final jamo
+    )
+
+
+def grapheme_bounds(text: str) -> List[int]:
+    """Index in text of the start of each grapheme, followed by len(text)
+
+    This covers combining marks, emoji sequences and flags; it is the
+    extended grapheme cluster algorithm minus rarely seen scripts' rules.
+    """
+    if text.isascii():
+        return [index for index in range(len(text) + 1)
+                if not (0 < index < len(text) and text[index - 1] == '\r' and text[index] == '\n')]
+    bounds = [0] if text else []
+    regional = 0
+    for index in range(1, len(text)):
+        char = text[index]
+        if 0x1F1E6 <= ord(char) <= 0x1F1FF:
+            # Flags are pairs of regional indicators
+            regional = regional + 1 if 0x1F1E6 <= ord(text[index - 1]) <= 0x1F1FF else 0
+            if regional % 2:
+                continue
+        elif _extends(char, text[index - 1]):
+            continue
+        bounds.append(index)
+    bounds.append(len(text))
+    return bounds
+
+
+def text_length(text: str, count_graphemes: bool = True) -> int:
+    """Length of text as a platform counts it"""
+    return len(grapheme_bounds(text)) - 1 if count_graphemes else len(text)
+
+
+def split_text(text: str, limit: int, count_graphemes: bool = True) -> List[str]:
+    """Split text into posts of at most limit graphemes (or code points)
+
+    Each post ends at the last sentence end that keeps it at least half
+    full, or else at the last space; a word longer than a whole post is cut
+    where it has to be, though never inside a link, mention or hashtag that
+    fits in a post of its own. Whitespace around cuts is dropped.
+    """
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+    text = text.strip()
+    bounds = grapheme_bounds(text)
+    count = len(bounds) - 1
+    if (count if count_graphemes else len(text)) <= limit:
+        return [text] if text else []
+
+    # For each grapheme: the last space at or before it, and the last space
+    # ending a sentence, by grapheme index (-1 for none)
+    last_space = [-1] * (count + 1)
+    last_sentence = [-1] * (count + 1)
+    # For each grapheme: the start of the link, mention or tag it is inside
+    # of (not counting the first grapheme of one), else -1
+    inside = [-1] * (count + 1)
+    facets = iter(find_facets(text))
+    facet = next(facets, None)
+    facet_start = -1
+    for index in range(count):
+        start = bounds[index]
+        cluster = text[start:bounds[index + 1]]
+        last_space[index] = last_space[index - 1] if index else -1
+        last_sentence[index] = last_sentence[index - 1] if index else -1
+        if cluster.isspace():
+            last_space[index] = index
+            if '\n' in cluster or (start and text[start - 1] in SENTENCE_ENDS):
+                last_sentence[index] = index
+        while facet is not None and facet.end <= start:
+            facet = next(facets, None)
+        if facet is not None and facet.start <= start:
+            if facet.start == start:
+                facet_start = index
+            elif facet_start >= 0:
+                inside[index] = facet_start
+    last_space[count] = last_space[count - 1]
+    last_sentence[count] = last_sentence[count - 1]
+
+    posts = []
+    first = 0
+    while True:
+        # The furthest grapheme the post can end before
+        if count_graphemes:
+            end = min(first + limit, count)
+        else:
+            end = first
+            while end < count and bounds[end + 1] - bounds[first] <= limit:
+                end += 1
+        if end == count:
+            posts.append(text[bounds[first]:])
+            return posts
+        if last_sentence[end] - first > (end - first) // 2:
+            cut = last_sentence[end]
+        elif last_space[end] > first:
+            cut = last_space[end]
+        elif inside[end] > first:
+            cut = inside[end]
+        else:
+            cut = max(end, first + 1)
+        posts.append(text[bounds[first]:bounds[cut]].rstrip())
+        first = cut
+        while first < count and text[bounds[first]:bounds[first + 1]].isspace():
+            first += 1
+        if first == count:
+            return posts